@@ -0,0 +1,60 @@
+import argparse
+import json
+import sys
+
+# Сравнение двух результатов run.py (например, до и после изменения).
+# Для каждой метрики печатается относительное изменение; изменение в худшую
+# сторону больше порога считается регрессией, и скрипт завершается с кодом 1.
+
+# Метрики, у которых больше - лучше; у остальных (время, задержки, память) лучше меньше
+HIGHER_IS_BETTER = {"docs_per_sec", "mb_per_sec", "qps"}
+COMPARED_METRICS = ["seconds", "docs_per_sec", "mb_per_sec", "peak_mb",
+                    "qps", "mean_ms", "p50_ms", "p95_ms", "p99_ms", "query_us", "cold_start_ms"]
+
+
+def load(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def compare(baseline, current, threshold):
+    """
+    Возвращает строки сравнения (этап, метрика, было, стало, изменение, регрессия ли).
+    """
+    rows = []
+    for stage, base_result in baseline["stages"].items():
+        result = current["stages"].get(stage)
+        if result is None or "error" in result or "error" in base_result:
+            continue
+        for metric in COMPARED_METRICS:
+            if metric not in base_result or metric not in result or not base_result[metric]:
+                continue
+            change = (result[metric] - base_result[metric]) / base_result[metric]
+            worse = -change if metric in HIGHER_IS_BETTER else change
+            rows.append((stage, metric, base_result[metric], result[metric], change, worse > threshold))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение результатов бенчмарка")
+    parser.add_argument("baseline")
+    parser.add_argument("current")
+    parser.add_argument("--threshold", type=float, default=0.1, help="допустимое ухудшение (0.1 = 10%%)")
+    args = parser.parse_args()
+
+    baseline, current = load(args.baseline), load(args.current)
+    if baseline.get("params") != current.get("params"):
+        print("Внимание: прогоны выполнены с разными параметрами")
+    print(f"{baseline['commit']} -> {current['commit']}")
+
+    rows = compare(baseline, current, args.threshold)
+    for stage, metric, before, after, change, regression in rows:
+        marker = "  РЕГРЕССИЯ" if regression else ""
+        print(f"{stage:16} {metric:13} {before:12.3f} {after:12.3f} {change:+8.1%}{marker}")
+    regressions = sum(1 for row in rows if row[-1])
+    print(f"Регрессий: {regressions}")
+    sys.exit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
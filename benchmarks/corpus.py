@@ -0,0 +1,172 @@
+import argparse
+import bisect
+import itertools
+import json
+import math
+import os
+import random
+
+# Синтетический корпус для бенчмарков: HTML-страницы в формате краулера
+# (page_N.txt), слова которых распределены по закону Ципфа, и журнал запросов,
+# в котором популярность запросов тоже подчиняется закону Ципфа.
+# Всё детерминировано seed, поэтому прогоны на разных коммитах сравнимы.
+
+CONSONANTS = "bdfghklmprstvz"
+VOWELS = "aeiuy"
+BASE_URL = "https://kpop.fandom.com/wiki/"
+# Операторы булевого поиска: слова, содержащие их, разбираются парсером запросов как операторы
+RESERVED_PARTS = ("and", "or", "not")
+
+
+def make_vocabulary(size, seed=0):
+    """
+    size различных псевдослов из слогов; порядок списка - ранг по частоте.
+    """
+    rng = random.Random(seed)
+    syllables = [c + v for c, v in itertools.product(CONSONANTS, VOWELS)]
+    words = []
+    seen = set()
+    while len(words) < size:
+        # Частые слова короче редких, как в естественном языке
+        length = 2 + min(3, int(math.log10(len(words) + 10)) - 1 + rng.randint(0, 1))
+        word = "".join(rng.choice(syllables) for _ in range(length))
+        if word in seen or any(part in word for part in RESERVED_PARTS):
+            continue
+        seen.add(word)
+        words.append(word)
+    return words
+
+
+class ZipfSampler:
+    """
+    Выбор рангов 0..n-1 с вероятностью, пропорциональной 1 / (ранг + 1) ** exponent.
+    """
+
+    def __init__(self, n, exponent=1.0, rng=None):
+        self.rng = rng or random.Random(0)
+        total = 0.0
+        self.cumulative = []
+        for rank in range(n):
+            total += 1.0 / (rank + 1) ** exponent
+            self.cumulative.append(total)
+        self.total = total
+
+    def sample(self):
+        return bisect.bisect_left(self.cumulative, self.rng.random() * self.total)
+
+    def sample_many(self, count):
+        cumulative, total, rnd = self.cumulative, self.total, self.rng.random
+        return [bisect.bisect_left(cumulative, rnd() * total) for _ in range(count)]
+
+
+def render_page(doc_id, words, links):
+    """
+    Страница в духе fandom: заголовок, абзацы, ссылки на другие страницы,
+    а также script/style, которые краулер вырезает.
+    """
+    title = " ".join(words[:3]).title()
+    paragraphs = []
+    for start in range(3, len(words), 60):
+        paragraphs.append("<p>" + " ".join(words[start:start + 60]) + "</p>")
+    anchors = "".join(f'<li><a href="{BASE_URL}Synthetic_{target}">{words[i % len(words)]}</a></li>'
+                      for i, target in enumerate(links))
+    return (f"<html><head><title>{title}</title><meta charset=\"utf-8\">"
+            f"<style>.p{doc_id} {{ color: #333; }}</style></head><body>"
+            f"<script>var page = {doc_id};</script><h1>{title}</h1>"
+            f"{''.join(paragraphs)}<ul>{anchors}</ul></body></html>")
+
+
+def generate_corpus(output_dir, doc_count, vocabulary_size=50000, doc_words=300, exponent=1.0, seed=0):
+    """
+    Записывает doc_count страниц page_0.txt ... в output_dir и corpus.json с параметрами.
+    Длина документов - логнормальная со средним около doc_words слов.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    sampler = ZipfSampler(vocabulary_size, exponent, rng)
+    sigma = 0.6
+    mu = math.log(doc_words) - sigma ** 2 / 2
+
+    total_words = 0
+    total_bytes = 0
+    for doc_id in range(doc_count):
+        length = max(10, int(rng.lognormvariate(mu, sigma)))
+        words = [vocabulary[rank] for rank in sampler.sample_many(length)]
+        links = [rng.randrange(doc_count) for _ in range(rng.randint(0, 10))]
+        html = render_page(doc_id, words, links)
+        with open(os.path.join(output_dir, f"page_{doc_id}.txt"), "w", encoding="utf-8") as f:
+            f.write(html)
+        total_words += length
+        total_bytes += len(html)
+
+    info = {
+        "docs": doc_count,
+        "vocabulary": vocabulary_size,
+        "doc_words": doc_words,
+        "exponent": exponent,
+        "seed": seed,
+        "total_words": total_words,
+        "total_bytes": total_bytes,
+    }
+    with open(os.path.join(output_dir, "corpus.json"), "w", encoding="utf-8") as f:
+        json.dump(info, f, indent=1)
+    return info
+
+
+def make_query_log(count, vocabulary_size=50000, distinct=None, exponent=1.0, boolean=False, phrase=False, seed=0):
+    """
+    Журнал из count запросов. Сначала строятся distinct различных запросов
+    по 1-3 слова (слова выбираются по Ципфу из того же словаря, что и корпус),
+    затем журнал набирается из них по Ципфу: популярные запросы повторяются.
+    boolean=True - запросы с операторами AND, OR, NOT для булевого поиска,
+    phrase=True - фразы в кавычках и запросы "a NEAR/k b" для позиционного индекса.
+    """
+    rng = random.Random(seed + 1)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    word_sampler = ZipfSampler(vocabulary_size, exponent, rng)
+    distinct = distinct or max(1, count // 4)
+
+    queries = []
+    for _ in range(distinct):
+        words = [vocabulary[rank] for rank in word_sampler.sample_many(rng.randint(1, 3))]
+        if phrase:
+            words = words if len(words) > 1 else words + [vocabulary[word_sampler.sample_many(1)[0]]]
+            if rng.random() < 0.5:
+                queries.append('"' + " ".join(words) + '"')
+            else:
+                queries.append(f"{words[0]} NEAR/{rng.randint(1, 10)} {words[1]}")
+            continue
+        if not boolean or len(words) == 1:
+            queries.append(" ".join(words))
+            continue
+        query = words[0]
+        for word in words[1:]:
+            query += " " + rng.choice(("AND", "OR", "AND NOT")) + " " + word
+        queries.append(query)
+
+    query_sampler = ZipfSampler(len(queries), exponent, rng)
+    return [queries[rank] for rank in query_sampler.sample_many(count)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Генератор синтетического корпуса и журнала запросов")
+    parser.add_argument("output_dir")
+    parser.add_argument("--docs", type=int, default=1000)
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--doc-words", type=int, default=300)
+    parser.add_argument("--exponent", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=1000, help="размер журнала запросов (queries.txt)")
+    args = parser.parse_args()
+
+    info = generate_corpus(args.output_dir, args.docs, args.vocabulary, args.doc_words, args.exponent, args.seed)
+    # Журнал в формате demo/loadtest.py --queries: по запросу в строке
+    with open(os.path.join(args.output_dir, "queries.txt"), "w", encoding="utf-8") as f:
+        f.write("\n".join(make_query_log(args.queries, args.vocabulary, exponent=args.exponent, seed=args.seed)))
+    print(f"Сгенерировано страниц: {info['docs']}, слов: {info['total_words']}, "
+          f"{info['total_bytes'] / 1024 / 1024:.1f} МБ")
+
+
+if __name__ == "__main__":
+    main()
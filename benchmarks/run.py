@@ -0,0 +1,420 @@
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.join(BENCH_DIR, '..')
+sys.path.append(ROOT_DIR)
+for folder in ("index", "tf-idf", "vector_search", "crawler"):
+    sys.path.append(os.path.join(ROOT_DIR, folder))
+
+from corpus import generate_corpus, make_query_log
+
+# Сквозной бенчмарк конвейера на синтетическом корпусе (corpus.py):
+# разбор HTML -> токенизация и лемматизация -> инвертированный индекс -> TF-IDF
+# -> хранилище текстов, затем задержки булевого, фразового и векторного поиска по журналу запросов.
+# Каждый этап вызывает те же функции, что и скрипты конвейера, в одном процессе.
+# Результат - JSON (по умолчанию results/<коммит>.json) для сравнения коммитов в compare.py.
+
+STAGES = ["html", "analyze", "tokenize", "build_index", "tfidf", "text_store", "boolean_queries", "phrase_queries",
+          "vector_queries", "boolean_batch", "vector_batch"]
+# Этапы, без результатов которых следующий этап не запустить
+DEPENDS_ON = {
+    "analyze": "html",
+    "tokenize": "html",
+    "build_index": "tokenize",
+    "tfidf": "tokenize",
+    "boolean_queries": "build_index",
+    "phrase_queries": "build_index",
+    "vector_queries": "tfidf",
+    "boolean_batch": "build_index",
+    "vector_batch": "tfidf",
+}
+
+
+def load_script(name, path):
+    """
+    Импорт скрипта по пути: у tokenizer-lemmatizer/main.py и tf-idf/main.py одинаковые имена модулей.
+    """
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def percentile(sorted_values, fraction):
+    """
+    Перцентиль методом ближайшего ранга по отсортированному списку.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def latency_summary(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        "queries": len(latencies),
+        "qps": len(latencies) / elapsed if elapsed else 0.0,
+        "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+        "p50_ms": percentile(latencies, 0.5) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "max_ms": latencies[-1] * 1000 if latencies else 0.0,
+    }
+
+
+def batch_summary(queries, elapsed, found):
+    """
+    Пропускная способность пакетного прогона журнала (search_many): задержки отдельных запросов в нём не измеряются.
+    """
+    return {
+        "queries": queries,
+        "qps": queries / elapsed if elapsed else 0.0,
+        "query_us": elapsed / queries * 1_000_000 if queries else 0.0,
+        "results": found,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class Pipeline:
+    """
+    Папки этапов внутри workdir и функции этапов. Каждая функция возвращает словарь
+    счётчиков этапа (документы, байты, термины...); время и память измеряет run_stage.
+    """
+
+    def __init__(self, workdir, queries, top_n):
+        self.workdir = workdir
+        self.pages_dir = os.path.join(workdir, "pages")
+        self.texts_dir = os.path.join(workdir, "texts")
+        self.tokens_dir = os.path.join(workdir, "tokens")
+        self.lemmas_dir = os.path.join(workdir, "lemmas")
+        self.tfidf_dir = os.path.join(workdir, "tfidf_lemmas")
+        self.tokens_store = os.path.join(workdir, "tokens.art")
+        self.tfidf_store = os.path.join(workdir, "tfidf.art")
+        self.index_file = os.path.join(workdir, "inverted_index.bin")
+        self.positions_file = os.path.join(workdir, "positions.bin")
+        self.matrix_file = os.path.join(workdir, "tfidf_lemmas.bin")
+        self.text_store_file = os.path.join(workdir, "page_texts.bin")
+        self.queries = queries
+        self.top_n = top_n
+
+    def doc_ids(self):
+        return sorted(int(name[5:-4]) for name in os.listdir(self.pages_dir)
+                      if name.startswith("page_") and name.endswith(".txt"))
+
+    def html(self):
+        from html_processing import process_html
+
+        os.makedirs(self.texts_dir, exist_ok=True)
+        total_bytes = 0
+        links = 0
+        doc_ids = self.doc_ids()
+        for doc_id in doc_ids:
+            with open(os.path.join(self.pages_dir, f"page_{doc_id}.txt"), "r", encoding="utf-8") as f:
+                html = f.read()
+            _, page_links, text = process_html(f"https://kpop.fandom.com/wiki/Synthetic_{doc_id}", html)
+            with open(os.path.join(self.texts_dir, f"page_{doc_id}.txt"), "w", encoding="utf-8") as f:
+                f.write(text)
+            total_bytes += len(html)
+            links += len(page_links)
+        return {"docs": len(doc_ids), "bytes": total_bytes, "links": links}
+
+    def analyze(self):
+        """
+        Анализатор отдельно от записи файлов: analyze_many по пачкам текстов,
+        разбор каждого запроса журнала и холодный старт (импорт и первый разбор в новом процессе).
+        """
+        from common.analyzer import Analyzer
+
+        analyzer = Analyzer()
+        doc_ids = self.doc_ids()
+        total_bytes = 0
+        lemmas = 0
+        for start in range(0, len(doc_ids), 256):
+            texts = []
+            for doc_id in doc_ids[start:start + 256]:
+                with open(os.path.join(self.texts_dir, f"page_{doc_id}.txt"), "r", encoding="utf-8") as f:
+                    texts.append(f.read())
+            total_bytes += sum(len(text) for text in texts)
+            lemmas += sum(len(result) for result in analyzer.analyze_many(texts))
+
+        queries = self.queries["vector"]
+        started = time.perf_counter()
+        for query in queries:
+            analyzer.analyze(query)
+        query_us = (time.perf_counter() - started) / len(queries) * 1_000_000 if queries else 0.0
+
+        started = time.perf_counter()
+        subprocess.run([sys.executable, "-c", "import sys; sys.path.append(sys.argv[1]); "
+                        "from common.analyzer import Analyzer; Analyzer().analyze('warm up')", ROOT_DIR],
+                       check=True, capture_output=True)
+        cold_start_ms = (time.perf_counter() - started) * 1000
+        return {"docs": len(doc_ids), "bytes": total_bytes, "lemmas": lemmas,
+                "query_us": query_us, "cold_start_ms": cold_start_ms}
+
+    def tokenize(self):
+        from common.artifact_store import TOKEN_TABLES, ArtifactWriter
+
+        tokenizer = load_script("tokenizer_main", os.path.join(ROOT_DIR, "tokenizer-lemmatizer", "main.py"))
+        tokenizer.TEXTS_DIR = self.texts_dir
+        tokenizer.init_worker()
+
+        pages = tokenizer.find_pages(self.pages_dir)
+        total_bytes = sum(os.path.getsize(os.path.join(self.texts_dir, os.path.basename(path)))
+                          for path in pages.values())
+        tokens = lemmas = 0
+        with ArtifactWriter(self.tokens_store, TOKEN_TABLES) as writer:
+            for page_num in sorted(pages):
+                page_tokens, page_lemmas, page_sequence, lemmas_count = tokenizer.process_page(pages[page_num], page_num)
+                writer.add("tokens", page_num, page_tokens)
+                writer.add("lemmas", page_num, page_lemmas)
+                writer.add("sequence", page_num, page_sequence)
+                tokens += len(page_tokens["token"])
+                lemmas += lemmas_count
+        return {"docs": len(pages), "bytes": total_bytes, "tokens": tokens, "lemmas": lemmas,
+                "store_bytes": os.path.getsize(self.tokens_store)}
+
+    def build_index(self):
+        from build_index import build_index, save_index_binary, save_positions
+
+        inverted_index = build_index(self.tokens_store)
+        save_index_binary(inverted_index, self.index_file)
+        save_positions(self.tokens_store, self.positions_file)
+        return {
+            "docs": len(self.doc_ids()),
+            "terms": len(inverted_index),
+            "postings": sum(len(doc_ids) for doc_ids in inverted_index.values()),
+            "index_bytes": os.path.getsize(self.index_file),
+            "positions_bytes": os.path.getsize(self.positions_file),
+        }
+
+    def tfidf(self):
+        from tfidf_builder import TfidfBuilder
+
+        builder = TfidfBuilder(self.tokens_dir, self.lemmas_dir, store_filename=self.tokens_store)
+        builder.compute_document_frequencies(self.doc_ids())
+        builder.write(None, None, self.matrix_file, self.tfidf_store)
+        return {"docs": builder.doc_count, "terms": len(builder.lemma_dfs),
+                "matrix_bytes": os.path.getsize(self.matrix_file),
+                "store_bytes": os.path.getsize(self.tfidf_store)}
+
+    def text_store(self):
+        from text_store import build_text_store
+
+        docs = build_text_store(self.pages_dir, self.text_store_file)
+        return {"docs": docs, "store_bytes": os.path.getsize(self.text_store_file)}
+
+    def boolean_queries(self):
+        from binary_index import BinaryIndex
+        from search_by_index import BooleanSearcher
+
+        # Без кэша результатов: измеряется выполнение запросов, а не попадания в кэш
+        searcher = BooleanSearcher(BinaryIndex(self.index_file), result_cache_size=0)
+        latencies = []
+        found = 0
+        started = time.perf_counter()
+        for query in self.queries["boolean"]:
+            query_started = time.perf_counter()
+            found += len(searcher.search(query))
+            latencies.append(time.perf_counter() - query_started)
+        summary = latency_summary(latencies, time.perf_counter() - started)
+        summary["results"] = found
+        return summary
+
+    def phrase_queries(self):
+        from binary_index import BinaryIndex
+        from positional_index import PositionalIndex
+        from search_by_index import BooleanSearcher
+
+        searcher = BooleanSearcher(BinaryIndex(self.index_file), result_cache_size=0,
+                                   positional_index=PositionalIndex(self.positions_file))
+        latencies = []
+        found = 0
+        started = time.perf_counter()
+        for query in self.queries["phrase"]:
+            query_started = time.perf_counter()
+            found += len(searcher.search(query))
+            latencies.append(time.perf_counter() - query_started)
+        summary = latency_summary(latencies, time.perf_counter() - started)
+        summary["results"] = found
+        return summary
+
+    def vector_queries(self):
+        from search import VectorSearchEngine
+
+        engine = VectorSearchEngine(pages_dir=self.pages_dir, tfidf_dir=self.tfidf_dir,
+                                    text_store=self.text_store_file, tfidf_matrix=self.matrix_file,
+                                    tfidf_store=self.tfidf_store)
+        latencies = []
+        found = 0
+        started = time.perf_counter()
+        for query in self.queries["vector"]:
+            query_started = time.perf_counter()
+            found += len(engine.rank(query, self.top_n))
+            latencies.append(time.perf_counter() - query_started)
+        summary = latency_summary(latencies, time.perf_counter() - started)
+        summary["results"] = found
+        return summary
+
+    def boolean_batch(self):
+        from binary_index import BinaryIndex
+        from search_by_index import boolean_search_many
+
+        started = time.perf_counter()
+        results = boolean_search_many(self.queries["boolean"], BinaryIndex(self.index_file))
+        return batch_summary(len(results), time.perf_counter() - started, sum(len(result) for result in results))
+
+    def vector_batch(self):
+        from search import VectorSearchEngine
+
+        engine = VectorSearchEngine(pages_dir=self.pages_dir, tfidf_dir=self.tfidf_dir,
+                                    text_store=self.text_store_file, tfidf_matrix=self.matrix_file,
+                                    tfidf_store=self.tfidf_store)
+        started = time.perf_counter()
+        results = engine.search_many(self.queries["vector"], self.top_n)
+        return batch_summary(len(results), time.perf_counter() - started, sum(len(result) for result in results))
+
+
+def run_stage(pipeline, stage, measure_memory, repeat=1):
+    """
+    Выполняет этап repeat раз и возвращает счётчики, время и пропускную способность
+    самого быстрого прогона (минимум меньше всего зависит от фоновой нагрузки).
+    При measure_memory этап выполняется ещё раз под tracemalloc: трассировка
+    замедляет Python в разы, поэтому время берётся из обычных прогонов.
+    """
+    function = getattr(pipeline, stage)
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        cpu_started = time.process_time()
+        attempt = function()
+        attempt["seconds"] = time.perf_counter() - started
+        attempt["cpu_seconds"] = time.process_time() - cpu_started
+        if result is None or attempt["seconds"] < result["seconds"]:
+            result = attempt
+    result["repeat"] = repeat
+    if "docs" in result:
+        result["docs_per_sec"] = result["docs"] / result["seconds"] if result["seconds"] else 0.0
+    if "bytes" in result:
+        result["mb_per_sec"] = result["bytes"] / 1024 / 1024 / result["seconds"] if result["seconds"] else 0.0
+
+    if measure_memory:
+        tracemalloc.start()
+        try:
+            function()
+            result["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        finally:
+            tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк конвейера на синтетическом корпусе")
+    parser.add_argument("--docs", type=int, default=1000, help="размер корпуса (от 1000 до 1000000 документов)")
+    parser.add_argument("--vocabulary", type=int, default=50000)
+    parser.add_argument("--doc-words", type=int, default=300)
+    parser.add_argument("--exponent", type=float, default=1.0, help="показатель закона Ципфа")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=1000, help="запросов в журнале для каждого вида поиска")
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--stages", default=",".join(STAGES), help="этапы через запятую")
+    parser.add_argument("--workdir", default="work", help="папка корпуса и промежуточных файлов")
+    parser.add_argument("--keep", action="store_true", help="не удалять workdir после прогона")
+    parser.add_argument("--repeat", type=int, default=1, help="прогонов каждого этапа (берётся самый быстрый)")
+    parser.add_argument("--no-memory", action="store_true", help="не измерять пиковую память (tracemalloc)")
+    parser.add_argument("--output", help="файл результатов (по умолчанию results/<коммит>.json)")
+    args = parser.parse_args()
+
+    stages = [stage for stage in args.stages.split(",") if stage]
+    unknown = set(stages) - set(STAGES)
+    if unknown:
+        parser.error(f"неизвестные этапы: {', '.join(sorted(unknown))}")
+
+    commit = git_commit()
+    report = {
+        "commit": commit,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("output", "keep", "workdir")},
+        "stages": {},
+    }
+
+    pages_dir = os.path.join(args.workdir, "pages")
+    corpus_file = os.path.join(pages_dir, "corpus.json")
+    corpus_params = {"docs": args.docs, "vocabulary": args.vocabulary, "doc_words": args.doc_words,
+                     "exponent": args.exponent, "seed": args.seed}
+    corpus = None
+    if os.path.exists(corpus_file):
+        with open(corpus_file, "r", encoding="utf-8") as f:
+            corpus = json.load(f)
+    if corpus is None or any(corpus.get(key) != value for key, value in corpus_params.items()):
+        # Корпус с другими параметрами не переиспользуется
+        shutil.rmtree(args.workdir, ignore_errors=True)
+        started = time.perf_counter()
+        corpus = generate_corpus(pages_dir, args.docs, args.vocabulary, args.doc_words, args.exponent, args.seed)
+        print(f"Корпус сгенерирован за {time.perf_counter() - started:.1f} с")
+    report["corpus"] = corpus
+
+    queries = {
+        "boolean": make_query_log(args.queries, args.vocabulary, exponent=args.exponent, boolean=True,
+                                  seed=args.seed),
+        "phrase": make_query_log(args.queries, args.vocabulary, exponent=args.exponent, phrase=True,
+                                 seed=args.seed),
+        "vector": make_query_log(args.queries, args.vocabulary, exponent=args.exponent, seed=args.seed),
+    }
+    pipeline = Pipeline(args.workdir, queries, args.top_n)
+
+    for stage in stages:
+        dependency = DEPENDS_ON.get(stage)
+        if dependency and "error" in report["stages"].get(dependency, {}):
+            report["stages"][stage] = {"error": f"пропущен: этап {dependency} завершился с ошибкой"}
+            continue
+        try:
+            result = run_stage(pipeline, stage, not args.no_memory, max(1, args.repeat))
+        except Exception as e:
+            result = {"error": f"{type(e).__name__}: {e}"}
+        report["stages"][stage] = result
+        if "error" in result:
+            print(f"{stage}: ошибка - {result['error']}")
+        elif "p50_ms" in result:
+            print(f"{stage}: {result['qps']:.1f} запросов/с, p50 {result['p50_ms']:.3f} мс, "
+                  f"p99 {result['p99_ms']:.3f} мс")
+        elif "qps" in result:
+            print(f"{stage}: {result['qps']:.1f} запросов/с, {result['query_us']:.1f} мкс/запрос")
+        else:
+            print(f"{stage}: {result['seconds']:.2f} с, {result.get('docs_per_sec', 0):.1f} документов/с")
+
+    # Пиковый RSS всего процесса (Linux - в КБ)
+    report["max_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    output = args.output or os.path.join(BENCH_DIR, "results", f"{commit}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=1, ensure_ascii=False)
+    print(f"Результаты сохранены в {output}")
+
+    if not args.keep:
+        shutil.rmtree(args.workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
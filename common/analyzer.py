@@ -0,0 +1,83 @@
+import os
+import re
+from collections import Counter
+
+from common.lemma_cache import LemmaCache
+
+# Общий анализатор текста для индексации и всех видов запросов.
+#
+# Токены - слова из латинских букв длиной от MIN_TOKEN_LENGTH, отделённые от соседних
+# букв и цифр границей слова ("k-pop" -> "pop", "abc123" и "café" отбрасываются),
+# без стоп-слов. Одно скомпилированное регулярное выражение вместо word_tokenize:
+# не нужны ни импорт NLTK, ни данные punkt. Стоп-слова лежат рядом (stopwords_en.txt -
+# английский список NLTK), леммы берутся из LemmaCache, который загружает WordNet
+# только при промахе и только с локального диска.
+
+MIN_TOKEN_LENGTH = 3
+# Меняется при изменении правил разбора: токенизатор переобрабатывает страницы, обработанные прежними правилами
+ANALYZER_VERSION = 1
+STOPWORDS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stopwords_en.txt')
+
+TOKEN_PATTERN = re.compile(r'\b[a-z]{%d,}\b' % MIN_TOKEN_LENGTH)
+
+
+def load_stop_words(filename=STOPWORDS_FILE):
+    with open(filename, 'r', encoding='utf-8') as f:
+        return frozenset(line.strip() for line in f if line.strip())
+
+
+class Analyzer:
+
+    def __init__(self, lemma_cache=None, stop_words=None):
+        self.lemma_cache = lemma_cache if lemma_cache is not None else LemmaCache()
+        self.stop_words = stop_words if stop_words is not None else load_stop_words()
+
+    def tokens(self, text):
+        """
+        Токены текста в нижнем регистре по порядку, с повторами.
+        """
+        stop_words = self.stop_words
+        return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in stop_words]
+
+    def lemmatize(self, token):
+        return self.lemma_cache.lemmatize(token)
+
+    def analyze(self, text):
+        """
+        Леммы текста по порядку, с повторами.
+        """
+        lemmatize = self.lemma_cache.lemmatize
+        return [lemmatize(token) for token in self.tokens(text)]
+
+    def analyze_many(self, texts):
+        """
+        То же, что analyze, для пачки текстов: каждое различное слово пачки
+        лемматизируется один раз.
+        """
+        token_lists = [self.tokens(text) for text in texts]
+        lemmatize = self.lemma_cache.lemmatize
+        lemmas = {token: lemmatize(token) for token in set().union(*token_lists)} if token_lists else {}
+        return [[lemmas[token] for token in tokens] for tokens in token_lists]
+
+    def analyze_document(self, text):
+        """
+        Разбор документа для токенизатора: {токен: число вхождений}, {лемма: множество токенов}
+        и леммы текста по порядку (номер в списке - позиция слова для фраз и NEAR).
+        """
+        tokens = self.tokens(text)
+        token_counts = Counter(tokens)
+        lemma_map = {}
+        lemmas_by_token = {}
+        lemmatize = self.lemma_cache.lemmatize
+        for token in token_counts:
+            lemma = lemmatize(token)
+            lemmas_by_token[token] = lemma
+            lemma_map.setdefault(lemma, set()).add(token)
+        return token_counts, lemma_map, [lemmas_by_token[token] for token in tokens]
+
+    def query_terms(self, term):
+        """
+        Леммы одного термина запроса: обычно одна; "red-velvet" даёт две,
+        стоп-слово или слишком короткое слово - ни одной.
+        """
+        return self.analyze(term)
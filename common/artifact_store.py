@@ -0,0 +1,378 @@
+import mmap
+import os
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+
+# Колоночное хранилище промежуточных результатов конвейера в одном файле
+# вместо тысяч файлов tokens_N.txt, lemmas_N.txt, tfidf_*_N.txt.
+#
+# Файл содержит общий словарь терминов (каждая строка хранится один раз, в таблицах -
+# только её id) и несколько таблиц. Строки таблицы сгруппированы по документам:
+# таблица документов даёт для doc_id начало и число его строк, а каждая колонка -
+# непрерывный массив значений всех строк. Читатель открывает файл через mmap
+# и отдаёт колонки документа как memoryview без разбора и копирования,
+# поэтому открытие не зависит от числа документов, а чтение - только от
+# числа затронутых строк.
+#
+# Типы колонок: "T" - термин (хранится как id в словаре, uint32), "I" - uint32,
+# "f" - float32, "d" - float64.
+#
+# Формат файла:
+#   заголовок  - MAGIC, версия формата, число таблиц, число терминов, смещения секций
+#   таблицы    - для каждой: имя, число колонок, документов и строк, смещения
+#                таблицы документов; затем колонки: имя, тип, смещение данных
+#   словарь    - term_count + 1 смещений строк (Q), term_count id терминов в порядке
+#                сортировки строк (I) для поиска термина, строки в UTF-8 подряд
+#   документы  - для каждой таблицы: doc_id по возрастанию (I), начало строк (Q), число строк (I)
+#   колонки    - данные колонок, каждая выровнена по 8 байтам
+MAGIC = b"ITAS"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHIQQQ")
+TABLE = struct.Struct("<32sHIQQQQ")
+COLUMN = struct.Struct("<16s1s7xQ")
+
+STORED_TYPES = {"T": "I", "I": "I", "f": "f", "d": "d"}
+
+# Таблицы конвейера: токенизатор пишет TOKEN_TABLES в tokenizer-lemmatizer/tokens.art
+# (строка lemmas - пара лемма/токен, строка sequence - лемма на очередной позиции текста),
+# tf-idf/main.py - TFIDF_TABLES в tf-idf/tfidf.art
+TOKEN_TABLES = {
+    "tokens": [("token", "T"), ("count", "I")],
+    "lemmas": [("lemma", "T"), ("token", "T")],
+    "sequence": [("lemma", "T")],
+}
+TFIDF_TABLES = {
+    "tfidf_tokens": [("term", "T"), ("idf", "f"), ("weight", "f")],
+    "tfidf_lemmas": [("term", "T"), ("idf", "f"), ("weight", "f")],
+}
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+class ArtifactWriter:
+    """
+    Потоковая запись хранилища. tables - {имя таблицы: [(имя колонки, тип), ...]}.
+    Строки документов добавляются в любом порядке (add) и сразу сбрасываются
+    во временные файлы колонок; в памяти остаются только словарь и таблица документов.
+    Файл появляется целиком при close (запись во временный файл и os.replace).
+
+    base - открытое хранилище прежней версии того же файла: словарь новой версии
+    начинается со словаря base с теми же id, поэтому строки неизменённых документов
+    переносятся copy() байтами колонок, без декодирования терминов.
+    """
+
+    def __init__(self, filename, tables, base=None):
+        self.filename = filename
+        self.tables = {name: list(columns) for name, columns in tables.items()}
+        self._base = base
+        if base is not None:
+            self._terms = list(base.vocabulary())
+            self._term_ids = {term: term_id for term_id, term in enumerate(self._terms)}
+        else:
+            self._term_ids = {}
+            self._terms = []
+        tmp_dir = os.path.dirname(os.path.abspath(filename))
+        self._columns = {name: {column: tempfile.TemporaryFile(dir=tmp_dir) for column, _ in columns}
+                         for name, columns in self.tables.items()}
+        self._documents = {name: {} for name in self.tables}
+        self._row_counts = {name: 0 for name in self.tables}
+
+    def term_id(self, term):
+        term_id = self._term_ids.get(term)
+        if term_id is None:
+            term_id = self._term_ids[term] = len(self._terms)
+            self._terms.append(term)
+        return term_id
+
+    def add(self, table, doc_id, columns):
+        """
+        Добавляет строки документа: columns - {имя колонки: последовательность значений}
+        одинаковой длины (для колонок "T" - строки терминов).
+        """
+        documents = self._documents[table]
+        if doc_id in documents:
+            raise ValueError(f"Документ {doc_id} уже записан в таблицу {table}")
+        row_count = None
+        for column, kind in self.tables[table]:
+            values = columns[column]
+            if kind == "T":
+                values = [self.term_id(term) for term in values]
+            data = array(STORED_TYPES[kind], values)
+            if row_count is None:
+                row_count = len(data)
+            elif len(data) != row_count:
+                raise ValueError(f"Колонки документа {doc_id} в таблице {table} разной длины")
+            self._columns[table][column].write(data.tobytes())
+        documents[doc_id] = (self._row_counts[table], row_count or 0)
+        self._row_counts[table] += row_count or 0
+
+    def copy(self, table, doc_id):
+        """
+        Переносит строки документа из таблицы base как есть: id терминов в base и в новом
+        словаре совпадают, поэтому колонки копируются байтами.
+        """
+        documents = self._documents[table]
+        if doc_id in documents:
+            raise ValueError(f"Документ {doc_id} уже записан в таблицу {table}")
+        rows = self._base.table(table).rows(doc_id)
+        if rows is None:
+            raise KeyError(f"Документа {doc_id} нет в таблице {table} хранилища {self._base.filename}")
+        row_count = 0
+        for column, _ in self.tables[table]:
+            values = rows[column]
+            row_count = len(values)
+            self._columns[table][column].write(values)
+        for values in rows.values():
+            values.release()
+        documents[doc_id] = (self._row_counts[table], row_count)
+        self._row_counts[table] += row_count
+
+    def close(self):
+        terms = [term.encode("utf-8") for term in self._terms]
+        term_offsets = array("Q", [0])
+        for term in terms:
+            term_offsets.append(term_offsets[-1] + len(term))
+        sorted_ids = array("I", sorted(range(len(self._terms)), key=self._terms.__getitem__))
+
+        offset = HEADER.size + sum(TABLE.size + COLUMN.size * len(columns) for columns in self.tables.values())
+        vocabulary_offset = _align(offset)
+        strings_offset = vocabulary_offset + term_offsets.itemsize * len(term_offsets) + sorted_ids.itemsize * len(sorted_ids)
+        offset = _align(strings_offset + term_offsets[-1])
+
+        layout = {}
+        for name, columns in self.tables.items():
+            doc_count = len(self._documents[name])
+            doc_ids_offset = offset
+            starts_offset = _align(doc_ids_offset + 4 * doc_count)
+            counts_offset = starts_offset + 8 * doc_count
+            offset = _align(counts_offset + 4 * doc_count)
+            column_offsets = []
+            for column, kind in columns:
+                column_offsets.append(offset)
+                offset = _align(offset + array(STORED_TYPES[kind]).itemsize * self._row_counts[name])
+            layout[name] = (doc_ids_offset, starts_offset, counts_offset, column_offsets)
+
+        tmp_file = self.filename + ".tmp"
+        with open(tmp_file, "wb") as f:
+            f.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(self.tables), len(terms),
+                                vocabulary_offset, strings_offset, HEADER.size))
+            for name, columns in self.tables.items():
+                doc_ids_offset, starts_offset, counts_offset, column_offsets = layout[name]
+                f.write(TABLE.pack(name.encode("utf-8"), len(columns), len(self._documents[name]),
+                                   self._row_counts[name], doc_ids_offset, starts_offset, counts_offset))
+                for (column, kind), column_offset in zip(columns, column_offsets):
+                    f.write(COLUMN.pack(column.encode("utf-8"), kind.encode("ascii"), column_offset))
+
+            self._pad_to(f, vocabulary_offset)
+            f.write(term_offsets.tobytes())
+            f.write(sorted_ids.tobytes())
+            f.write(b"".join(terms))
+
+            for name, columns in self.tables.items():
+                doc_ids_offset, starts_offset, counts_offset, column_offsets = layout[name]
+                documents = self._documents[name]
+                doc_ids = sorted(documents)
+                self._pad_to(f, doc_ids_offset)
+                f.write(array("I", doc_ids).tobytes())
+                self._pad_to(f, starts_offset)
+                f.write(array("Q", (documents[doc_id][0] for doc_id in doc_ids)).tobytes())
+                f.write(array("I", (documents[doc_id][1] for doc_id in doc_ids)).tobytes())
+                for (column, _), column_offset in zip(columns, column_offsets):
+                    self._pad_to(f, column_offset)
+                    data = self._columns[name][column]
+                    data.seek(0)
+                    while True:
+                        chunk = data.read(1024 * 1024)
+                        if not chunk:
+                            break
+                        f.write(chunk)
+                    data.close()
+            self._pad_to(f, offset)
+        os.replace(tmp_file, self.filename)
+
+    @staticmethod
+    def _pad_to(f, offset):
+        position = f.tell()
+        if position > offset:
+            raise ValueError("Нарушена разметка файла хранилища")
+        f.write(b"\0" * (offset - position))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            for columns in self._columns.values():
+                for data in columns.values():
+                    data.close()
+
+
+class ArtifactTable:
+    """
+    Таблица хранилища. doc_ids - memoryview id документов по возрастанию.
+    """
+
+    def __init__(self, store, mm, column_count, doc_count, doc_ids_offset, starts_offset, counts_offset, columns):
+        self.store = store
+        self.doc_ids = memoryview(mm)[doc_ids_offset:doc_ids_offset + 4 * doc_count].cast("I")
+        self._starts = memoryview(mm)[starts_offset:starts_offset + 8 * doc_count].cast("Q")
+        self._counts = memoryview(mm)[counts_offset:counts_offset + 4 * doc_count].cast("I")
+        self.kinds = {}
+        self._columns = {}
+        row_count = sum(self._counts)
+        for name, kind, offset in columns:
+            itemsize = array(STORED_TYPES[kind]).itemsize
+            self.kinds[name] = kind
+            self._columns[name] = memoryview(mm)[offset:offset + itemsize * row_count].cast(STORED_TYPES[kind])
+
+    def __len__(self):
+        return len(self.doc_ids)
+
+    def __iter__(self):
+        return iter(self.doc_ids)
+
+    def _position(self, doc_id):
+        position = bisect_left(self.doc_ids, doc_id)
+        if position < len(self.doc_ids) and self.doc_ids[position] == doc_id:
+            return position
+        return None
+
+    def __contains__(self, doc_id):
+        return self._position(doc_id) is not None
+
+    def rows(self, doc_id):
+        """
+        {колонка: memoryview значений} строк документа без копирования (для "T" - id терминов)
+        или None, если документа нет.
+        """
+        position = self._position(doc_id)
+        if position is None:
+            return None
+        start = self._starts[position]
+        end = start + self._counts[position]
+        return {name: column[start:end] for name, column in self._columns.items()}
+
+    def column(self, doc_id, name):
+        rows = self.rows(doc_id)
+        return rows[name] if rows is not None else None
+
+    def document(self, doc_id):
+        """
+        Строки документа как списки Python; колонки "T" - строками терминов.
+        """
+        rows = self.rows(doc_id)
+        if rows is None:
+            return None
+        return {name: self.store.terms(values) if self.kinds[name] == "T" else values.tolist()
+                for name, values in rows.items()}
+
+
+class ArtifactStore:
+    """
+    Чтение хранилища через mmap: store.table("lemmas").rows(doc_id).
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._file = open(filename, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, table_count, term_count, vocabulary_offset, strings_offset,
+         tables_offset) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            self._mm.close()
+            self._file.close()
+            raise ValueError(f"{filename}: не хранилище артефактов версии {FORMAT_VERSION}")
+
+        self.term_count = term_count
+        self._term_offsets = memoryview(self._mm)[vocabulary_offset:vocabulary_offset + 8 * (term_count + 1)].cast("Q")
+        sorted_offset = vocabulary_offset + 8 * (term_count + 1)
+        self._sorted_ids = memoryview(self._mm)[sorted_offset:sorted_offset + 4 * term_count].cast("I")
+        self._strings_offset = strings_offset
+        self._vocabulary = None
+
+        self.tables = {}
+        offset = tables_offset
+        for _ in range(table_count):
+            name, column_count, doc_count, _, doc_ids_offset, starts_offset, counts_offset = TABLE.unpack_from(self._mm, offset)
+            offset += TABLE.size
+            columns = []
+            for _ in range(column_count):
+                column, kind, column_offset = COLUMN.unpack_from(self._mm, offset)
+                offset += COLUMN.size
+                columns.append((column.rstrip(b"\0").decode("utf-8"), kind.decode("ascii"), column_offset))
+            self.tables[name.rstrip(b"\0").decode("utf-8")] = ArtifactTable(
+                self, self._mm, column_count, doc_count, doc_ids_offset, starts_offset, counts_offset, columns)
+
+    def table(self, name):
+        return self.tables[name]
+
+    def has_tables(self, tables):
+        """
+        Есть ли в файле все таблицы tables ({имя: [(колонка, тип), ...]}) с такими колонками -
+        хранилище, записанное прежней версией конвейера, может их не содержать.
+        """
+        return all(name in self.tables and
+                   all(self.tables[name].kinds.get(column) == kind for column, kind in columns)
+                   for name, columns in tables.items())
+
+    def term(self, term_id):
+        start = self._strings_offset + self._term_offsets[term_id]
+        end = self._strings_offset + self._term_offsets[term_id + 1]
+        return self._mm[start:end].decode("utf-8")
+
+    def terms(self, term_ids):
+        if self._vocabulary is not None:
+            return [self._vocabulary[term_id] for term_id in term_ids]
+        return [self.term(term_id) for term_id in term_ids]
+
+    def term_id(self, term):
+        """
+        id термина двоичным поиском по отсортированному словарю или None.
+        """
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            if self.term(self._sorted_ids[middle]) < term:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.term_count and self.term(self._sorted_ids[low]) == term:
+            return self._sorted_ids[low]
+        return None
+
+    def vocabulary(self):
+        """
+        Все термины в порядке id - для пакетных этапов, читающих весь файл. Список
+        декодируется один раз и дальше используется в terms() и document().
+        """
+        if self._vocabulary is None:
+            self._vocabulary = [self.term(term_id) for term_id in range(self.term_count)]
+        return self._vocabulary
+
+    def close(self):
+        """
+        Закрывает файл; memoryview, полученные из rows(), к этому моменту должны быть освобождены.
+        """
+        for table in self.tables.values():
+            table.doc_ids.release()
+            table._starts.release()
+            table._counts.release()
+            for column in table._columns.values():
+                column.release()
+        self._term_offsets.release()
+        self._sorted_ids.release()
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
@@ -0,0 +1,58 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Пакетное выполнение запросов (search_many у векторного и булева поиска).
+#
+# Повторяющиеся запросы журнала выполняются один раз, остальные делятся на пачки
+# по chunk_size: всё, что нужно на пачку (векторы запросов, декодированные постинги,
+# аккумуляторы), живёт только пока она обрабатывается, поэтому память ограничена
+# размером пачки, а не журнала. Пачки можно раздать пулу процессов: процессы
+# создаются через fork и получают уже загруженный поисковик (матрицы и индексы
+# открыты через mmap и разделяются со страницами родителя), поэтому индекс
+# не копируется и не загружается заново.
+
+DEFAULT_CHUNK_SIZE = 1000
+
+# Поисковик, чей метод вызывают процессы пула (наследуется при fork)
+_batch_owner = None
+
+
+def chunked(items, chunk_size):
+    return [items[start:start + chunk_size] for start in range(0, len(items), chunk_size)]
+
+
+def _run_chunk(method, chunk, args):
+    return getattr(_batch_owner, method)(chunk, *args)
+
+
+def fork_available():
+    return "fork" in multiprocessing.get_all_start_methods()
+
+
+def run_batches(owner, method, queries, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, args=()):
+    """
+    Выполняет owner.method(пачка, *args) для пачек различных запросов и возвращает
+    результаты в порядке queries (одинаковые запросы получают один и тот же результат).
+    workers > 1 - пачки выполняются в пуле из стольких процессов (только там, где есть fork).
+    """
+    unique = list(dict.fromkeys(queries))
+    chunks = chunked(unique, max(1, chunk_size))
+    if workers is None:
+        workers = 1
+    workers = min(workers, len(chunks))
+
+    if workers <= 1 or not fork_available():
+        results = [result for chunk in chunks for result in getattr(owner, method)(chunk, *args)]
+    else:
+        global _batch_owner
+        _batch_owner = owner
+        try:
+            context = multiprocessing.get_context("fork")
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                results = [result for chunk_results in executor.map(
+                    _run_chunk, [method] * len(chunks), chunks, [args] * len(chunks)) for result in chunk_results]
+        finally:
+            _batch_owner = None
+
+    by_query = dict(zip(unique, results))
+    return [by_query[query] for query in queries]
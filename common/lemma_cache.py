@@ -0,0 +1,131 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Кэш лемматизации, общий для токенизатора и поисковиков.
+# Частоты слов в корпусе распределены по Ципфу, поэтому большая часть
+# вызовов WordNetLemmatizer повторяет уже сделанную работу.
+# Кэш ограничен по размеру (LRU) и сохраняется на диск между запусками,
+# так что индексация и разбор запросов используют одни и те же леммы.
+# Один экземпляр разделяют потоки демо (gthread-воркеры gunicorn, пул сниппетов),
+# поэтому состояние LRU и счётчики меняются под блокировкой, как в common/cache.py.
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'lemma_cache.json')
+
+
+class IdentityLemmatizer:
+    """
+    Замена WordNetLemmatizer, когда данных WordNet нет: слово остаётся как есть.
+    """
+
+    def lemmatize(self, word):
+        return word
+
+
+def local_lemmatizer(quiet=False):
+    """
+    WordNetLemmatizer, если данные WordNet уже есть на диске, иначе IdentityLemmatizer.
+    Ничего не скачивает: данные ставятся один раз командой python -m nltk.downloader wordnet.
+    """
+    try:
+        import nltk
+        nltk.data.find('corpora/wordnet')
+    except (ImportError, LookupError):
+        if not quiet:
+            print("Данные WordNet не найдены локально, леммы совпадут со словами "
+                  "(установка: python -m nltk.downloader wordnet)")
+        return IdentityLemmatizer()
+    from nltk.stem import WordNetLemmatizer
+    return WordNetLemmatizer()
+
+
+class LemmaCache:
+
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, max_size=200_000, lemmatizer=None):
+        self.cache_file = cache_file
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._lemmatizer = lemmatizer
+        self._data = OrderedDict()
+        self._new_entries = {}
+        self._lock = threading.Lock()
+        if cache_file and os.path.exists(cache_file):
+            self.load()
+
+    @property
+    def lemmatizer(self):
+        # WordNet загружается только при первом промахе кэша, один раз на все потоки
+        if self._lemmatizer is None:
+            with self._lock:
+                if self._lemmatizer is None:
+                    self._lemmatizer = local_lemmatizer()
+        return self._lemmatizer
+
+    def lemmatize(self, word):
+        with self._lock:
+            lemma = self._data.get(word)
+            if lemma is not None:
+                self._data.move_to_end(word)
+                self.hits += 1
+                return lemma
+            self.misses += 1
+        # WordNet вызывается без блокировки: промах в одном потоке не задерживает остальные
+        lemma = self.lemmatizer.lemmatize(word)
+        with self._lock:
+            self._put(word, lemma)
+            self._new_entries[word] = lemma
+        return lemma
+
+    def _put(self, word, lemma):
+        # вызывается под self._lock
+        self._data[word] = lemma
+        self._data.move_to_end(word)
+        while len(self._data) > self.max_size:
+            self._data.popitem(last=False)
+
+    def pop_new_entries(self):
+        """
+        Леммы, вычисленные с момента прошлого вызова.
+        Нужны, чтобы собрать в один кэш результаты процессов-обработчиков.
+        """
+        with self._lock:
+            new_entries = self._new_entries
+            self._new_entries = {}
+        return new_entries
+
+    def update(self, entries):
+        with self._lock:
+            for word, lemma in entries.items():
+                self._put(word, lemma)
+
+    def load(self):
+        with open(self.cache_file, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        with self._lock:
+            for word, lemma in entries:
+                self._put(word, lemma)
+
+    def save(self):
+        # Без WordNet леммы не настоящие - не сохраняем их, чтобы не испортить кэш
+        if not self.cache_file or isinstance(self._lemmatizer, IdentityLemmatizer):
+            return
+        with self._lock:
+            entries = list(self._data.items())
+        tmp_file = self.cache_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(tmp_file, self.cache_file)
+
+    def stats(self):
+        with self._lock:
+            hits, misses, size = self.hits, self.misses, len(self._data)
+        total = hits + misses
+        return {
+            "size": size,
+            "max_size": self.max_size,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / total if total else 0.0,
+        }
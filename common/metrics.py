@@ -0,0 +1,340 @@
+import contextvars
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Counter
+from contextlib import contextmanager
+
+# Лёгкая инструментация: счётчики и гистограммы задержек в реестре процесса,
+# отрезки (span) вокруг этапов выполнения запроса и пакетных этапов конвейера
+# и выборочный профилировщик медленных запросов.
+#
+# Реестр выводится в текстовом формате Prometheus: демо отдаёт его на /metrics,
+# пакетные скрипты в конце работы записывают его в файл metrics.prom
+# (формат textfile collector у node_exporter).
+
+# Границы корзин гистограмм задержек, секунд
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """
+    Монотонно растущий счётчик с метками: inc(stage="parse").
+    """
+
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(tuple(labels.get(name, "") for name in self.labelnames), 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Histogram:
+    """
+    Гистограмма значений (обычно секунд) с корзинами buckets: observe(0.012, stage="score").
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for position, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][position] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, **labels):
+        entry = self._values.get(tuple(labels.get(name, "") for name in self.labelnames))
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._values.items())
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + "_bucket", _format_labels(self.labelnames, key, [("le", _format_value(bound))]), cumulative
+            yield self.name + "_bucket", _format_labels(self.labelnames, key, [("le", "+Inf")]), count
+            yield self.name + "_sum", _format_labels(self.labelnames, key), total
+            yield self.name + "_count", _format_labels(self.labelnames, key), count
+
+
+class Gauge:
+    """
+    Значение, вычисляемое при выводе: function() возвращает число
+    или {кортеж значений меток: число} - например, размеры и попадания кэшей.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+
+    def samples(self):
+        values = self.function()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for key, value in sorted(values.items()):
+            if value is not None:
+                yield self.name, _format_labels(self.labelnames, key), value
+
+
+class Registry:
+    """
+    Метрики процесса. Повторная регистрация метрики с тем же именем возвращает
+    уже существующую, поэтому модули могут объявлять метрики независимо.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, function, labelnames=()):
+        """
+        Вычисляемая метрика; при повторной регистрации функция заменяется (например, новым приложением).
+        """
+        with self._lock:
+            self._metrics[name] = Gauge(name, documentation, function, labelnames)
+            return self._metrics[name]
+
+    def render(self):
+        """
+        Все метрики в текстовом формате Prometheus (версия 0.0.4).
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda metric: metric.name)
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in metric.samples())
+        return "\n".join(lines) + "\n"
+
+    def write_textfile(self, filename):
+        tmp_file = filename + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            f.write(self.render())
+        os.replace(tmp_file, filename)
+
+
+REGISTRY = Registry()
+
+QUERY_STAGE_SECONDS = REGISTRY.histogram(
+    "search_stage_seconds", "Время этапов выполнения поискового запроса", ("stage",))
+BATCH_STAGE_SECONDS = REGISTRY.histogram(
+    "batch_stage_seconds", "Время обработки одного элемента на этапе конвейера", ("stage",))
+BATCH_ITEMS = REGISTRY.counter(
+    "batch_items_total", "Обработано элементов на этапе конвейера", ("stage",))
+
+
+class Trace:
+    """
+    Отрезки времени одного запроса: {этап: миллисекунды} в порядке первого появления.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.spans = {}
+
+    def add(self, name, seconds):
+        self.spans[name] = self.spans.get(name, 0.0) + seconds
+
+    def breakdown(self):
+        timings = {name: round(seconds * 1000, 3) for name, seconds in self.spans.items()}
+        timings["total"] = round((time.perf_counter() - self.started) * 1000, 3)
+        return timings
+
+
+_current_trace = contextvars.ContextVar("trace", default=None)
+
+
+@contextmanager
+def trace():
+    """
+    Собирает отрезки, выполненные внутри блока в этом потоке, для разбивки времени запроса (debug=1).
+    """
+    current = Trace()
+    token = _current_trace.set(current)
+    try:
+        yield current
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(name, histogram=QUERY_STAGE_SECONDS):
+    """
+    Замеряет блок: время попадает в гистограмму с меткой stage=name
+    и в разбивку текущего запроса, если она собирается.
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        histogram.observe(elapsed, stage=name)
+        current = _current_trace.get()
+        if current is not None:
+            current.add(name, elapsed)
+
+
+def record_batch(stage, seconds, items=1):
+    """
+    Время обработки элемента пакетного этапа (страницы, документа, шарда).
+    """
+    BATCH_STAGE_SECONDS.observe(seconds, stage=stage)
+    BATCH_ITEMS.inc(items, stage=stage)
+
+
+@contextmanager
+def batch_span(stage, items=1):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_batch(stage, time.perf_counter() - started, items)
+
+
+class SlowQueryProfiler:
+    """
+    Выборочный профилировщик медленных запросов.
+
+    Пока выполняется блок profile(), отдельный поток раз в interval секунд снимает
+    стек потока запроса (sys._current_frames). Если запрос длился дольше threshold
+    секунд, стеки записываются в output_dir в свёрнутом формате ("f1;f2;f3 число"),
+    который понимают flamegraph.pl и speedscope; строка о запросе дописывается в
+    slow_queries.log. Быстрые запросы ничего не пишут, а без активных запросов
+    поток выборки спит.
+    """
+
+    def __init__(self, threshold, output_dir, interval=0.002, max_dumps=1000):
+        self.threshold = threshold
+        self.output_dir = output_dir
+        self.interval = interval
+        self.max_dumps = max_dumps
+        self.dumps = 0
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._pid = None
+        self.slow_queries = REGISTRY.counter("search_slow_queries_total", "Запросы дольше порога профилировщика")
+
+    def _ensure_sampler(self):
+        # Поток выборки создаётся в каждом процессе (после fork потоки родителя не наследуются)
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._pid = os.getpid()
+                    threading.Thread(target=self._sample_loop, daemon=True).start()
+
+    def _sample_loop(self):
+        while True:
+            self._wakeup.wait()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                active = list(self._active.items())
+                if not active:
+                    self._wakeup.clear()
+            for thread_id, samples in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    samples[self._stack(frame)] += 1
+
+    @staticmethod
+    def _stack(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    @contextmanager
+    def profile(self, label):
+        self._ensure_sampler()
+        thread_id = threading.get_ident()
+        samples = _Counter()
+        with self._lock:
+            self._active[thread_id] = samples
+        self._wakeup.set()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._active.pop(thread_id, None)
+            if elapsed >= self.threshold:
+                self.slow_queries.inc()
+                if samples and self.dumps < self.max_dumps:
+                    self._dump(label, elapsed, samples)
+
+    def _dump(self, label, elapsed, samples):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self.dumps += 1
+        filename = f"slow_{time.strftime('%Y%m%d_%H%M%S')}_{os.getpid()}_{self.dumps}.folded"
+        with open(os.path.join(self.output_dir, filename), "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in samples.most_common())
+        with open(os.path.join(self.output_dir, "slow_queries.log"), "a", encoding="utf-8") as f:
+            f.write(f"{time.strftime('%Y-%m-%dT%H:%M:%S')}\t{elapsed * 1000:.1f} ms\t{filename}\t{label!r}\n")
@@ -0,0 +1,119 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+# Шардирование по документам: документ doc_id попадает в шард doc_id % shard_count.
+# Шарды строятся и опрашиваются параллельно; каждый процесс пула открывает
+# файлы шардов один раз (mmap) и держит их открытыми между запросами.
+
+
+def shard_of(doc_id, shard_count):
+    return doc_id % shard_count
+
+
+def split_by_shard(doc_ids, shard_count):
+    """
+    Разбивает id документов на shard_count списков.
+    """
+    shards = [[] for _ in range(shard_count)]
+    for doc_id in doc_ids:
+        shards[shard_of(doc_id, shard_count)].append(doc_id)
+    return shards
+
+
+def shard_filename(filename, shard, shard_count):
+    """
+    inverted_index.bin -> inverted_index.shard1-of-4.bin
+    """
+    base, extension = os.path.splitext(filename)
+    return f"{base}.shard{shard}-of-{shard_count}{extension}"
+
+
+def find_shard_files(filename):
+    """
+    Файлы шардов для filename (по одному полному набору), упорядоченные по номеру шарда.
+    Пустой список, если шардов нет.
+    """
+    directory = os.path.dirname(filename) or "."
+    base, extension = os.path.splitext(os.path.basename(filename))
+    prefix = base + ".shard"
+    counts = set()
+    if os.path.isdir(directory):
+        for name in os.listdir(directory):
+            if name.startswith(prefix) and name.endswith(extension) and "-of-" in name:
+                try:
+                    counts.add(int(name[len(prefix):-len(extension) or None].split("-of-")[1]))
+                except ValueError:
+                    continue
+    for shard_count in sorted(counts, reverse=True):
+        files = [shard_filename(filename, shard, shard_count) for shard in range(shard_count)]
+        if all(os.path.exists(path) for path in files):
+            return files
+    return []
+
+
+# Открытые шарды процесса: (функция открытия, путь) -> объект шарда
+_open_shards = {}
+_open_lock = threading.Lock()
+
+
+def _get_shard(opener, path):
+    key = (opener, path)
+    shard = _open_shards.get(key)
+    if shard is None:
+        with _open_lock:
+            shard = _open_shards.get(key)
+            if shard is None:
+                shard = opener(path)
+                _open_shards[key] = shard
+    return shard
+
+
+def _call_shard(opener, path, method, args):
+    return getattr(_get_shard(opener, path), method)(*args)
+
+
+class ShardPool:
+    """
+    Параллельный опрос шардов (scatter-gather).
+
+    opener(path) - функция уровня модуля, открывающая шард; объект шарда кэшируется
+    в каждом процессе пула. scatter(method, *args) вызывает метод на всех шардах
+    одновременно и возвращает результаты в порядке шардов.
+
+    executor="process" - пул процессов (запросы по разным шардам идут на разных ядрах),
+    executor="thread" - пул потоков (без копирования данных между процессами,
+    выгоден для маленьких шардов), executor="serial" - по очереди в текущем потоке.
+    """
+
+    def __init__(self, shard_files, opener, workers=None, executor="process"):
+        self.shard_files = list(shard_files)
+        self.opener = opener
+        self.executor_type = executor
+        workers = workers or min(len(self.shard_files), os.cpu_count() or 1)
+        if executor == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        elif executor == "thread":
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            self.executor = None
+
+    def scatter(self, method, *args):
+        if self.executor is None:
+            return [_call_shard(self.opener, path, method, args) for path in self.shard_files]
+        futures = [self.executor.submit(_call_shard, self.opener, path, method, args)
+                   for path in self.shard_files]
+        return [future.result() for future in futures]
+
+    def local(self, shard):
+        """
+        Шард, открытый в текущем процессе (для статистик и отладки).
+        """
+        return _get_shard(self.opener, self.shard_files[shard])
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+    def __len__(self):
+        return len(self.shard_files)
@@ -0,0 +1,238 @@
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+# Версионированные снимки индекса.
+#
+# Папка снимков:
+#   v1/, v2/, ...   - неизменяемые версии: файлы индекса и manifest.json
+#                     (версия, время создания, размеры и sha1 файлов)
+#   CURRENT         - имя текущей версии; заменяется атомарно (os.replace),
+#                     поэтому читатель видит либо старую, либо новую версию целиком
+#
+# Версия сначала собирается во временной папке и переименовывается только
+# после записи манифеста, так что незаконченная версия никогда не становится текущей.
+
+CURRENT_FILE = "CURRENT"
+MANIFEST_FILE = "manifest.json"
+
+
+def _file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def list_versions(root):
+    versions = []
+    if os.path.isdir(root):
+        for name in os.listdir(root):
+            if name.startswith("v") and name[1:].isdigit() and os.path.isdir(os.path.join(root, name)):
+                versions.append(int(name[1:]))
+    return sorted(versions)
+
+
+def current_version(root):
+    """
+    Номер текущей версии или None, если снимков нет.
+    """
+    try:
+        with open(os.path.join(root, CURRENT_FILE), "r", encoding="utf-8") as f:
+            name = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return int(name[1:]) if name.startswith("v") and name[1:].isdigit() else None
+
+
+def snapshot_dir(root, version):
+    return os.path.join(root, f"v{version}")
+
+
+def read_manifest(root, version):
+    with open(os.path.join(snapshot_dir(root, version), MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def set_current(root, version):
+    """
+    Атомарно делает version текущей (в том числе для отката на старую версию).
+    """
+    if not os.path.exists(os.path.join(snapshot_dir(root, version), MANIFEST_FILE)):
+        raise ValueError(f"Версия v{version} не найдена в {root}")
+    tmp_file = os.path.join(root, CURRENT_FILE + ".tmp")
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        f.write(f"v{version}\n")
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_file, os.path.join(root, CURRENT_FILE))
+
+
+def publish_snapshot(root, files, make_current=True):
+    """
+    Копирует файлы индекса {имя в снимке: исходный путь} в новую версию
+    и (по умолчанию) делает её текущей. Возвращает номер версии.
+    """
+    os.makedirs(root, exist_ok=True)
+    versions = list_versions(root)
+    version = (versions[-1] if versions else 0) + 1
+    tmp_dir = os.path.join(root, f".v{version}.tmp")
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    manifest = {"version": version, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "files": {}}
+    for name, source in files.items():
+        target = os.path.join(tmp_dir, name)
+        # Копия, а не жёсткая ссылка: построители перезаписывают файлы на месте
+        shutil.copyfile(source, target)
+        manifest["files"][name] = {"size": os.path.getsize(target), "sha1": _file_digest(target)}
+    with open(os.path.join(tmp_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=1)
+
+    os.rename(tmp_dir, snapshot_dir(root, version))
+    if make_current:
+        set_current(root, version)
+    return version
+
+
+def prune_snapshots(root, keep=3):
+    """
+    Удаляет старые версии, оставляя keep последних и текущую.
+    """
+    current = current_version(root)
+    versions = list_versions(root)
+    removed = []
+    for version in versions[:-keep] if keep else versions:
+        if version != current:
+            shutil.rmtree(snapshot_dir(root, version), ignore_errors=True)
+            removed.append(version)
+    return removed
+
+
+class SnapshotHolder:
+    """
+    Текущий загруженный снимок индекса с горячей перезагрузкой.
+
+    loader(snapshot_path, version) строит объект поиска по папке версии.
+    get() возвращает текущий объект: запрос берёт ссылку один раз и работает
+    с ней до конца, поэтому при смене версии начатые запросы дорабатывают
+    на старом снимке, а новые сразу получают новый.
+
+    reload() строит новый объект (в фоне - reload_async) и заменяет ссылку
+    одним присваиванием. Одновременно строится не больше одной версии, поэтому
+    в памяти живут не более двух снимков: текущий и старый, пока его держат
+    незавершённые запросы.
+    """
+
+    def __init__(self, root, loader, initial=None, initial_version=None):
+        self.root = root
+        self.loader = loader
+        self.version = initial_version
+        self.current = initial
+        self.reloads = 0
+        self.last_error = None
+        self._reload_lock = threading.Lock()
+        self._pid = None
+        self._watcher = None
+        if self.current is None:
+            self.reload()
+
+    def get(self):
+        return self.current
+
+    def reload(self, version=None):
+        """
+        Загружает версию (по умолчанию текущую по CURRENT), если она отличается от загруженной.
+        Возвращает True, если объект заменён.
+        """
+        with self._reload_lock:
+            version = version if version is not None else current_version(self.root)
+            if version is None or version == self.version:
+                return False
+            try:
+                loaded = self.loader(snapshot_dir(self.root, version), version)
+            except Exception as e:
+                self.last_error = f"v{version}: {e}"
+                print(f"Не удалось загрузить снимок v{version}: {e}")
+                return False
+            self.swap(loaded, version)
+            self.last_error = None
+            return True
+
+    def swap(self, loaded, version):
+        """
+        Подменяет текущий объект уже построенным (одно присваивание ссылки).
+        """
+        self.current = loaded
+        self.version = version
+        self.reloads += 1
+
+    def reload_async(self, version=None):
+        thread = threading.Thread(target=self.reload, args=(version,), daemon=True)
+        thread.start()
+        return thread
+
+    def watch(self, interval):
+        """
+        Запускает поток, который раз в interval секунд проверяет CURRENT и подхватывает новую версию.
+        Поток создаётся заново в каждом процессе (после fork потоки родителя не наследуются).
+        """
+        if self._pid == os.getpid() and self._watcher is not None and self._watcher.is_alive():
+            return
+
+        def poll():
+            while True:
+                time.sleep(interval)
+                if current_version(self.root) not in (None, self.version):
+                    self.reload()
+
+        self._pid = os.getpid()
+        self._watcher = threading.Thread(target=poll, daemon=True)
+        self._watcher.start()
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "current_version": current_version(self.root),
+            "reloads": self.reloads,
+            "last_error": self.last_error,
+        }
+
+
+def main():
+    """
+    python snapshots.py publish <папка снимков> <файл> [<файл> ...]
+    python snapshots.py list <папка снимков>
+    python snapshots.py rollback <папка снимков> <версия>
+    python snapshots.py prune <папка снимков> [сколько оставить]
+    """
+    if len(sys.argv) < 3:
+        print(main.__doc__)
+        return
+    command, root = sys.argv[1], sys.argv[2]
+    if command == "publish":
+        version = publish_snapshot(root, {os.path.basename(path): path for path in sys.argv[3:]})
+        print(f"Опубликована версия v{version}")
+    elif command == "list":
+        current = current_version(root)
+        for version in list_versions(root):
+            manifest = read_manifest(root, version)
+            marker = "*" if version == current else " "
+            print(f"{marker} v{version}  {manifest['created']}  {', '.join(sorted(manifest['files']))}")
+    elif command == "rollback":
+        set_current(root, int(sys.argv[3].lstrip("v")))
+        print(f"Текущая версия: {sys.argv[3]}")
+    elif command == "prune":
+        removed = prune_snapshots(root, int(sys.argv[3]) if len(sys.argv) > 3 else 3)
+        print(f"Удалены версии: {', '.join(f'v{v}' for v in removed) or 'нет'}")
+    else:
+        print(main.__doc__)
+
+
+if __name__ == "__main__":
+    main()
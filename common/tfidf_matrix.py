@@ -0,0 +1,199 @@
+import heapq
+import mmap
+import os
+import struct
+import sys
+import tempfile
+from array import array
+
+# Бинарная матрица TF-IDF по леммам, упорядоченная по терминам (CSC):
+# постинги каждого термина лежат подряд, поэтому VectorSearchEngine
+# открывает файл через mmap и берёт id документов и веса как memoryview
+# без разбора текста и без копирования.
+#
+# Формат файла tfidf_lemmas.bin:
+#   заголовок  - MAGIC, версия формата, число терминов, документов и постингов,
+#                смещения секций
+#   документы  - doc_count норм векторов (d), затем doc_count id документов (I)
+#   словарь    - term_count записей (смещение строки, длина строки, начало постингов,
+#                число постингов, idf, максимум weight / norm по постингам)
+#   строки     - термины в UTF-8 подряд
+#   постинги   - posting_count id документов (I), затем posting_count весов (d)
+MAGIC = b"ITTF"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIQQQQQ")
+ENTRY = struct.Struct("<QHQIdd")
+RECORD = struct.Struct("<IId")
+# Память на одну тройку в буфере ExternalSorter: кортеж, два int, float и указатель в списке -
+# в несколько раз больше RECORD.size, поэтому бюджет памяти делится на эту величину
+BUFFERED_RECORD_SIZE = (sys.getsizeof((0, 0, 0.0)) + 2 * sys.getsizeof(2 ** 20) + sys.getsizeof(0.0)
+                        + struct.calcsize("P"))
+
+
+class ExternalSorter:
+    """
+    Сортирует тройки (term_id, doc_id, weight) при ограниченной памяти:
+    когда буфер превышает memory_budget байт, он сортируется и сбрасывается
+    во временный файл; итоговый порядок получается слиянием этих файлов.
+    """
+
+    def __init__(self, memory_budget=64 * 1024 * 1024, tmp_dir=None):
+        self.max_records = max(1, memory_budget // BUFFERED_RECORD_SIZE)
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.runs = []
+
+    def add(self, term_id, doc_id, weight):
+        self.buffer.append((term_id, doc_id, weight))
+        if len(self.buffer) >= self.max_records:
+            self._spill()
+
+    def _spill(self):
+        self.buffer.sort()
+        run = tempfile.TemporaryFile(dir=self.tmp_dir)
+        for record in self.buffer:
+            run.write(RECORD.pack(*record))
+        run.seek(0)
+        self.runs.append(run)
+        self.buffer = []
+
+    @staticmethod
+    def _read_run(run):
+        while True:
+            chunk = run.read(RECORD.size * 4096)
+            if not chunk:
+                break
+            yield from RECORD.iter_unpack(chunk)
+        run.close()
+
+    def sorted_records(self):
+        self.buffer.sort()
+        streams = [self._read_run(run) for run in self.runs]
+        streams.append(iter(self.buffer))
+        return heapq.merge(*streams)
+
+
+def write_tfidf_matrix(matrix_filename, terms, idf, doc_norms, sorted_records):
+    """
+    Записывает матрицу. terms - термины по возрастанию term_id, idf - их IDF,
+    doc_norms - {doc_id: норма вектора}, sorted_records - тройки
+    (term_id, doc_id, weight) в порядке (term_id, doc_id).
+    """
+    doc_ids = array("I", sorted(doc_norms))
+    norms = array("d", (doc_norms[doc_id] for doc_id in doc_ids))
+
+    posting_doc_ids = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(matrix_filename)))
+    posting_weights = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(matrix_filename)))
+    starts = [0] * len(terms)
+    counts = [0] * len(terms)
+    max_weights = [0.0] * len(terms)
+    posting_count = 0
+    doc_buffer = array("I")
+    weight_buffer = array("d")
+    for term_id, doc_id, weight in sorted_records:
+        if counts[term_id] == 0:
+            starts[term_id] = posting_count
+        counts[term_id] += 1
+        posting_count += 1
+        norm = doc_norms[doc_id]
+        if norm:
+            max_weights[term_id] = max(max_weights[term_id], weight / norm)
+        doc_buffer.append(doc_id)
+        weight_buffer.append(weight)
+        if len(doc_buffer) >= 65536:
+            doc_buffer.tofile(posting_doc_ids)
+            weight_buffer.tofile(posting_weights)
+            doc_buffer = array("I")
+            weight_buffer = array("d")
+    doc_buffer.tofile(posting_doc_ids)
+    weight_buffer.tofile(posting_weights)
+
+    term_blob = bytearray()
+    entries = []
+    for term_id, term in enumerate(terms):
+        encoded_term = term.encode("utf-8")
+        entries.append((len(term_blob), len(encoded_term), starts[term_id], counts[term_id],
+                        idf[term_id], max_weights[term_id]))
+        term_blob += encoded_term
+
+    docs_offset = HEADER.size
+    dictionary_offset = docs_offset + len(doc_ids) * (doc_ids.itemsize + norms.itemsize)
+    terms_offset = dictionary_offset + ENTRY.size * len(entries)
+    # постинги выравниваются по 8 байт, чтобы веса (d) читались без копирования
+    postings_offset = (terms_offset + len(term_blob) + 7) // 8 * 8
+    weights_offset = postings_offset + posting_count * 4
+    weights_offset = (weights_offset + 7) // 8 * 8
+
+    tmp_filename = matrix_filename + ".tmp"
+    with open(tmp_filename, "wb") as matrix_file:
+        matrix_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(terms), len(doc_ids),
+                                      posting_count, dictionary_offset, terms_offset,
+                                      postings_offset, weights_offset))
+        norms.tofile(matrix_file)
+        doc_ids.tofile(matrix_file)
+        for entry in entries:
+            matrix_file.write(ENTRY.pack(*entry))
+        matrix_file.write(term_blob)
+        for part, offset in ((posting_doc_ids, postings_offset), (posting_weights, weights_offset)):
+            matrix_file.write(b"\0" * (offset - matrix_file.tell()))
+            part.seek(0)
+            while True:
+                chunk = part.read(1024 * 1024)
+                if not chunk:
+                    break
+                matrix_file.write(chunk)
+            part.close()
+    os.replace(tmp_filename, matrix_filename)
+
+
+class TfidfMatrix:
+    """
+    Матрица TF-IDF, открытая через mmap.
+    """
+
+    def __init__(self, matrix_filename):
+        self.matrix_filename = matrix_filename
+        self._file = open(matrix_filename, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, _flags, self.term_count, self.doc_count, self.posting_count,
+         dictionary_offset, terms_offset, postings_offset, weights_offset) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Файл {matrix_filename} не является матрицей TF-IDF")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Неподдерживаемая версия матрицы TF-IDF: {version}")
+
+        view = memoryview(self._mm)
+        norms_offset = HEADER.size
+        docs_offset = norms_offset + self.doc_count * 8
+        self.doc_norms = view[norms_offset:docs_offset].cast("d")
+        self.doc_ids = view[docs_offset:docs_offset + self.doc_count * 4].cast("I")
+        self._posting_doc_ids = view[postings_offset:postings_offset + self.posting_count * 4].cast("I")
+        self._posting_weights = view[weights_offset:weights_offset + self.posting_count * 8].cast("d")
+        self._dictionary_offset = dictionary_offset
+        self._terms_offset = terms_offset
+
+    def close(self):
+        for name in ("doc_ids", "doc_norms", "_posting_doc_ids", "_posting_weights"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+        self._mm.close()
+        self._file.close()
+
+    def terms(self):
+        """
+        Перебирает (term, idf, max_weight, doc_ids, weights); doc_ids и weights -
+        memoryview на участки файла.
+        """
+        for term_id in range(self.term_count):
+            (term_offset, term_length, start, count,
+             idf, max_weight) = ENTRY.unpack_from(self._mm, self._dictionary_offset + ENTRY.size * term_id)
+            start_term = self._terms_offset + term_offset
+            term = self._mm[start_term:start_term + term_length].decode("utf-8")
+            yield (term, idf, max_weight,
+                   self._posting_doc_ids[start:start + count],
+                   self._posting_weights[start:start + count])
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import math
+import os
+
+
+class BloomFilter:
+    """
+    Множество просмотренных URL с заданной вероятностью ложного срабатывания.
+    Хранит около -ln(p) / ln(2)^2 бит на элемент вместо целой строки URL.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bit_count = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.bit_count / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_count + 7) // 8)
+        self.count = 0
+
+    def _positions(self, item: str):
+        digest = hashlib.blake2b(item.encode("utf-8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "little")
+        second = int.from_bytes(digest[8:], "little") | 1
+        for i in range(self.hash_count):
+            yield (first + i * second) % self.bit_count
+
+    def add(self, item: str):
+        for position in self._positions(item):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, item: str) -> bool:
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+
+class IndexLog:
+    """Буферизованная запись строк "номер: URL" в index.txt (файл открывается один раз)."""
+
+    def __init__(self, path: str, buffer_size: int = 64 * 1024):
+        self.path = path
+        self.file = open(path, "a", encoding="utf-8", buffering=buffer_size)
+
+    def write(self, index: int, url: str):
+        self.file.write(f"{index}: {url}\n")
+
+    def flush(self) -> int:
+        """Сбрасывает буфер на диск и возвращает размер файла."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        return self.file.tell()
+
+    def close(self):
+        self.file.close()
+
+    @staticmethod
+    def truncate(path: str, size: int):
+        """Обрезает лог до размера на момент контрольной точки (записи после неё будут повторены)."""
+        if os.path.exists(path) and os.path.getsize(path) > size:
+            with open(path, "r+b") as f:
+                f.truncate(size)
+
+
+class CrawlState:
+    """
+    Состояние обхода, которое сохраняется в контрольных точках:
+    фильтр просмотренных URL, очередь (вместе со страницами, которые скачивались
+    в момент сохранения), число сохранённых страниц и размер index.txt.
+
+    Файлы в папке state_dir:
+        seen.bloom  - биты фильтра Блума
+        state.json  - параметры фильтра, очередь, счётчики
+    """
+
+    def __init__(self, state_dir: str, capacity: int, error_rate: float, mode: str = "crawl"):
+        self.state_dir = state_dir
+        self.mode = mode
+        self.seen = BloomFilter(capacity, error_rate)
+        self.saved = 0
+        self.index_log_size = 0
+        self.frontier = []
+
+    @property
+    def _state_file(self):
+        return os.path.join(self.state_dir, "state.json")
+
+    @property
+    def _bloom_file(self):
+        return os.path.join(self.state_dir, "seen.bloom")
+
+    def exists(self) -> bool:
+        return os.path.exists(self._state_file) and os.path.exists(self._bloom_file)
+
+    def save(self, frontier_entries, saved: int, index_log_size: int):
+        """frontier_entries - список (depth, inlinks, url)."""
+        os.makedirs(self.state_dir, exist_ok=True)
+        tmp_bloom = self._bloom_file + ".tmp"
+        with open(tmp_bloom, "wb") as f:
+            f.write(self.seen.bits)
+        state = {
+            "mode": self.mode,
+            "capacity": self.seen.capacity,
+            "error_rate": self.seen.error_rate,
+            "seen_count": self.seen.count,
+            "saved": saved,
+            "index_log_size": index_log_size,
+            "frontier": [list(entry) for entry in frontier_entries],
+        }
+        tmp_state = self._state_file + ".tmp"
+        with open(tmp_state, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        # state.json заменяется последним: он ссылается на уже записанный фильтр
+        os.replace(tmp_bloom, self._bloom_file)
+        os.replace(tmp_state, self._state_file)
+
+    def clear(self):
+        """Удаляет контрольную точку завершённого обхода."""
+        for path in (self._state_file, self._bloom_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def saved_mode(self) -> str:
+        """Режим (первичный обход или повторный), в котором сохранена контрольная точка."""
+        with open(self._state_file, "r", encoding="utf-8") as f:
+            return json.load(f).get("mode", "crawl")
+
+    def load(self):
+        with open(self._state_file, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        self.mode = state.get("mode", "crawl")
+        self.seen = BloomFilter(state["capacity"], state["error_rate"])
+        with open(self._bloom_file, "rb") as f:
+            self.seen.bits = bytearray(f.read())
+        self.seen.count = state["seen_count"]
+        self.saved = state["saved"]
+        self.index_log_size = state["index_log_size"]
+        self.frontier = [tuple(entry) for entry in state["frontier"]]
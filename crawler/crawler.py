@@ -1,111 +1,346 @@
 import os
 import asyncio
+import json
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 
-import aiofiles
 import aiohttp
 from aiohttp import ClientSession
-from bs4 import BeautifulSoup
-from urllib.parse import urljoin, urlparse, urldefrag
+from urllib.parse import urlparse
+
+from crawl_state import CrawlState, IndexLog
+from html_processing import BACKEND, normalize_url, process_html, process_page
+from url_metadata import UrlMetadata, text_hash
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.metrics import REGISTRY, record_batch
 
 # Начальная страница
 START_URL = "https://kpop.fandom.com/wiki/BTS"
 INDEX_FILE = "index.txt"
 OUTPUT_FOLDER = "downloaded_pages"
+# Текст страниц, извлечённый при разборе (используется токенизатором вместо повторного разбора HTML)
+TEXTS_FOLDER = "downloaded_texts"
 MAX_PAGES = 200
 CONCURRENT_REQUESTS = 10
+# Число процессов для разбора HTML
+PARSE_WORKERS = os.cpu_count() or 1
+# Не больше стольких запросов в секунду к одному хосту
+PER_HOST_RATE = 10.0
+# Как часто печатать скорость обхода, секунд
+PROGRESS_INTERVAL = 10
+# Папка с контрольными точками обхода; если она есть, обход продолжается с последней точки
+STATE_DIR = "crawl_state"
+# Сохранять контрольную точку каждые CHECKPOINT_INTERVAL страниц
+CHECKPOINT_INTERVAL = 50
+# Метаданные URL (номера документов, ETag, Last-Modified, хэши текста) для повторного обхода
+METADATA_FILE = "url_metadata.json"
+# Список изменённых документов последнего обхода для построителей индексов
+CHANGES_FILE = "changes.json"
+# Параметры фильтра просмотренных URL: ожидаемое число URL и доля ложных срабатываний
+EXPECTED_URLS = 1_000_000
+SEEN_FALSE_POSITIVE_RATE = 0.001
+# Метрики обхода (время скачивания и разбора страниц) в формате Prometheus, пишутся в конце обхода
+METRICS_FILE = "metrics.prom"
 
 # Создаем папку для скачанных страниц
 os.makedirs(OUTPUT_FOLDER, exist_ok=True)
+os.makedirs(TEXTS_FOLDER, exist_ok=True)
+
+
+class HostRateLimiter:
+    """Равномерно распределяет запросы к каждому хосту: не чаще rate запросов в секунду."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self.next_slot = {}
+
+    async def wait(self, url: str):
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        now = time.monotonic()
+        slot = max(now, self.next_slot.get(host, now))
+        self.next_slot[host] = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
 
-# Храним посещенные страницы
-visited_urls = set()
-to_visit = set([START_URL])
-semaphore = asyncio.Semaphore(CONCURRENT_REQUESTS)
+rate_limiter = HostRateLimiter(PER_HOST_RATE)
 
 
-async def fetch(url: str, session: ClientSession):
-    """Асинхронная загрузка страницы."""
+async def fetch(url: str, session: ClientSession, headers=None):
+    """
+    Асинхронная загрузка страницы. Возвращает (HTTP-статус, HTML, ETag, Last-Modified);
+    для 304 и ошибок HTML равен None.
+    """
     try:
-        async with semaphore:
-            async with session.get(url, timeout=10) as response:
-                response.raise_for_status()
-                return await response.text()
+        await rate_limiter.wait(url)
+        async with session.get(url, timeout=10, headers=headers or {}) as response:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+            if response.status in (304, 404, 410):
+                return response.status, None, etag, last_modified
+            response.raise_for_status()
+            return response.status, await response.text(), etag, last_modified
     except Exception as e:
         print(f"Ошибка при скачивании {url}: {e}")
-        return None
+        return None, None, None, None
 
 
-def clean_html(text: str) -> str:
-    """Удаляет ненужные теги (JS, стили, метаданные) из HTML."""
-    soup = BeautifulSoup(text, "html.parser")
-    for tag in soup(["script", "style", "link", "meta"]):
-        tag.decompose()
-    return str(soup)
+def save_page(index: int, url: str, html: str, text: str, index_log):
+    """
+    Сохраняет HTML-страницу и её текст и добавляет запись в индексный файл (если index_log задан).
+    Выполняется без await, чтобы контрольная точка не застала страницу сохранённой наполовину.
+    """
+    file_name = f"page_{index}.txt"
+    file_path = os.path.join(OUTPUT_FOLDER, file_name)
+    with open(file_path, "w", encoding="utf-8") as file:
+        file.write(html)
+    with open(os.path.join(TEXTS_FOLDER, file_name), "w", encoding="utf-8") as file:
+        file.write(text)
 
+    if index_log is not None:
+        index_log.write(index, url)
 
-def extract_links(base_url: str, html: str) -> set:
-    """Извлекает ссылки на страницы, убирает фрагменты (#section), параметры (?query=), исключает редиректы и файлы."""
-    soup = BeautifulSoup(html, "html.parser")
-    links = set()
+    print(f"[✓] Страница {index} сохранена: {url}")
 
-    excluded_extensions = {".jpg", ".jpeg", ".png", ".gif", ".svg", ".pdf",
-                           ".doc", ".docx", ".xls", ".xlsx", ".mp4", ".mp3", ".zip"}
 
-    for a_tag in soup.find_all("a", href=True):
-        full_link = urljoin(base_url, a_tag["href"])  # Преобразуем относительные ссылки в абсолютные
-        clean_link, _ = urldefrag(full_link)  # Удаляем fragment
-        parsed = urlparse(clean_link)
+def remove_page(index: int):
+    for folder in (OUTPUT_FOLDER, TEXTS_FOLDER):
+        file_path = os.path.join(folder, f"page_{index}.txt")
+        if os.path.exists(file_path):
+            os.remove(file_path)
 
-        # Убираем параметры запроса (?query=123)
-        clean_link = f"{parsed.scheme}://{parsed.netloc}{parsed.path}"
 
-        # Проверяем, не является ли ссылка файлом
-        if (any(clean_link.lower().endswith(ext) for ext in excluded_extensions) or "file" in clean_link.lower()):
-            continue
+def read_saved_page(index: int) -> str:
+    with open(os.path.join(OUTPUT_FOLDER, f"page_{index}.txt"), "r", encoding="utf-8") as file:
+        return file.read()
 
-        # Фильтруем только ссылки на страницы в "kpop.fandom.com/wiki"
-        if (clean_link not in visited_urls and parsed.scheme in {"http", "https"} and
-                "kpop.fandom.com/wiki" in clean_link and "redirect" not in clean_link and
-                "category" not in clean_link.lower()):
-            links.add(clean_link)
 
-    return links
+def load_metadata() -> UrlMetadata:
+    """Загружает метаданные URL; для обхода, сделанного без них, строит их по index.txt."""
+    metadata = UrlMetadata(METADATA_FILE)
+    if metadata.exists():
+        metadata.load()
+    elif os.path.exists(INDEX_FILE):
+        metadata.bootstrap(INDEX_FILE, OUTPUT_FOLDER, lambda url, html: process_html(url, html)[2])
+        metadata.save()
+    return metadata
 
 
-async def save_page(index: int, url: str, html: str):
-    """Сохраняет HTML-страницу и обновляет индексный файл."""
-    file_name = f"page_{index}.txt"
-    file_path = os.path.join(OUTPUT_FOLDER, file_name)
-    async with aiofiles.open(file_path, "w", encoding="utf-8") as file:
-        await file.write(html)
+class Frontier:
+    """
+    Очередь URL на обход с приоритетом: сначала меньшая глубина ссылки,
+    при равной глубине - больше входящих ссылок (на момент постановки в очередь;
+    счётчик в pending растёт и дальше и сохраняется в контрольной точке).
+    Просмотренные URL хранятся в фильтре Блума (state.seen); строки URL держатся
+    в памяти только пока URL ждёт в очереди или скачивается.
+    """
 
-    async with aiofiles.open(INDEX_FILE, "a", encoding="utf-8") as index_file:
-        await index_file.write(f"{index}: {url}\n")
+    def __init__(self, state: CrawlState):
+        self.state = state
+        self.queue = asyncio.PriorityQueue()
+        self.counter = 0
+        self.pending = {}  # url -> [глубина, число входящих ссылок]
+        self.in_flight = {}  # url -> [глубина, число входящих ссылок]
 
-    print(f"[✓] Страница {index} сохранена: {url}")
+    def _push(self, url: str):
+        depth, inlinks = self.pending[url]
+        self.counter += 1
+        self.queue.put_nowait((depth, -inlinks, self.counter, url))
 
+    def add(self, url: str, depth: int, inlinks: int = 1):
+        url = normalize_url(url)
+        entry = self.pending.get(url)
+        if entry is not None:
+            # URL уже в очереди: новая запись нужна, только если ссылка ведёт с меньшей глубины
+            # (устаревшая будет пропущена); иначе очередь росла бы с каждой входящей ссылкой
+            entry[1] += inlinks
+            if depth < entry[0]:
+                entry[0] = depth
+                self._push(url)
+            return
+        if url in self.in_flight or url in self.state.seen:
+            return
+        self.state.seen.add(url)
+        self.pending[url] = [depth, inlinks]
+        self._push(url)
 
-async def crawl():
-    """Асинхронный обход страниц."""
-    index = 1
-    async with aiohttp.ClientSession() as session:
-        while to_visit and index <= MAX_PAGES:
-            url = to_visit.pop()
-            if url in visited_urls:
-                continue
+    def start(self, url: str):
+        """Забирает URL из очереди в обработку; False, если запись устарела."""
+        entry = self.pending.pop(url, None)
+        if entry is None:
+            return False
+        self.in_flight[url] = entry
+        return True
 
-            visited_urls.add(url)
-            html = await fetch(url, session)
+    def finish(self, url: str):
+        self.in_flight.pop(url, None)
+
+    def entries(self):
+        """Очередь и скачиваемые сейчас URL для контрольной точки: (depth, inlinks, url)."""
+        for url, (depth, inlinks) in (*self.pending.items(), *self.in_flight.items()):
+            yield depth, inlinks, url
+
+
+async def crawl(recrawl: bool = False):
+    """
+    Асинхронный обход страниц пулом из CONCURRENT_REQUESTS обработчиков.
+
+    recrawl=True - повторный обход: все известные URL запрашиваются условно
+    (If-None-Match / If-Modified-Since), неизменённые страницы и страницы-дубликаты
+    не сохраняются, 404/410 удаляют документ. Номера документов стабильны между
+    обходами, список изменений записывается в CHANGES_FILE.
+    """
+    mode = "recrawl" if recrawl else "crawl"
+    metadata = load_metadata()
+    state = CrawlState(STATE_DIR, EXPECTED_URLS, SEEN_FALSE_POSITIVE_RATE, mode)
+    frontier = Frontier(state)
+    if state.exists() and state.saved_mode() == mode:
+        state.load()
+        IndexLog.truncate(INDEX_FILE, state.index_log_size)
+        for depth, inlinks, url in state.frontier:
+            frontier.pending[url] = [depth, inlinks]
+            frontier._push(url)
+        print(f"Продолжение обхода: документов {metadata.doc_count}, в очереди {len(frontier.pending)}")
+    else:
+        if recrawl:
+            for url in metadata.documents():
+                frontier.add(url, 0)
+        frontier.add(START_URL, 0)
+    index_log = IndexLog(INDEX_FILE)
+    loop = asyncio.get_running_loop()
+    parse_pool = ProcessPoolExecutor(max_workers=PARSE_WORKERS)
+    parse_cpu_time = 0.0
+    fetched = 0
+    processed = 0
+    statuses = {"added": 0, "modified": 0, "unchanged": 0, "duplicate": 0, "deleted": 0}
+    started = time.monotonic()
+    done = asyncio.Event()
+    if not recrawl and metadata.doc_count >= MAX_PAGES:
+        done.set()
+
+    def checkpoint():
+        state.save(frontier.entries(), metadata.doc_count, index_log.flush())
+        metadata.save()
+
+    async def parse(url: str, html: str):
+        nonlocal parse_cpu_time
+        # Разбор HTML в отдельном процессе, чтобы не блокировать цикл событий
+        cleaned_html, links, text, cpu_time = await loop.run_in_executor(parse_pool, process_page, url, html)
+        parse_cpu_time += cpu_time
+        record_batch("parse", cpu_time)
+        return cleaned_html, links, text
+
+    async def worker(session: ClientSession):
+        nonlocal processed
+        while True:
+            depth, _, _, url = await frontier.queue.get()
+            try:
+                if not frontier.start(url):
+                    continue
+                # Ошибка одной страницы (нет сохранённой копии, сломанный пул разбора, сбой записи)
+                # не должна завершать обработчик: иначе URL остаётся в in_flight, а когда погибнут
+                # все обработчики, queue.join() не дождётся оставшихся в очереди URL
+                handled = False
+                try:
+                    handled = await process_url(session, url, depth)
+                except Exception as e:
+                    print(f"Ошибка при обработке {url}: {type(e).__name__}: {e}")
+                finally:
+                    frontier.finish(url)
+                if not handled:
+                    continue
+
+                processed += 1
+                if processed % CHECKPOINT_INTERVAL == 0:
+                    try:
+                        checkpoint()
+                    except OSError as e:
+                        print(f"Не удалось сохранить контрольную точку: {e}")
+                if not recrawl and metadata.doc_count >= MAX_PAGES:
+                    done.set()
+            finally:
+                frontier.queue.task_done()
+
+    async def process_url(session: ClientSession, url: str, depth: int):
+        """
+        Скачивает и сохраняет одну страницу, ставит её ссылки в очередь.
+        False - страница пропущена из-за лимита MAX_PAGES.
+        """
+        nonlocal fetched
+        known = url in metadata.urls
+        if not known and metadata.doc_count >= MAX_PAGES:
+            return False
+
+        headers = metadata.conditional_headers(url) if recrawl else {}
+        fetch_started = time.perf_counter()
+        status, html, etag, last_modified = await fetch(url, session, headers)
+        record_batch("fetch", time.perf_counter() - fetch_started)
+        links = ()
+        if status == 304:
+            # Страница не изменилась: ссылки берём из сохранённой копии
+            fetched += 1
+            statuses["unchanged"] += 1
+            _, links, _ = await parse(url, read_saved_page(metadata.urls[url]["doc_id"]))
+        elif status in (404, 410):
+            doc_id = metadata.delete(url)
+            if doc_id is not None:
+                remove_page(doc_id)
+                statuses["deleted"] += 1
+                print(f"[-] Документ {doc_id} удалён: {url}")
+        elif html:
+            fetched += 1
+            cleaned_html, links, text = await parse(url, html)
+            if url not in metadata.urls and metadata.doc_count >= MAX_PAGES:
+                return False
+            doc_id, change = metadata.record(url, text_hash(text), etag, last_modified)
+            statuses[change] += 1
+            if change in ("added", "modified"):
+                save_page(doc_id, url, cleaned_html, text, index_log if change == "added" else None)
+
+        for link in links:
+            frontier.add(link, depth + 1)
+        return True
+
+    async def report_progress():
+        while True:
+            await asyncio.sleep(PROGRESS_INTERVAL)
+            elapsed = time.monotonic() - started
+            print(f"Скачано {fetched} страниц, {fetched / elapsed:.2f} стр/с, "
+                  f"документов {metadata.doc_count}, в очереди {len(frontier.pending)}")
+
+    async with aiohttp.ClientSession() as session:
+        workers = [asyncio.create_task(worker(session)) for _ in range(CONCURRENT_REQUESTS)]
+        progress = asyncio.create_task(report_progress())
+        queue_drained = asyncio.create_task(frontier.queue.join())
+        limit_reached = asyncio.create_task(done.wait())
+        await asyncio.wait([queue_drained, limit_reached], return_when=asyncio.FIRST_COMPLETED)
+        for task in (*workers, progress, queue_drained, limit_reached):
+            task.cancel()
+        await asyncio.gather(*workers, progress, queue_drained, limit_reached, return_exceptions=True)
 
-            if html:
-                cleaned_html = clean_html(html)
-                await save_page(index, url, cleaned_html)
-                index += 1
+    parse_pool.shutdown(cancel_futures=True)
+    checkpoint()
+    index_log.close()
+    if recrawl and queue_drained.done() and not queue_drained.cancelled():
+        # Повторный обход завершён целиком: следующий начнётся заново со всех известных URL
+        state.clear()
 
-                new_links = extract_links(url, html)
-                to_visit.update(new_links)
+    changes = metadata.pop_changes()
+    metadata.save()
+    with open(CHANGES_FILE, "w", encoding="utf-8") as f:
+        json.dump(changes, f, indent=1)
+    REGISTRY.write_textfile(METRICS_FILE)
 
-        print(f"✅ Завершено: скачано {index - 1} страниц.")
+    elapsed = time.monotonic() - started
+    print(f"✅ Завершено: скачано {fetched} страниц за {elapsed:.1f} с ({fetched / elapsed:.2f} стр/с), "
+          f"документов {metadata.doc_count}.")
+    print("Изменения: " + ", ".join(f"{kind} {count}" for kind, count in statuses.items()))
+    if fetched:
+        print(f"Разбор HTML ({BACKEND}): {parse_cpu_time / fetched * 1000:.1f} мс процессорного времени на страницу")
 
 
 if __name__ == "__main__":
@@ -113,4 +348,4 @@ if __name__ == "__main__":
 
     if sys.platform == "win32":
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
-    asyncio.run(crawl())
+    asyncio.run(crawl(recrawl="--recrawl" in sys.argv[1:]))
@@ -0,0 +1,108 @@
+import os
+import time
+from urllib.parse import urljoin, urlparse, urldefrag
+
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser
+    except ImportError:
+        HTMLParser = None
+
+try:
+    import lxml  # noqa: F401 - нужен только как парсер для BeautifulSoup
+    BS4_PARSER = "lxml"
+except ImportError:
+    BS4_PARSER = "html.parser"
+
+# Разбор страницы за один проход: из одного дерева получаются очищенный HTML,
+# исходящие ссылки и текст страницы. Парсер выбирается по доступности:
+# selectolax, затем BeautifulSoup с lxml, затем BeautifulSoup с html.parser.
+BACKEND = "selectolax" if HTMLParser is not None else BS4_PARSER
+
+REMOVED_TAGS = ["script", "style", "link", "meta"]
+EXCLUDED_EXTENSIONS = frozenset({".jpg", ".jpeg", ".png", ".gif", ".svg", ".pdf",
+                                 ".doc", ".docx", ".xls", ".xlsx", ".mp4", ".mp3", ".zip"})
+
+
+def normalize_url(url: str) -> str:
+    """Приводит URL к единому виду: без фрагмента и параметров, хост в нижнем регистре, без порта по умолчанию."""
+    url, _ = urldefrag(url)
+    parsed = urlparse(url)
+    scheme = parsed.scheme.lower()
+    host = (parsed.hostname or "").lower()
+    port = parsed.port
+    if port and not ((scheme == "http" and port == 80) or (scheme == "https" and port == 443)):
+        host = f"{host}:{port}"
+    path = parsed.path or "/"
+    return f"{scheme}://{host}{path}"
+
+
+def filter_link(base_url: str, href: str):
+    """Возвращает нормализованную ссылку на страницу wiki или None для файлов, редиректов и категорий."""
+    full_link = urljoin(base_url, href)  # Преобразуем относительные ссылки в абсолютные
+    # Удаляем fragment и параметры запроса (?query=123)
+    clean_link = normalize_url(full_link)
+    parsed = urlparse(clean_link)
+    lower_link = clean_link.lower()
+
+    # Проверяем, не является ли ссылка файлом
+    if os.path.splitext(parsed.path)[1].lower() in EXCLUDED_EXTENSIONS or "file" in lower_link:
+        return None
+
+    # Фильтруем только ссылки на страницы в "kpop.fandom.com/wiki"
+    if (parsed.scheme in {"http", "https"} and
+            "kpop.fandom.com/wiki" in clean_link and "redirect" not in clean_link and
+            "category" not in lower_link):
+        return clean_link
+    return None
+
+
+def _process_selectolax(base_url: str, html: str):
+    tree = HTMLParser(html)
+    for tag in tree.css(", ".join(REMOVED_TAGS)):
+        tag.decompose()
+    links = set()
+    for a_tag in tree.css("a[href]"):
+        link = filter_link(base_url, a_tag.attributes.get("href") or "")
+        if link:
+            links.add(link)
+    # Текст всего документа (как get_text у BeautifulSoup), а не только body:
+    # токены не должны зависеть от того, какой парсер установлен
+    text = tree.root.text(separator=" ", strip=True) if tree.root is not None else ""
+    return tree.html or "", links, text
+
+
+def _process_bs4(base_url: str, html: str, parser: str):
+    soup = BeautifulSoup(html, parser)
+    for tag in soup(REMOVED_TAGS):
+        tag.decompose()
+    links = set()
+    for a_tag in soup.find_all("a", href=True):
+        link = filter_link(base_url, a_tag["href"])
+        if link:
+            links.add(link)
+    return str(soup), links, soup.get_text(separator=" ", strip=True)
+
+
+def process_html(base_url: str, html: str, backend: str = BACKEND):
+    """
+    Разбирает страницу один раз. Возвращает (очищенный HTML без script/style/link/meta,
+    множество ссылок на страницы wiki, текст страницы).
+    """
+    if backend == "selectolax":
+        return _process_selectolax(base_url, html)
+    return _process_bs4(base_url, html, backend)
+
+
+def process_page(base_url: str, html: str):
+    """
+    То же, что process_html, плюс затраченное процессорное время.
+    Вызывается в пуле процессов краулера.
+    """
+    started = time.process_time()
+    cleaned_html, links, text = process_html(base_url, html)
+    return cleaned_html, links, text, time.process_time() - started
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import os
+import re
+
+
+def text_hash(text: str) -> str:
+    """Хэш текста страницы без учёта пробельных символов."""
+    return hashlib.sha1(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+class UrlMetadata:
+    """
+    Метаданные скачанных URL для инкрементального повторного обхода:
+    стабильный номер документа (page_N), ETag, Last-Modified и хэш текста.
+    URL, отдающий тот же текст, что и уже сохранённый документ, хранится как
+    псевдоним этого документа и отдельной страницей не сохраняется.
+
+    Изменения за обход (added / modified / deleted номера документов)
+    накапливаются в changes и выгружаются в changes.json для построителей индексов.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.urls = {}  # url -> {"doc_id", "etag", "last_modified", "hash"} или {"doc_id", "alias": True}
+        self.hashes = {}  # хэш текста -> doc_id
+        self.next_doc_id = 1
+        self.changes = {"added": set(), "modified": set(), "deleted": set()}
+
+    def exists(self) -> bool:
+        return os.path.exists(self.path)
+
+    @property
+    def doc_count(self) -> int:
+        """Число живых документов: удалённые номера next_doc_id не возвращает, поэтому считаем по записям."""
+        return sum(1 for meta in self.urls.values() if not meta.get("alias"))
+
+    def documents(self):
+        """URL сохранённых документов (без псевдонимов)."""
+        return [url for url, meta in self.urls.items() if not meta.get("alias")]
+
+    def conditional_headers(self, url: str) -> dict:
+        meta = self.urls.get(url)
+        headers = {}
+        if meta and not meta.get("alias"):
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def record(self, url: str, digest: str, etag=None, last_modified=None):
+        """
+        Учитывает скачанную страницу. Возвращает (doc_id, status), где status -
+        "added", "modified", "unchanged" или "duplicate" (текст совпал с другим документом).
+        Для "unchanged" и "duplicate" страницу сохранять не нужно.
+        """
+        meta = self.urls.get(url)
+        if meta is not None and not meta.get("alias"):
+            meta["etag"] = etag
+            meta["last_modified"] = last_modified
+            if meta["hash"] == digest:
+                return meta["doc_id"], "unchanged"
+            if self.hashes.get(meta["hash"]) == meta["doc_id"]:
+                del self.hashes[meta["hash"]]
+            meta["hash"] = digest
+            self.hashes.setdefault(digest, meta["doc_id"])
+            if meta["doc_id"] not in self.changes["added"]:
+                self.changes["modified"].add(meta["doc_id"])
+            return meta["doc_id"], "modified"
+
+        duplicate_of = self.hashes.get(digest)
+        if duplicate_of is not None:
+            self.urls[url] = {"doc_id": duplicate_of, "alias": True}
+            return duplicate_of, "duplicate"
+
+        doc_id = self.next_doc_id
+        self.next_doc_id += 1
+        self.urls[url] = {"doc_id": doc_id, "etag": etag, "last_modified": last_modified, "hash": digest}
+        self.hashes[digest] = doc_id
+        self.changes["added"].add(doc_id)
+        return doc_id, "added"
+
+    def delete(self, url: str):
+        """URL больше не существует (404/410): документ и его псевдонимы удаляются."""
+        meta = self.urls.pop(url, None)
+        if meta is None or meta.get("alias"):
+            return None
+        doc_id = meta["doc_id"]
+        if self.hashes.get(meta["hash"]) == doc_id:
+            del self.hashes[meta["hash"]]
+        for alias in [u for u, m in self.urls.items() if m.get("alias") and m["doc_id"] == doc_id]:
+            del self.urls[alias]
+        self.changes["added"].discard(doc_id)
+        self.changes["modified"].discard(doc_id)
+        self.changes["deleted"].add(doc_id)
+        return doc_id
+
+    def save(self):
+        state = {
+            "next_doc_id": self.next_doc_id,
+            "urls": self.urls,
+            "changes": {kind: sorted(doc_ids) for kind, doc_ids in self.changes.items()},
+        }
+        tmp_file = self.path + ".tmp"
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_file, self.path)
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        self.next_doc_id = state["next_doc_id"]
+        self.urls = state["urls"]
+        self.changes = {kind: set(doc_ids) for kind, doc_ids in state["changes"].items()}
+        self.hashes = {}
+        for meta in self.urls.values():
+            if not meta.get("alias"):
+                self.hashes.setdefault(meta["hash"], meta["doc_id"])
+
+    def bootstrap(self, index_file: str, pages_folder: str, extract_text):
+        """
+        Заполняет метаданные по результатам обхода без метаданных:
+        номера документов из index.txt, хэши - из сохранённых страниц.
+        """
+        line_pattern = re.compile(r"^(\d+): (\S+)$")
+        with open(index_file, "r", encoding="utf-8") as f:
+            for line in f:
+                match = line_pattern.match(line.strip())
+                if not match:
+                    continue
+                doc_id, url = int(match.group(1)), match.group(2)
+                page_path = os.path.join(pages_folder, f"page_{doc_id}.txt")
+                if not os.path.exists(page_path):
+                    continue
+                with open(page_path, "r", encoding="utf-8") as page:
+                    digest = text_hash(extract_text(url, page.read()))
+                self.urls[url] = {"doc_id": doc_id, "etag": None, "last_modified": None, "hash": digest}
+                self.hashes.setdefault(digest, doc_id)
+                self.next_doc_id = max(self.next_doc_id, doc_id + 1)
+
+    def pop_changes(self) -> dict:
+        changes = {kind: sorted(doc_ids) for kind, doc_ids in self.changes.items()}
+        self.changes = {"added": set(), "modified": set(), "deleted": set()}
+        return changes
@@ -1,53 +1,351 @@
 import os
+import re
+import signal
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+from flask import Flask, Response, g, render_template, request, jsonify, send_from_directory
 
-from flask import Flask, render_template, request, Response, abort
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(BASE_DIR, '..'))
+from common.cache import LRUCache
+from common.metrics import REGISTRY, SlowQueryProfiler, span, trace
+from common.snapshots import SnapshotHolder
 from vector_search.search import VectorSearchEngine
-import re
 
-app = Flask(__name__)
+DEFAULT_CONFIG = {
+    "PAGES_DIR": os.path.join(BASE_DIR, "pages"),
+    "SOURCE_PAGES_DIR": os.path.join(BASE_DIR, "../crawler/downloaded_pages"),
+    "TFIDF_DIR": os.path.join(BASE_DIR, "../tf-idf/tfidf_lemmas"),
+    "TFIDF_STORE": os.path.join(BASE_DIR, "../tf-idf/tfidf.art"),
+    "TEXT_STORE": os.path.join(BASE_DIR, "../vector_search/page_texts.bin"),
+    "TFIDF_MATRIX": os.path.join(BASE_DIR, "../tf-idf/tfidf_lemmas.bin"),
+    # Версионированные снимки индекса (common/snapshots.py). Если в папке есть CURRENT,
+    # индекс берётся из текущей версии, а новая версия подхватывается без перезапуска:
+    # каждый процесс раз в RELOAD_POLL_INTERVAL секунд проверяет CURRENT (0 - не проверять),
+    # а POST /api/admin/reload перезагружает сразу. ADMIN_TOKEN, если задан,
+    # должен передаваться в заголовке X-Admin-Token.
+    "SNAPSHOT_DIR": os.path.join(BASE_DIR, "../index_snapshots"),
+    "RELOAD_POLL_INTERVAL": 5.0,
+    "ADMIN_TOKEN": None,
+    # Выборочный профилировщик: запросы дольше PROFILE_SLOW_MS миллисекунд сохраняют стеки
+    # в PROFILE_DIR в формате flamegraph (None - выключен); PROFILE_INTERVAL - период выборки, секунд
+    "PROFILE_SLOW_MS": None,
+    "PROFILE_DIR": os.path.join(BASE_DIR, "../profiles"),
+    "PROFILE_INTERVAL": 0.002,
+    # Сниппеты строятся в пуле из SNIPPET_WORKERS потоков; в очереди не больше
+    # SNIPPET_QUEUE задач на процесс, при переполнении или по истечении
+    # SNIPPET_TIMEOUT секунд результат отдаётся без сниппета
+    "SNIPPET_WORKERS": 4,
+    "SNIPPET_QUEUE": 64,
+    "SNIPPET_TIMEOUT": 2.0,
+    "DEFAULT_TOP_N": 10,
+    "MAX_TOP_N": 50,
+    # Кэш результатов по (нормализованный запрос, top_n) и кэш сниппетов по (документ, слова запроса):
+    # размер в записях и время жизни в секундах. Оба сбрасываются при смене поколения индекса.
+    "RESULT_CACHE_SIZE": 1024,
+    "RESULT_CACHE_TTL": 300,
+    "SNIPPET_CACHE_SIZE": 8192,
+    "SNIPPET_CACHE_TTL": 3600,
+}
+
+
+class BoundedExecutor:
+    """
+    Пул потоков с ограниченной очередью. Потоки создаются лениво в каждом процессе,
+    поэтому объект можно создать до fork рабочих процессов сервера.
+    submit возвращает None, если в очереди уже max_pending задач.
+    """
+
+    def __init__(self, max_workers, max_pending):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._pid = None
+        self._executor = None
+        self._slots = None
+        self._lock = threading.Lock()
+
+    def _ensure(self):
+        if self._pid != os.getpid():
+            with self._lock:
+                if self._pid != os.getpid():
+                    self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+                    self._slots = threading.BoundedSemaphore(self.max_pending)
+                    self._pid = os.getpid()
+
+    def submit(self, fn, *args):
+        self._ensure()
+        if not self._slots.acquire(blocking=False):
+            return None
+        future = self._executor.submit(fn, *args)
+        future.add_done_callback(lambda _: self._slots.release())
+        return future
 
-search_engine = VectorSearchEngine(
-    pages_dir="../crawler/downloaded_pages",
-    tfidf_dir="../tf-idf/tfidf_lemmas"
-)
+
+@lru_cache(maxsize=1024)
+def highlight_pattern(query_terms):
+    return re.compile(r'(' + '|'.join(map(re.escape, query_terms)) + r')', re.IGNORECASE)
 
 
 def highlight(text, query_terms):
-    pattern = re.compile(r'(' + '|'.join(map(re.escape, query_terms)) + r')', re.IGNORECASE)
-    return pattern.sub(r'<mark>\1</mark>', text)
+    return highlight_pattern(tuple(query_terms)).sub(r'<mark>\1</mark>', text)
+
+
+def normalize_query(query):
+    return " ".join(query.lower().split())
+
+
+def load_engine(config, text_store, tfidf_matrix, generation=0):
+    search_engine = VectorSearchEngine(
+        pages_dir=config["SOURCE_PAGES_DIR"],
+        tfidf_dir=config["TFIDF_DIR"],
+        tfidf_store=config["TFIDF_STORE"],
+        text_store=text_store,
+        tfidf_matrix=tfidf_matrix
+    )
+    search_engine.generation = generation
+    search_engine.warm_up()
+    return search_engine
+
+
+def create_app(config=None, search_engine=None):
+    """
+    Создаёт приложение. Индекс загружается один раз здесь: при запуске через
+    gunicorn с preload_app (gunicorn.conf.py) это происходит до fork, и рабочие
+    процессы разделяют его страницы памяти (матрица TF-IDF и тексты открыты через mmap).
+
+    Перезагрузка снимка строит новый VectorSearchEngine в фоновом потоке и подменяет
+    ссылку на него; запрос берёт движок один раз в начале, поэтому начатые запросы
+    дорабатывают на старом снимке. Номер версии снимка становится поколением движка,
+    и кэши результатов и сниппетов сбрасываются при первом запросе к новой версии.
+    """
+    app = Flask(__name__)
+    app.config.update(DEFAULT_CONFIG)
+    if config:
+        app.config.update(config)
+
+    def load_snapshot(path, version):
+        text_store = os.path.join(path, "page_texts.bin")
+        return load_engine(app.config, text_store if os.path.exists(text_store) else app.config["TEXT_STORE"],
+                           os.path.join(path, "tfidf_lemmas.bin"), generation=version)
+
+    snapshots = SnapshotHolder(app.config["SNAPSHOT_DIR"], load_snapshot, initial=search_engine)
+    if snapshots.get() is None:
+        # Снимков нет - работаем с файлами из папок построения, как раньше
+        snapshots.swap(load_engine(app.config, app.config["TEXT_STORE"], app.config["TFIDF_MATRIX"]), None)
+    snippet_executor = BoundedExecutor(app.config["SNIPPET_WORKERS"], app.config["SNIPPET_QUEUE"])
+    result_cache = LRUCache(app.config["RESULT_CACHE_SIZE"], app.config["RESULT_CACHE_TTL"])
+    snippet_cache = LRUCache(app.config["SNIPPET_CACHE_SIZE"], app.config["SNIPPET_CACHE_TTL"])
+    app.extensions["snapshots"] = snapshots
+    profiler = None
+    if app.config["PROFILE_SLOW_MS"] is not None:
+        profiler = SlowQueryProfiler(app.config["PROFILE_SLOW_MS"] / 1000, app.config["PROFILE_DIR"],
+                                     app.config["PROFILE_INTERVAL"])
+
+    requests_total = REGISTRY.counter("http_requests_total", "HTTP-запросы к демо", ("endpoint", "status"))
+    request_seconds = REGISTRY.histogram("http_request_seconds", "Время обработки HTTP-запроса", ("endpoint",))
+    queries_total = REGISTRY.counter("search_queries_total", "Поисковые запросы по источнику результата",
+                                     ("cache",))
+    REGISTRY.gauge("search_cache_entries", "Записей в кэшах демо",
+                   lambda: {("results",): len(result_cache), ("snippets",): len(snippet_cache)}, ("cache",))
+    REGISTRY.gauge("search_cache_hits", "Попаданий в кэши демо с запуска",
+                   lambda: {("results",): result_cache.hits, ("snippets",): snippet_cache.hits}, ("cache",))
+    REGISTRY.gauge("search_cache_misses", "Промахов кэшей демо с запуска",
+                   lambda: {("results",): result_cache.misses, ("snippets",): snippet_cache.misses}, ("cache",))
+    REGISTRY.gauge("search_snapshot_version", "Загруженная версия снимка индекса", lambda: snapshots.version)
+    app.extensions["snippet_executor"] = snippet_executor
+    app.extensions["result_cache"] = result_cache
+    app.extensions["snippet_cache"] = snippet_cache
+
+    def build_snippets(search_engine, scores, query_terms):
+        """
+        Сниппеты из кэша, недостающие - параллельно в ограниченном пуле.
+        Возвращает (сниппеты, все ли построены).
+        """
+        terms_key = tuple(query_terms)
+        snippets = [snippet_cache.get((doc_id, terms_key)) for doc_id, _ in scores]
+        futures = [snippet_executor.submit(search_engine.get_snippet, doc_id, query_terms) if snippet is None else None
+                   for (doc_id, _), snippet in zip(scores, snippets)]
+        deadline = time.monotonic() + app.config["SNIPPET_TIMEOUT"]
+
+        complete = True
+        for position, ((doc_id, _), future) in enumerate(zip(scores, futures)):
+            if snippets[position] is not None:
+                continue
+            snippet = None
+            if future is not None:
+                try:
+                    snippet = future.result(timeout=max(0.0, deadline - time.monotonic()))
+                except Exception:
+                    snippet = None
+            if snippet is None:
+                complete = False
+                snippet = ""
+            else:
+                snippet_cache.put((doc_id, terms_key), snippet)
+            snippets[position] = snippet
+        return snippets, complete
+
+    def run_search(query, top_n):
+        """
+        Ранжирование в потоке запроса, сниппеты - параллельно в ограниченном пуле.
+        Результат кэшируется по нормализованному запросу и top_n, если построены все сниппеты.
+        Возвращает новый список словарей, который можно изменять.
+        """
+        search_engine = snapshots.get()
+        generation = search_engine.generation
+        result_cache.set_generation(generation)
+        snippet_cache.set_generation(generation)
+        key = (normalize_query(query), top_n)
+        results = result_cache.get(key)
+        queries_total.inc(cache="hit" if results is not None else "miss")
+        if results is None:
+            scores = search_engine.rank(query, top_n)
+            query_terms = search_engine.query_terms(query) if scores else []
+            with span("snippets"):
+                snippets, complete = build_snippets(search_engine, scores, query_terms)
+            results = tuple((doc_id, score, snippet) for (doc_id, score), snippet in zip(scores, snippets))
+            if complete:
+                result_cache.put(key, results)
+        return [{"doc_id": doc_id, "score": score, "snippet": snippet} for doc_id, score, snippet in results]
+
+    def parse_top_n():
+        try:
+            top_n = int(request.args.get("top_n", app.config["DEFAULT_TOP_N"]))
+        except ValueError:
+            return None
+        if not 1 <= top_n <= app.config["MAX_TOP_N"]:
+            return None
+        return top_n
+
+    def profiled_search(query, top_n):
+        if profiler is None:
+            return run_search(query, top_n)
+        with profiler.profile(f"{query} (top_n={top_n})"):
+            return run_search(query, top_n)
+
+    @app.before_request
+    def watch_snapshots():
+        g.request_started = time.perf_counter()
+        # Поток проверки CURRENT запускается в каждом рабочем процессе при первом запросе
+        if app.config["RELOAD_POLL_INTERVAL"]:
+            snapshots.watch(app.config["RELOAD_POLL_INTERVAL"])
+
+    @app.after_request
+    def record_request(response):
+        endpoint = request.endpoint or "unknown"
+        requests_total.inc(endpoint=endpoint, status=response.status_code)
+        started = g.get("request_started")
+        if started is not None:
+            request_seconds.observe(time.perf_counter() - started, endpoint=endpoint)
+        return response
+
+    @app.route("/", methods=["GET"])
+    def index():
+        return render_template("results.html")
+
+    @app.route("/search", methods=["GET"])
+    def search():
+        query = request.args.get("q", "").strip()
+        if not query:
+            return render_template("index.html", error="Введите запрос")
+
+        results = profiled_search(query, top_n=app.config["DEFAULT_TOP_N"])
+        # Подсвечиваются те же слова, по которым анализатор строил запрос
+        query_terms = snapshots.get().query_terms(query)
+
+        if query_terms:
+            for result in results:
+                result["snippet"] = highlight(result["snippet"], query_terms)
+
+        return render_template("results.html", query=query, results=results)
 
+    @app.route("/api/search", methods=["GET"])
+    def api_search():
+        """
+        JSON-ответ: {"query", "top_n", "took_ms", "results": [{"doc_id", "score", "snippet", "url"}]}.
+        С debug=1 добавляется "debug": разбивка времени по этапам в миллисекундах
+        (без этапов ранжирования, если ответ взят из кэша) и версия снимка индекса.
+        """
+        query = request.args.get("q", "").strip()
+        if not query:
+            return jsonify({"error": "Параметр q обязателен"}), 400
+        top_n = parse_top_n()
+        if top_n is None:
+            return jsonify({"error": f"top_n должен быть от 1 до {app.config['MAX_TOP_N']}"}), 400
 
-@app.route("/", methods=["GET"])
-def index():
-    return render_template("results.html")
+        started = time.perf_counter()
+        with trace() as query_trace:
+            results = profiled_search(query, top_n)
+        for result in results:
+            result["url"] = f"/pages/page_{result['doc_id']}.txt"
+        response = {
+            "query": query,
+            "top_n": top_n,
+            "took_ms": round((time.perf_counter() - started) * 1000, 3),
+            "results": results,
+        }
+        if request.args.get("debug") == "1":
+            response["debug"] = {"timings_ms": query_trace.breakdown(), "snapshot_version": snapshots.version}
+        return jsonify(response)
 
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        """
+        Метрики процесса в текстовом формате Prometheus. Под gunicorn у каждого рабочего
+        процесса свой реестр: ответ содержит метрики того процесса, который принял запрос.
+        """
+        return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
 
+    @app.route("/api/cache/stats", methods=["GET"])
+    def cache_stats():
+        """
+        Счётчики попаданий и промахов кэшей - для подбора их размеров.
+        """
+        pattern_info = highlight_pattern.cache_info()
+        return jsonify({
+            "generation": snapshots.get().generation,
+            "results": result_cache.stats(),
+            "snippets": snippet_cache.stats(),
+            "highlight_patterns": {"hits": pattern_info.hits, "misses": pattern_info.misses,
+                                   "size": pattern_info.currsize, "max_size": pattern_info.maxsize},
+        })
 
-@app.route("/search", methods=["GET"])
-def search():
-    query = request.args.get("q", "").strip()
-    if not query:
-        return render_template("index.html", error="Введите запрос")
+    @app.route("/api/admin/reload", methods=["POST"])
+    def admin_reload():
+        """
+        Перезагружает текущую версию снимка в фоне (?wait=1 - дождаться загрузки).
+        Подменяется движок только того процесса, который принял запрос;
+        остальные рабочие процессы подхватят версию при проверке CURRENT.
+        """
+        token = app.config["ADMIN_TOKEN"]
+        if token and request.headers.get("X-Admin-Token") != token:
+            return jsonify({"error": "Неверный токен"}), 403
+        if request.args.get("wait") == "1":
+            reloaded = snapshots.reload()
+            return jsonify({"reloaded": reloaded, **snapshots.stats()})
+        snapshots.reload_async()
+        return jsonify(snapshots.stats()), 202
 
-    results = search_engine.search(query, top_n=10)
-    query_terms = query.lower().split()
+    @app.route("/api/admin/snapshot", methods=["GET"])
+    def admin_snapshot():
+        return jsonify(snapshots.stats())
 
-    for result in results:
-        result["snippet"] = highlight(result["snippet"], query_terms)
+    @app.route('/pages/<path:filename>')
+    def serve_page(filename):
+        # send_from_directory отдаёт файл потоком (sendfile под gunicorn) и не пускает за пределы папки
+        return send_from_directory(app.config["PAGES_DIR"], filename, mimetype='text/html')
 
-    return render_template("results.html", query=query, results=results)
+    return app
 
 
-@app.route('/pages/<path:filename>')
-def serve_page(filename):
-    file_path = os.path.join('pages', filename)
-    if os.path.exists(file_path):
-        with open(file_path, 'r', encoding='utf-8') as f:
-            content = f.read()
-        return Response(content, mimetype='text/html')
-    else:
-        abort(404)
+app = create_app()
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # kill -HUP <pid> перезагружает снимок (под gunicorn HUP занят мастером - там работает проверка CURRENT)
+    signal.signal(signal.SIGHUP, lambda *_: app.extensions["snapshots"].reload_async())
+    app.run(debug=True)
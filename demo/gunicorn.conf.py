@@ -0,0 +1,14 @@
+import multiprocessing
+
+# Продакшен-запуск демо: gunicorn -c gunicorn.conf.py app:app (из папки demo)
+bind = "0.0.0.0:8000"
+# Приложение (и индекс) загружается один раз в мастер-процессе до fork:
+# рабочие процессы разделяют его память copy-on-write, матрица и тексты - через mmap
+preload_app = True
+workers = multiprocessing.cpu_count()
+worker_class = "gthread"
+threads = 4
+timeout = 30
+keepalive = 5
+# Файлы страниц отдаются через sendfile
+sendfile = True
@@ -0,0 +1,79 @@
+import argparse
+import asyncio
+import random
+import time
+
+import aiohttp
+
+DEFAULT_QUERIES = [
+    "bts", "blackpink", "twice album", "bts members", "red velvet debut",
+    "seventeen", "stray kids", "exo", "girl group", "boy group debut",
+    "kpop idol", "album release", "music video", "mini album", "korean singer",
+]
+
+
+def percentile(sorted_values, fraction):
+    """
+    Перцентиль методом ближайшего ранга по отсортированному списку.
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(fraction * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+async def run(url, queries, concurrency, total_requests, top_n, zipf):
+    latencies = []
+    errors = 0
+    counter = iter(range(total_requests))
+    weights = [1 / (rank + 1) for rank in range(len(queries))] if zipf else None
+    rnd = random.Random(0)
+
+    async def worker(session):
+        nonlocal errors
+        for _ in counter:
+            query = rnd.choices(queries, weights)[0]
+            started = time.perf_counter()
+            try:
+                async with session.get(url, params={"q": query, "top_n": top_n}) as response:
+                    await response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+            except aiohttp.ClientError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    return latencies, errors, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест /api/search")
+    parser.add_argument("--url", default="http://127.0.0.1:8000/api/search")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--queries", help="файл с запросами, по одному в строке")
+    parser.add_argument("--zipf", action="store_true", help="частоты запросов по закону Ципфа (популярные чаще)")
+    args = parser.parse_args()
+
+    queries = DEFAULT_QUERIES
+    if args.queries:
+        with open(args.queries, "r", encoding="utf-8") as f:
+            queries = [line.strip() for line in f if line.strip()]
+
+    latencies, errors, elapsed = asyncio.run(
+        run(args.url, queries, args.concurrency, args.requests, args.top_n, args.zipf))
+    latencies.sort()
+    print(f"Запросов: {len(latencies)}, ошибок: {errors}, время: {elapsed:.2f} с")
+    print(f"QPS: {len(latencies) / elapsed:.1f}")
+    for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        print(f"{name}: {percentile(latencies, fraction) * 1000:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,220 @@
+import mmap
+import struct
+import sys
+from array import array
+
+# Формат файла inverted_index.bin:
+#   заголовок     - MAGIC, версия формата, число терминов, число документов,
+#                   смещения секций словаря, строк терминов и постингов
+#   словарь       - term_count записей фиксированной длины, отсортированных по термину:
+#                   (смещение строки, длина строки, смещение постинга, длина постинга, df)
+#   строки        - термины в UTF-8 подряд, без разделителей
+#   постинги      - списки id документов: дельты между соседними id в varint-кодировке;
+#                   первым идёт список всех id документов корпуса
+MAGIC = b"ITIX"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIQQQ")
+ENTRY = struct.Struct("<QHQII")
+
+
+def encode_postings(file_ids):
+    """
+    Кодирует отсортированный список id документов: дельты + varint.
+    """
+    out = bytearray()
+    previous = 0
+    for file_id in file_ids:
+        delta = file_id - previous
+        previous = file_id
+        while delta >= 0x80:
+            out.append((delta & 0x7F) | 0x80)
+            delta >>= 7
+        out.append(delta)
+    return bytes(out)
+
+
+def decode_postings(buffer, offset=0, length=None):
+    """
+    Декодирует постинг-лист из буфера (bytes или mmap) в array('I').
+    """
+    end = len(buffer) if length is None else offset + length
+    data = buffer[offset:end]
+    result = array("I")
+    value = 0
+    delta = 0
+    shift = 0
+    for byte in data:
+        delta |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        value += delta
+        result.append(value)
+        delta = 0
+        shift = 0
+    return result
+
+
+def write_binary_index(inverted_index, index_filename="inverted_index.bin"):
+    """
+    Сохраняет инвертированный индекс {термин: id документов} в бинарный файл.
+    """
+    terms = sorted(inverted_index.keys(), key=lambda t: t.encode("utf-8"))
+    universe = set()
+    for file_ids in inverted_index.values():
+        universe.update(file_ids)
+
+    term_blob = bytearray()
+    postings_blob = bytearray(encode_postings(sorted(universe)))
+    universe_length = len(postings_blob)
+    entries = []
+    for term in terms:
+        encoded_term = term.encode("utf-8")
+        file_ids = sorted(set(inverted_index[term]))
+        encoded_postings = encode_postings(file_ids)
+        entries.append((len(term_blob), len(encoded_term),
+                        len(postings_blob), len(encoded_postings), len(file_ids)))
+        term_blob += encoded_term
+        postings_blob += encoded_postings
+
+    dictionary_offset = HEADER.size
+    terms_offset = dictionary_offset + ENTRY.size * len(entries)
+    postings_offset = terms_offset + len(term_blob)
+
+    with open(index_filename, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(terms), len(universe),
+                                     terms_offset, postings_offset, universe_length))
+        for entry in entries:
+            index_file.write(ENTRY.pack(*entry))
+        index_file.write(term_blob)
+        index_file.write(postings_blob)
+
+
+class BinaryIndex:
+    """
+    Инвертированный индекс, открытый через mmap.
+    Словарь терминов не загружается в память: поиск термина - бинарный поиск
+    по записям словаря, постинги декодируются только для запрошенных терминов.
+    """
+
+    def __init__(self, index_filename="inverted_index.bin"):
+        self.index_filename = index_filename
+        self._file = open(index_filename, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, _flags, self.term_count, self.doc_count,
+         self._terms_offset, self._postings_offset, self._universe_length) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Файл {index_filename} не является бинарным индексом")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Неподдерживаемая версия индекса: {version}")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _entry(self, position):
+        return ENTRY.unpack_from(self._mm, HEADER.size + ENTRY.size * position)
+
+    def _term_bytes(self, entry):
+        start = self._terms_offset + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    def _find(self, term):
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            current = self._term_bytes(entry)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def _decode(self, entry):
+        return decode_postings(self._mm, self._postings_offset + entry[2], entry[3])
+
+    def get(self, term, default=None):
+        entry = self._find(term)
+        if entry is None:
+            return default
+        return self._decode(entry)
+
+    def __getitem__(self, term):
+        postings = self.get(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def __contains__(self, term):
+        return self._find(term) is not None
+
+    def __len__(self):
+        return self.term_count
+
+    def doc_frequency(self, term):
+        entry = self._find(term)
+        return entry[4] if entry is not None else 0
+
+    def universe(self):
+        """
+        Все id документов корпуса (хранятся в файле отдельным постинг-листом).
+        """
+        return decode_postings(self._mm, self._postings_offset, self._universe_length)
+
+    def keys(self):
+        for position in range(self.term_count):
+            yield self._term_bytes(self._entry(position)).decode("utf-8")
+
+    def items(self):
+        for position in range(self.term_count):
+            entry = self._entry(position)
+            yield self._term_bytes(entry).decode("utf-8"), self._decode(entry)
+
+    def values(self):
+        for _, postings in self.items():
+            yield postings
+
+
+def convert_tsv_to_binary(tsv_file="inverted_index.tsv", index_filename="inverted_index.bin"):
+    """
+    Конвертирует существующий inverted_index.tsv в бинарный формат.
+    """
+    inverted_index = {}
+    with open(tsv_file, "r", encoding="utf-8") as f:
+        f.readline()  # заголовок
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                term, files_str = line.split("\t")
+            except ValueError:
+                continue
+            inverted_index[term] = [int(file_id) for file_id in files_str.split()]
+    write_binary_index(inverted_index, index_filename)
+    return len(inverted_index)
+
+
+def main():
+    tsv_file = sys.argv[1] if len(sys.argv) > 1 else "inverted_index.tsv"
+    index_filename = sys.argv[2] if len(sys.argv) > 2 else "inverted_index.bin"
+    terms_count = convert_tsv_to_binary(tsv_file, index_filename)
+    print(f"Сконвертировано терминов: {terms_count}, индекс сохранён в {index_filename}")
+
+
+if __name__ == "__main__":
+    main()
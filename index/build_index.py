@@ -1,8 +1,38 @@
 import os
 import glob
+import sys
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 
+from binary_index import write_binary_index
+from positional_index import write_positional_index
+from segments import SegmentedIndex
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.artifact_store import ArtifactStore
+from common.metrics import REGISTRY, batch_span
+from common.shards import shard_filename, shard_of
+
+# Число шардов для параллельной сборки (python build_index.py --shards N)
+DEFAULT_SHARDS = os.cpu_count() or 1
+# Время этапов построения в формате Prometheus
+METRICS_FILE = "metrics.prom"
+# Хранилище токенизатора; если его нет, леммы читаются из lemmas_N.txt
+TOKENS_STORE = "../tokenizer-lemmatizer/tokens.art"
+LEMMAS_FOLDER = "../tokenizer-lemmatizer/lemmas"
+# Позиционный индекс для фраз и NEAR (строится только из хранилища: в lemmas_N.txt порядка слов нет)
+POSITIONS_FILE = "positions.bin"
+
+
+def build_index(lemmas_folder, shard=None, shard_count=1):
+    """
+    Строит словарь {лемма: id документов}. Если задан shard, берутся только
+    документы этого шарда (doc_id % shard_count == shard).
+    lemmas_folder - папка с lemmas_N.txt или файл хранилища tokens.art.
+    """
+    if os.path.isfile(lemmas_folder):
+        return build_index_from_store(lemmas_folder, shard, shard_count)
 
-def build_index(lemmas_folder):
     inverted_index = {}
     for filepath in glob.glob(os.path.join(lemmas_folder, "lemmas_*.txt")):
         filename = os.path.basename(filepath)
@@ -11,6 +41,8 @@ def build_index(lemmas_folder):
         except (IndexError, ValueError):
             print(f"Пропущен файл с некорректным именем: {filename}")
             continue
+        if shard is not None and shard_of(file_id, shard_count) != shard:
+            continue
 
         with open(filepath, "r", encoding="utf-8") as file:
             for line in file:
@@ -22,6 +54,41 @@ def build_index(lemmas_folder):
     return inverted_index
 
 
+def build_index_from_store(store_filename, shard=None, shard_count=1):
+    """
+    То же по таблице lemmas хранилища: постинги собираются по id терминов,
+    а строки лемм декодируются один раз на термин, а не на вхождение.
+    """
+    postings = defaultdict(set)
+    with ArtifactStore(store_filename) as store:
+        table = store.table("lemmas")
+        for doc_id in table.doc_ids.tolist():
+            if shard is not None and shard_of(doc_id, shard_count) != shard:
+                continue
+            for term_id in set(table.column(doc_id, "lemma")):
+                postings[term_id].add(doc_id)
+        return {store.term(term_id): doc_ids for term_id, doc_ids in postings.items()}
+
+
+def build_positions(store_filename, shard=None, shard_count=1):
+    """
+    Позиции лемм {лемма: {doc_id: позиции}} по таблице sequence хранилища
+    (строка таблицы - лемма на очередной позиции текста документа).
+    """
+    positions = defaultdict(dict)
+    with ArtifactStore(store_filename) as store:
+        table = store.table("sequence")
+        for doc_id in table.doc_ids.tolist():
+            if shard is not None and shard_of(doc_id, shard_count) != shard:
+                continue
+            by_term = defaultdict(list)
+            for position, term_id in enumerate(table.column(doc_id, "lemma").tolist()):
+                by_term[term_id].append(position)
+            for term_id, term_positions in by_term.items():
+                positions[term_id][doc_id] = term_positions
+        return {store.term(term_id): by_doc for term_id, by_doc in positions.items()}
+
+
 def save_index_tsv(inverted_index, index_filename="inverted_index.tsv"):
     """
     Сохраняет инвертированный индекс и сопоставление lemma_id -> filename в TSV-файлы.
@@ -37,11 +104,90 @@ def save_index_tsv(inverted_index, index_filename="inverted_index.tsv"):
             index_file.write(f"{term}\t{file_ids_str}\n")
 
 
+def save_index_binary(inverted_index, index_filename="inverted_index.bin"):
+    """
+    Сохраняет инвертированный индекс в бинарном формате (см. binary_index.py):
+    отсортированный словарь терминов и постинги в delta+varint-кодировке.
+    """
+    write_binary_index(inverted_index, index_filename)
+
+
+def save_index_segments(inverted_index, index_dir="segments", positions=None):
+    """
+    Пересоздаёт сегментированный индекс (см. segments.py) одним сегментом, с позициями, если они переданы.
+    Дальнейшие изменения корпуса добавляются в него командой segments.py без полной перестройки.
+    """
+    SegmentedIndex.create(index_dir, inverted_index, positions)
+
+
+def save_positions(store_filename, positions_filename=POSITIONS_FILE, shard=None, shard_count=1, positions=None):
+    """
+    Строит (если не переданы готовые positions) и сохраняет позиционный индекс (см. positional_index.py).
+    """
+    if positions is None:
+        positions = build_positions(store_filename, shard, shard_count)
+    write_positional_index(positions, positions_filename)
+
+
+def build_shard(lemmas_folder, shard, shard_count, index_filename, positions_filename=None):
+    """
+    Строит и сохраняет один шард бинарного индекса и, если задан positions_filename,
+    позиционного (выполняется в процессе пула).
+    """
+    write_binary_index(build_index(lemmas_folder, shard, shard_count), index_filename)
+    if positions_filename:
+        save_positions(lemmas_folder, positions_filename, shard, shard_count)
+    return index_filename
+
+
+def build_sharded_index(lemmas_folder, shard_count, index_filename="inverted_index.bin", workers=None,
+                        positions_filename=None):
+    """
+    Параллельно строит shard_count шардов бинарного индекса:
+    inverted_index.shard0-of-N.bin, ... Документ попадает в шард doc_id % N.
+    С positions_filename рядом строятся шарды позиционного индекса positions.shard0-of-N.bin, ...
+    """
+    filenames = [shard_filename(index_filename, shard, shard_count) for shard in range(shard_count)]
+    with ProcessPoolExecutor(max_workers=workers or min(shard_count, os.cpu_count() or 1)) as executor:
+        futures = [executor.submit(build_shard, lemmas_folder, shard, shard_count, filename,
+                                   shard_filename(positions_filename, shard, shard_count) if positions_filename else None)
+                   for shard, filename in enumerate(filenames)]
+        return [future.result() for future in futures]
+
+
 def main():
-    lemmas_folder = "../tokenizer-lemmatizer/lemmas"
-    inverted_index = build_index(lemmas_folder)
-    save_index_tsv(inverted_index)
-    print("Индекс успешно построен и сохранён в формате TSV.")
+    lemmas_folder = TOKENS_STORE if os.path.exists(TOKENS_STORE) else LEMMAS_FOLDER
+    with_positions = os.path.isfile(lemmas_folder)
+    if "--shards" in sys.argv:
+        position = sys.argv.index("--shards")
+        shard_count = int(sys.argv[position + 1]) if len(sys.argv) > position + 1 else DEFAULT_SHARDS
+        with batch_span("index_build_shards", shard_count):
+            filenames = build_sharded_index(lemmas_folder, shard_count,
+                                            positions_filename=POSITIONS_FILE if with_positions else None)
+        REGISTRY.write_textfile(METRICS_FILE)
+        print(f"Построено шардов: {len(filenames)}: {', '.join(filenames)}")
+        return
+
+    with batch_span("index_build"):
+        inverted_index = build_index(lemmas_folder)
+    with batch_span("index_save_tsv"):
+        save_index_tsv(inverted_index)
+    with batch_span("index_save_binary"):
+        save_index_binary(inverted_index)
+    positions = None
+    if with_positions:
+        with batch_span("index_build_positions"):
+            positions = build_positions(lemmas_folder)
+        with batch_span("index_save_positions"):
+            save_positions(lemmas_folder, positions=positions)
+    with batch_span("index_save_segments"):
+        save_index_segments(inverted_index, positions=positions)
+    REGISTRY.write_textfile(METRICS_FILE)
+    print("Индекс успешно построен и сохранён в форматах TSV, BIN и в папке segments.")
+    if with_positions:
+        print(f"Позиционный индекс для фраз и NEAR: {POSITIONS_FILE}")
+    else:
+        print(f"Позиционный индекс не построен: нет хранилища {TOKENS_STORE}")
 
 
 if __name__ == "__main__":
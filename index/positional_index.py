@@ -0,0 +1,228 @@
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+
+from binary_index import decode_postings, encode_postings
+
+# Позиционный индекс positions.bin: для каждой леммы - документы, в которых она есть,
+# и номера слов, на которых она стоит в каждом из них. Позиция - номер токена в тексте
+# после отбрасывания стоп-слов и коротких слов (common/analyzer.py); фраза запроса
+# разбирается тем же анализатором, поэтому "queen of hearts" ищется как "queen hearts".
+#
+# Формат файла:
+#   заголовок  - MAGIC, версия формата, число терминов, число документов,
+#                смещения секций строк терминов и записей
+#   словарь    - term_count записей фиксированной длины, отсортированных по термину:
+#                (смещение строки, длина строки, смещение записи, длины трёх частей записи, df)
+#   строки     - термины в UTF-8 подряд
+#   записи     - для каждого термина три части:
+#                  документы  - id документов, дельты + varint (как в binary_index.py);
+#                  границы    - конец списка позиций каждого документа в части позиций
+#                               (нарастающие смещения, дельты + varint, то есть длины списков);
+#                  позиции    - списки позиций документов, каждый дельты + varint.
+#
+# Границы позволяют декодировать позиции только тех документов, которые остались после
+# пересечения списков документов, а не все вхождения частого термина.
+MAGIC = b"ITPX"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHIIQQ")
+ENTRY = struct.Struct("<QHQIIII")
+
+
+def write_positional_index(positions, index_filename="positions.bin"):
+    """
+    Сохраняет позиции {термин: {doc_id: отсортированные позиции}}.
+    """
+    terms = sorted(positions.keys(), key=lambda t: t.encode("utf-8"))
+    universe = set()
+    term_blob = bytearray()
+    records_blob = bytearray()
+    entries = []
+    for term in terms:
+        encoded_term = term.encode("utf-8")
+        by_doc = positions[term]
+        doc_ids = sorted(by_doc)
+        universe.update(doc_ids)
+
+        position_lists = bytearray()
+        ends = []
+        for doc_id in doc_ids:
+            position_lists += encode_postings(by_doc[doc_id])
+            ends.append(len(position_lists))
+        encoded_docs = encode_postings(doc_ids)
+        encoded_ends = encode_postings(ends)
+
+        entries.append((len(term_blob), len(encoded_term), len(records_blob),
+                        len(encoded_docs), len(encoded_ends), len(position_lists), len(doc_ids)))
+        term_blob += encoded_term
+        records_blob += encoded_docs
+        records_blob += encoded_ends
+        records_blob += position_lists
+
+    terms_offset = HEADER.size + ENTRY.size * len(entries)
+    records_offset = terms_offset + len(term_blob)
+    with open(index_filename, "wb") as index_file:
+        index_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(terms), len(universe),
+                                     terms_offset, records_offset))
+        for entry in entries:
+            index_file.write(ENTRY.pack(*entry))
+        index_file.write(term_blob)
+        index_file.write(records_blob)
+
+
+def phrase_starts(position_lists):
+    """
+    Начала фразы в документе: позиции p первого слова, для которых i-е слово стоит на p + i.
+    Списки позиций сливаются попарно двумя указателями.
+    """
+    starts = position_lists[0]
+    for offset, positions in enumerate(position_lists[1:], 1):
+        matched = array("I")
+        size = len(positions)
+        cursor = 0
+        for start in starts:
+            target = start + offset
+            while cursor < size and positions[cursor] < target:
+                cursor += 1
+            if cursor == size:
+                break
+            if positions[cursor] == target:
+                matched.append(start)
+        starts = matched
+        if not starts:
+            break
+    return starts
+
+
+def near_match(left, left_length, right, right_length, distance):
+    """
+    Есть ли вхождения left и right (начала вхождений длиной left_length и right_length слов),
+    которые не перекрываются и между концом одного и началом другого не больше distance слов.
+    Оба списка обходятся слиянием: нижняя граница окна по right только растёт.
+    """
+    size = len(right)
+    cursor = 0
+    for start in left:
+        end = start + left_length - 1
+        low = start - distance - right_length + 1
+        while cursor < size and right[cursor] < low:
+            cursor += 1
+        position = cursor
+        while position < size and right[position] <= end + distance:
+            other = right[position]
+            if other + right_length - 1 < start or other > end:
+                return True
+            position += 1
+    return False
+
+
+class PositionalIndex:
+    """
+    Позиционный индекс, открытый через mmap: словарь ищется двоичным поиском,
+    позиции декодируются только для запрошенных документов.
+    """
+
+    def __init__(self, index_filename="positions.bin"):
+        self.index_filename = index_filename
+        self._file = open(index_filename, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (magic, version, _flags, self.term_count, self.doc_count,
+         self._terms_offset, self._records_offset) = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Файл {index_filename} не является позиционным индексом")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Неподдерживаемая версия позиционного индекса: {version}")
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.term_count
+
+    def _entry(self, position):
+        return ENTRY.unpack_from(self._mm, HEADER.size + ENTRY.size * position)
+
+    def _term_bytes(self, entry):
+        start = self._terms_offset + entry[0]
+        return self._mm[start:start + entry[1]]
+
+    def _find(self, term):
+        key = term.encode("utf-8")
+        low, high = 0, self.term_count
+        while low < high:
+            middle = (low + high) // 2
+            entry = self._entry(middle)
+            current = self._term_bytes(entry)
+            if current < key:
+                low = middle + 1
+            elif current > key:
+                high = middle
+            else:
+                return entry
+        return None
+
+    def get(self, term, default=None):
+        """
+        id документов с термином (array('I')).
+        """
+        entry = self._find(term)
+        if entry is None:
+            return default
+        return decode_postings(self._mm, self._records_offset + entry[2], entry[3])
+
+    def doc_frequency(self, term):
+        entry = self._find(term)
+        return entry[6] if entry is not None else 0
+
+    def positions(self, term, doc_ids):
+        """
+        Списки позиций термина (array('I')) в документах doc_ids (отсортированы по возрастанию),
+        в том же порядке; документ без термина получает пустой список.
+        """
+        entry = self._find(term)
+        if entry is None:
+            return [array("I") for _ in doc_ids]
+        record = self._records_offset + entry[2]
+        term_docs = decode_postings(self._mm, record, entry[3])
+        ends = decode_postings(self._mm, record + entry[3], entry[4])
+        base = record + entry[3] + entry[4]
+
+        result = []
+        cursor = 0
+        for doc_id in doc_ids:
+            cursor = bisect_left(term_docs, doc_id, cursor)
+            if cursor < len(term_docs) and term_docs[cursor] == doc_id:
+                start = ends[cursor - 1] if cursor else 0
+                result.append(decode_postings(self._mm, base + start, ends[cursor] - start))
+            else:
+                result.append(array("I"))
+        return result
+
+    def items(self):
+        """
+        Все термины с позициями {doc_id: позиции} в порядке словаря - для слияния сегментов.
+        """
+        for position in range(self.term_count):
+            entry = self._entry(position)
+            record = self._records_offset + entry[2]
+            term_docs = decode_postings(self._mm, record, entry[3])
+            ends = decode_postings(self._mm, record + entry[3], entry[4])
+            base = record + entry[3] + entry[4]
+            by_doc = {}
+            start = 0
+            for doc_id, end in zip(term_docs, ends):
+                by_doc[doc_id] = decode_postings(self._mm, base + start, end - start)
+                start = end
+            yield self._term_bytes(entry).decode("utf-8"), by_doc
@@ -0,0 +1,151 @@
+import heapq
+from array import array
+from bisect import bisect_left
+
+# Постинг-листы хранятся как отсортированные массивы array('I') без повторов.
+# Операции не строят промежуточных множеств: пересечение и разность идут
+# галопирующим поиском по длинному списку, поэтому их стоимость
+# определяется длиной короткого списка.
+
+
+def to_postings(file_ids):
+    """
+    Приводит произвольную коллекцию id документов к отсортированному array('I').
+    """
+    if isinstance(file_ids, array):
+        return file_ids
+    return array("I", sorted(set(file_ids)))
+
+
+def _gallop(postings, target, low):
+    """
+    Возвращает первую позицию >= low, где postings[pos] >= target.
+    Шаг поиска удваивается, затем границы уточняются бинарным поиском.
+    """
+    size = len(postings)
+    step = 1
+    high = low
+    while high < size and postings[high] < target:
+        low = high + 1
+        high += step
+        step <<= 1
+    return bisect_left(postings, target, low, min(high, size))
+
+
+def intersect(a, b):
+    """
+    Пересечение двух постинг-листов (AND).
+    """
+    if len(a) > len(b):
+        a, b = b, a
+    result = array("I")
+    position = 0
+    size = len(b)
+    for file_id in a:
+        position = _gallop(b, file_id, position)
+        if position >= size:
+            break
+        if b[position] == file_id:
+            result.append(file_id)
+            position += 1
+    return result
+
+
+def intersect_many(postings_lists):
+    """
+    Пересечение нескольких списков: от самого короткого к самому длинному,
+    с остановкой на пустом промежуточном результате.
+    """
+    if not postings_lists:
+        return array("I")
+    ordered = sorted(postings_lists, key=len)
+    result = ordered[0]
+    for postings in ordered[1:]:
+        if not result:
+            break
+        result = intersect(result, postings)
+    return result
+
+
+def union_many(postings_lists):
+    """
+    Объединение нескольких списков (OR) k-путевым слиянием.
+    """
+    result = array("I")
+    last = None
+    for file_id in heapq.merge(*postings_lists):
+        if file_id != last:
+            result.append(file_id)
+            last = file_id
+    return result
+
+
+def union(a, b):
+    return union_many((a, b))
+
+
+def difference(a, b):
+    """
+    Разность списков (a AND NOT b) без построения дополнения к b.
+    """
+    if not b:
+        return a
+    result = array("I")
+    position = 0
+    size = len(b)
+    for file_id in a:
+        if position < size:
+            position = _gallop(b, file_id, position)
+        if position >= size or b[position] != file_id:
+            result.append(file_id)
+    return result
+
+
+class Complement:
+    """
+    Ленивое отрицание: все документы корпуса, кроме postings.
+    Материализуется только если остаётся результатом всего запроса.
+    """
+    __slots__ = ("postings",)
+
+    def __init__(self, postings):
+        self.postings = postings
+
+    def materialize(self, universe):
+        return difference(universe, self.postings)
+
+
+def negate(operand):
+    if isinstance(operand, Complement):
+        return operand.postings
+    return Complement(operand)
+
+
+def and_operands(a, b):
+    a_negated = isinstance(a, Complement)
+    b_negated = isinstance(b, Complement)
+    if a_negated and b_negated:
+        return Complement(union(a.postings, b.postings))
+    if a_negated:
+        return difference(b, a.postings)
+    if b_negated:
+        return difference(a, b.postings)
+    return intersect(a, b)
+
+
+def or_operands(a, b):
+    a_negated = isinstance(a, Complement)
+    b_negated = isinstance(b, Complement)
+    if a_negated and b_negated:
+        return Complement(intersect(a.postings, b.postings))
+    if a_negated:
+        return Complement(difference(a.postings, b))
+    if b_negated:
+        return Complement(difference(b.postings, a))
+    return union(a, b)
+
+
+def materialize(operand, universe):
+    if isinstance(operand, Complement):
+        return operand.materialize(universe)
+    return operand
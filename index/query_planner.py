@@ -0,0 +1,354 @@
+import re
+from array import array
+
+from positional_index import near_match, phrase_starts
+from postings import Complement, and_operands, difference, intersect, negate, or_operands, union_many
+
+# Планировщик булевых запросов.
+# ОПН из convert_to_postfix превращается в дерево выражения, после чего:
+#   - цепочки AND/OR сворачиваются в один узел с несколькими операндами;
+#   - операнды AND сортируются по оценке числа документов (сначала самые редкие);
+#   - "a AND NOT b" переписывается в разность a - b;
+#   - при выполнении AND и разность останавливаются на пустом промежуточном результате.
+#
+# Фраза (кортеж лемм в ОПН) и "a NEAR/k b" выполняются в два шага: сначала пересекаются
+# списки документов обычного индекса, затем только для оставшихся документов
+# сливаются списки позиций из позиционного индекса (positional_index.py).
+
+NEAR_PATTERN = re.compile(r"NEAR/(\d+)$")
+
+
+def near_distance(token):
+    """
+    k для оператора "NEAR/k" или None, если token - не NEAR.
+    """
+    match = NEAR_PATTERN.match(token) if isinstance(token, str) else None
+    return int(match.group(1)) if match else None
+
+
+def document_frequency(inverted_index, term):
+    if hasattr(inverted_index, "doc_frequency"):
+        return inverted_index.doc_frequency(term)
+    return len(inverted_index.get(term, ()))
+
+
+class Node:
+    estimate = 0
+
+    def children(self):
+        return ()
+
+
+class TermNode(Node):
+    def __init__(self, term):
+        self.term = term
+
+    def label(self):
+        return f"TERM {self.term}"
+
+
+class PhraseNode(Node):
+    def __init__(self, terms):
+        self.terms = terms
+
+    def label(self):
+        return f'PHRASE "{" ".join(self.terms)}"'
+
+
+class NearNode(Node):
+    """
+    left NEAR/distance right; операнды - термины или фразы.
+    """
+
+    def __init__(self, left, right, distance):
+        self.left = left
+        self.right = right
+        self.distance = distance
+
+    def children(self):
+        return (self.left, self.right)
+
+    def label(self):
+        return f"NEAR/{self.distance}"
+
+
+class AndNode(Node):
+    def __init__(self, operands):
+        self.operands = operands
+
+    def children(self):
+        return self.operands
+
+    def label(self):
+        return "AND"
+
+
+class OrNode(Node):
+    def __init__(self, operands):
+        self.operands = operands
+
+    def children(self):
+        return self.operands
+
+    def label(self):
+        return "OR"
+
+
+class NotNode(Node):
+    def __init__(self, operand):
+        self.operand = operand
+
+    def children(self):
+        return (self.operand,)
+
+    def label(self):
+        return "NOT"
+
+
+class DifferenceNode(Node):
+    """
+    positive AND NOT negative_1 AND NOT negative_2 ...
+    """
+
+    def __init__(self, positive, negatives):
+        self.positive = positive
+        self.negatives = negatives
+
+    def children(self):
+        return (self.positive, *self.negatives)
+
+    def label(self):
+        return "DIFFERENCE"
+
+
+def build_tree(postfix_tokens):
+    """
+    Строит дерево выражения из ОПН.
+    """
+    stack = []
+    for token in postfix_tokens:
+        if token in ("AND", "OR"):
+            right = stack.pop()
+            left = stack.pop()
+            node_class = AndNode if token == "AND" else OrNode
+            stack.append(node_class([left, right]))
+        elif token == "NOT":
+            stack.append(NotNode(stack.pop()))
+        elif near_distance(token) is not None:
+            right = stack.pop()
+            left = stack.pop()
+            if not all(isinstance(operand, (TermNode, PhraseNode)) for operand in (left, right)):
+                raise ValueError(f"{token} соединяет только термины и фразы")
+            stack.append(NearNode(left, right, near_distance(token)))
+        elif isinstance(token, tuple):
+            stack.append(PhraseNode(list(token)))
+        else:
+            stack.append(TermNode(token))
+    return stack.pop() if stack else None
+
+
+def _flatten(node, node_class):
+    operands = []
+    for operand in node.operands:
+        if isinstance(operand, node_class):
+            operands.extend(operand.operands)
+        else:
+            operands.append(operand)
+    return operands
+
+
+def optimize(node, inverted_index, universe_size):
+    """
+    Переписывает дерево и проставляет оценки числа документов в node.estimate.
+    """
+    if node is None:
+        return None
+
+    if isinstance(node, TermNode):
+        node.estimate = document_frequency(inverted_index, node.term)
+        return node
+
+    if isinstance(node, PhraseNode):
+        # не больше, чем документов у самого редкого слова фразы
+        node.estimate = min(document_frequency(inverted_index, term) for term in node.terms)
+        return node
+
+    if isinstance(node, NearNode):
+        optimize(node.left, inverted_index, universe_size)
+        optimize(node.right, inverted_index, universe_size)
+        node.estimate = min(node.left.estimate, node.right.estimate)
+        return node
+
+    if isinstance(node, NotNode):
+        operand = optimize(node.operand, inverted_index, universe_size)
+        if isinstance(operand, NotNode):
+            return operand.operand
+        node.operand = operand
+        node.estimate = universe_size - operand.estimate
+        return node
+
+    if isinstance(node, OrNode):
+        operands = [optimize(operand, inverted_index, universe_size) for operand in node.operands]
+        node.operands = _flatten(OrNode(operands), OrNode)
+        node.operands.sort(key=lambda operand: -operand.estimate)
+        node.estimate = min(universe_size, sum(operand.estimate for operand in node.operands))
+        return node
+
+    operands = [optimize(operand, inverted_index, universe_size) for operand in node.operands]
+    operands = _flatten(AndNode(operands), AndNode)
+    positives = [operand for operand in operands if not isinstance(operand, NotNode)]
+    negatives = [operand.operand for operand in operands if isinstance(operand, NotNode)]
+    positives.sort(key=lambda operand: operand.estimate)
+    negatives.sort(key=lambda operand: -operand.estimate)
+
+    if not positives:
+        # NOT a AND NOT b = NOT (a OR b)
+        union_node = negatives[0] if len(negatives) == 1 else OrNode(negatives)
+        if isinstance(union_node, OrNode):
+            union_node.estimate = min(universe_size, sum(operand.estimate for operand in negatives))
+        result = NotNode(union_node)
+        result.estimate = universe_size - union_node.estimate
+        return result
+
+    if len(positives) == 1:
+        positive = positives[0]
+    else:
+        positive = AndNode(positives)
+        positive.estimate = positives[0].estimate
+    if not negatives:
+        return positive
+    result = DifferenceNode(positive, negatives)
+    result.estimate = positive.estimate
+    return result
+
+
+def _candidates(node, inverted_index):
+    """
+    Документы, где есть все слова термина или фразы (пересечение, начиная с самого короткого списка).
+    """
+    if isinstance(node, TermNode):
+        return inverted_index.get(node.term, array("I"))
+    result = None
+    for postings in sorted((inverted_index.get(term, array("I")) for term in node.terms), key=len):
+        result = postings if result is None else intersect(result, postings)
+        if not result:
+            break
+    return result
+
+
+def _starts(node, doc_ids, positional_index):
+    """
+    Для каждого документа doc_ids - начала вхождений термина или фразы.
+    """
+    if positional_index is None:
+        raise ValueError("Для фраз и NEAR нужен позиционный индекс: positions.bin или позиции "
+                         "во всех сегментах (build_index.py)")
+    if isinstance(node, TermNode):
+        return positional_index.positions(node.term, doc_ids)
+    by_term = [positional_index.positions(term, doc_ids) for term in node.terms]
+    return [phrase_starts(lists) for lists in zip(*by_term)]
+
+
+def _length(node):
+    return len(node.terms) if isinstance(node, PhraseNode) else 1
+
+
+def execute(node, inverted_index, actuals=None, positional_index=None):
+    """
+    Выполняет план. Возвращает array('I') или ленивое отрицание Complement.
+    Если передан словарь actuals, в него записываются фактические размеры
+    результатов узлов (id(node) -> число документов или Complement).
+    positional_index нужен только планам с фразами и NEAR.
+    """
+    if node is None:
+        return array("I")
+
+    if isinstance(node, TermNode):
+        result = inverted_index.get(node.term, array("I"))
+    elif isinstance(node, PhraseNode):
+        doc_ids = _candidates(node, inverted_index)
+        result = array("I")
+        if doc_ids:
+            for doc_id, starts in zip(doc_ids, _starts(node, doc_ids, positional_index)):
+                if starts:
+                    result.append(doc_id)
+    elif isinstance(node, NearNode):
+        left_docs = _candidates(node.left, inverted_index)
+        right_docs = _candidates(node.right, inverted_index)
+        if actuals is not None:
+            actuals[id(node.left)] = left_docs
+            actuals[id(node.right)] = right_docs
+        doc_ids = intersect(left_docs, right_docs)
+        result = array("I")
+        if doc_ids:
+            left_length, right_length = _length(node.left), _length(node.right)
+            for doc_id, left, right in zip(doc_ids, _starts(node.left, doc_ids, positional_index),
+                                           _starts(node.right, doc_ids, positional_index)):
+                if near_match(left, left_length, right, right_length, node.distance):
+                    result.append(doc_id)
+    elif isinstance(node, NotNode):
+        result = negate(execute(node.operand, inverted_index, actuals, positional_index))
+    elif isinstance(node, AndNode):
+        result = None
+        for operand in node.operands:
+            current = execute(operand, inverted_index, actuals, positional_index)
+            if result is None:
+                result = current
+            elif isinstance(result, Complement) or isinstance(current, Complement):
+                result = and_operands(result, current)
+            else:
+                result = intersect(result, current)
+            if not isinstance(result, Complement) and not result:
+                break
+    elif isinstance(node, DifferenceNode):
+        result = execute(node.positive, inverted_index, actuals, positional_index)
+        for negative in node.negatives:
+            if not isinstance(result, Complement) and not result:
+                break
+            current = execute(negative, inverted_index, actuals, positional_index)
+            if isinstance(result, Complement) or isinstance(current, Complement):
+                result = and_operands(result, negate(current))
+            else:
+                result = difference(result, current)
+    else:
+        results = [execute(operand, inverted_index, actuals, positional_index) for operand in node.operands]
+        plain = [result for result in results if not isinstance(result, Complement)]
+        result = union_many(plain)
+        for current in results:
+            if isinstance(current, Complement):
+                result = or_operands(result, current)
+
+    if actuals is not None:
+        actuals[id(node)] = result
+    return result
+
+
+def explain(node, universe_size, actuals=None):
+    """
+    Текстовое представление плана: оценка и (если план выполнялся) фактическое
+    число документов для каждого узла. Узлы, до которых выполнение не дошло
+    из-за пустого промежуточного результата, помечены как пропущенные.
+    """
+    if node is None:
+        return "(пустой запрос)"
+
+    lines = []
+
+    def visit(current, depth):
+        line = f"{'  ' * depth}{current.label()}  est={current.estimate}"
+        if actuals is not None:
+            if id(current) in actuals:
+                result = actuals[id(current)]
+                if isinstance(result, Complement):
+                    actual = universe_size - len(result.postings)
+                else:
+                    actual = len(result)
+                line += f"  actual={actual}"
+            else:
+                line += "  (пропущен)"
+        lines.append(line)
+        for child in current.children():
+            visit(child, depth + 1)
+
+    visit(node, 0)
+    return "\n".join(lines)
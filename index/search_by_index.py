@@ -1,8 +1,39 @@
+import heapq
+import os
 import re
+import sys
+from array import array
 
-from nltk.stem import WordNetLemmatizer
+from binary_index import BinaryIndex
+from positional_index import PositionalIndex
+from postings import and_operands, materialize, negate, or_operands, union_many
+from query_planner import Node, NearNode, PhraseNode, TermNode, build_tree, execute, explain, near_distance, optimize
+from segments import MANIFEST_FILE, SegmentReader
+from sharding import open_shard
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.cache import LRUCache
+from common.analyzer import Analyzer
+from common.batch import DEFAULT_CHUNK_SIZE, run_batches
+from common.metrics import span
+from common.shards import ShardPool, find_shard_files
+from common.snapshots import SnapshotHolder, current_version
+
+# Общий с токенизатором анализатор: термины запроса разбираются и приводятся к леммам так же, как при индексации
+analyzer = Analyzer()
+lemmatizer = analyzer.lemma_cache
+
+# Версионированные снимки индекса (common/snapshots.py)
+SNAPSHOT_DIR = "../index_snapshots"
+
+# Операторы - только отдельными словами: "android" и "notebook" остаются терминами.
+# Фраза - текст в кавычках (незакрытая кавычка - до конца запроса), NEAR/k - оператор близости
+QUERY_TOKEN_PATTERN = re.compile(r'"[^"]*"?|\(|\)|\bAND\b|\bOR\b|\bNOT\b|\bNEAR/\d+\b|[^\s\(\)"]+',
+                                 flags=re.IGNORECASE)
+OPERATORS = {"AND", "OR", "NOT"}
+# Позиционный индекс (positional_index.py) для фраз и NEAR
+POSITIONS_FILE = "positions.bin"
 
-lemmatizer = WordNetLemmatizer()
 
 def load_inverted_index_tsv(tsv_file):
     index = {}
@@ -16,26 +47,92 @@ def load_inverted_index_tsv(tsv_file):
                 term, files_str = line.split("\t")
             except ValueError:
                 continue
-            file_ids = set(map(int, files_str.split()))
-            index[term] = file_ids
+            index[term] = array("I", sorted(map(int, files_str.split())))
     return index
 
+
+def load_inverted_index(index_file="inverted_index.bin", tsv_file="inverted_index.tsv", segments_dir="segments"):
+    """
+    Открывает сегментированный индекс, если он есть, иначе бинарный индекс через mmap, иначе читает TSV.
+    """
+    if os.path.exists(os.path.join(segments_dir, MANIFEST_FILE)):
+        return SegmentReader(segments_dir)
+    if os.path.exists(index_file):
+        return BinaryIndex(index_file)
+    return load_inverted_index_tsv(tsv_file)
+
+
+def load_positional_index(positions_file=POSITIONS_FILE):
+    """
+    Позиционный индекс или None, если он не построен (тогда фразы и NEAR недоступны).
+    """
+    return PositionalIndex(positions_file) if os.path.exists(positions_file) else None
+
+
+def select_positional_index(inverted_index, positional_index):
+    """
+    Позиционный индекс для поиска по inverted_index. У сегментированного индекса позиции
+    хранятся в самих сегментах: positions.bin последней полной сборки не знает документов,
+    добавленных segments.py после неё. Если у части сегментов позиций нет, возвращается None -
+    фразы и NEAR завершаются ошибкой, а не пропускают документы этих сегментов.
+    """
+    if isinstance(inverted_index, SegmentReader):
+        return inverted_index if inverted_index.has_positions else None
+    return positional_index
+
+
+def load_snapshot_searcher(path, version):
+    """
+    BooleanSearcher по версии снимка; строится целиком до подмены,
+    поэтому запросы к старой версии не видят наполовину загруженный индекс.
+    """
+    searcher = BooleanSearcher(load_inverted_index(os.path.join(path, "inverted_index.bin"),
+                                                   os.path.join(path, "inverted_index.tsv"),
+                                                   os.path.join(path, "segments")),
+                               positional_index=load_positional_index(os.path.join(path, POSITIONS_FILE)))
+    searcher.generation = version
+    return searcher
+
+
 def make_supported_query(query):
     """
     Разбивает запрос на токены.
-    Поддерживаются: скобки, операторы (AND, OR, NOT) и отдельные термины.
-    Операторы приводятся к верхнему регистру, термины – к леммам в нижнем регистре.
+    Поддерживаются: скобки, операторы (AND, OR, NOT, NEAR/k), фразы в кавычках и отдельные термины.
+    Операторы приводятся к верхнему регистру, термины – к леммам анализатора.
+    Термин из нескольких слов ("red-velvet") становится их конъюнкцией в скобках;
+    термин без слов индекса (стоп-слово, слишком короткое слово) остаётся как есть
+    в нижнем регистре и ничего не находит. Фраза становится кортежем своих лемм,
+    фраза из одной леммы - обычным термином.
     """
-    token_pattern = r'\(|\)|AND|OR|NOT|[^\s\(\)]+'
-    tokens = re.findall(token_pattern, query, flags=re.IGNORECASE)
+    tokens = QUERY_TOKEN_PATTERN.findall(query)
 
     processed = []
     for token in tokens:
-        if token.upper() in {"AND", "OR", "NOT"}:
+        if token.upper() in OPERATORS or near_distance(token.upper()) is not None:
             processed.append(token.upper())
+        elif token in ("(", ")"):
+            processed.append(token)
+        elif token.startswith('"'):
+            lemmas = analyzer.analyze(token.strip('"'))
+            if not lemmas:
+                processed.append(token.lower())
+            elif len(lemmas) == 1:
+                processed.append(lemmas[0])
+            else:
+                processed.append(tuple(lemmas))
         else:
-            lemma = lemmatizer.lemmatize(token.lower())
-            processed.append(lemma)
+            lemmas = analyzer.query_terms(token)
+            if not lemmas:
+                processed.append(token.lower())
+            elif len(lemmas) == 1:
+                processed.append(lemmas[0])
+            else:
+                processed.append("(")
+                for position, lemma in enumerate(lemmas):
+                    if position:
+                        processed.append("AND")
+                    processed.append(lemma)
+                processed.append(")")
     return processed
 
 
@@ -44,14 +141,18 @@ def convert_to_postfix(tokens):
     """
     Преобразует список токенов в обратную польскую нотацию (ОПН)
     с помощью алгоритма сортировочной станции.
-    Приоритет операторов: NOT > AND > OR.
+    Приоритет операторов: NEAR/k > NOT > AND > OR.
     """
     precedence = {"NOT": 3, "AND": 2, "OR": 1}
     output = []
     op_stack = []
 
     for token in tokens:
-        if token == "(":
+        if near_distance(token) is not None:
+            while op_stack and near_distance(op_stack[-1]) is not None:
+                output.append(op_stack.pop())
+            op_stack.append(token)
+        elif token == "(":
             op_stack.append(token)
         elif token == ")":
             while op_stack and op_stack[-1] != "(":
@@ -59,8 +160,8 @@ def convert_to_postfix(tokens):
             if op_stack:  # удаляем "("
                 op_stack.pop()
         elif token in precedence:
-            while (op_stack and op_stack[-1] in precedence and
-                   precedence[op_stack[-1]] >= precedence[token]):
+            while (op_stack and (op_stack[-1] in precedence or near_distance(op_stack[-1]) is not None) and
+                   precedence.get(op_stack[-1], 4) >= precedence[token]):
                 output.append(op_stack.pop())
             op_stack.append(token)
         else:
@@ -73,51 +174,317 @@ def convert_to_postfix(tokens):
     return output
 
 
-def evaluate_postfix(postfix_tokens, inverted_index, all_file_ids):
+def evaluate_postfix(postfix_tokens, inverted_index, all_file_ids, positional_index=None):
+    """
+    Вычисляет ОПН над отсортированными постинг-листами (см. postings.py).
+    NOT не строит дополнение: отрицание остаётся ленивым и раскрывается
+    как разность при AND, а относительно all_file_ids - только в конце.
+    Термины и фразы лежат в стеке узлами плана, пока их не заберёт оператор:
+    NEAR нужны сами узлы, остальным - их постинги.
+    """
+    def resolve(operand):
+        if isinstance(operand, Node):
+            return execute(operand, inverted_index, positional_index=positional_index)
+        return operand
+
     stack = []
     for token in postfix_tokens:
         if token == "AND":
-            b = stack.pop()
-            a = stack.pop()
-            stack.append(a & b)
+            b = resolve(stack.pop())
+            a = resolve(stack.pop())
+            stack.append(and_operands(a, b))
         elif token == "OR":
-            b = stack.pop()
-            a = stack.pop()
-            stack.append(a | b)
+            b = resolve(stack.pop())
+            a = resolve(stack.pop())
+            stack.append(or_operands(a, b))
         elif token == "NOT":
-            a = stack.pop()
-            stack.append(all_file_ids - a)
+            stack.append(negate(resolve(stack.pop())))
+        elif near_distance(token) is not None:
+            right = stack.pop()
+            left = stack.pop()
+            if not all(isinstance(operand, (TermNode, PhraseNode)) for operand in (left, right)):
+                raise ValueError(f"{token} соединяет только термины и фразы")
+            stack.append(NearNode(left, right, near_distance(token)))
+        elif isinstance(token, tuple):
+            stack.append(PhraseNode(list(token)))
         else:
-            stack.append(inverted_index.get(token, set()))
-    return stack.pop() if stack else set()
+            stack.append(TermNode(token))
+    return materialize(resolve(stack.pop()), all_file_ids) if stack else array("I")
 
 
-def boolean_search(query, inverted_index):
+def collect_file_ids(inverted_index):
+    """
+    Все id документов индекса.
+    """
+    if hasattr(inverted_index, "universe"):
+        return inverted_index.universe()
+    return union_many(inverted_index.values())
+
+
+def boolean_search(query, inverted_index, positional_index=None):
     """
     Выполняет булев поиск по строковому запросу
     """
-    tokens = make_supported_query(query)
-    postfix = convert_to_postfix(tokens)
-    all_file_ids = set()
-    for doc_ids in inverted_index.values():
-        all_file_ids.update(doc_ids)
+    with span("boolean_parse"):
+        tokens = make_supported_query(query)
+        postfix = convert_to_postfix(tokens)
+    with span("boolean_collect_ids"):
+        all_file_ids = collect_file_ids(inverted_index)
+
+    with span("boolean_execute"):
+        result = evaluate_postfix(postfix, inverted_index, all_file_ids,
+                                  select_positional_index(inverted_index, positional_index))
+    return list(result)
+
+
+def boolean_search_many(queries, inverted_index, chunk_size=DEFAULT_CHUNK_SIZE, workers=None, positional_index=None):
+    """
+    Пакетный булев поиск (см. BooleanSearcher.search_many): списки id документов в порядке запросов.
+    """
+    searcher = BooleanSearcher(inverted_index, plan_cache_size=0, result_cache_size=0,
+                               positional_index=positional_index)
+    return searcher.search_many(queries, chunk_size, workers)
+
+
+class BatchPostings:
+    """
+    Постинги индекса, декодированные один раз на пачку запросов: термины журнала
+    распределены по Ципфу, и частые термины встречаются во многих запросах пачки.
+    """
+
+    def __init__(self, inverted_index):
+        self.inverted_index = inverted_index
+        self._postings = {}
+
+    def get(self, term, default=None):
+        postings = self._postings.get(term)
+        if postings is None:
+            postings = self.inverted_index.get(term)
+            if postings is None:
+                return default
+            self._postings[term] = postings
+        return postings
+
+
+def normalize_query(query):
+    """
+    Нормализованная запись запроса для ключа кэша:
+    операторы в верхнем регистре, термины в нижнем, пробелы схлопнуты (и внутри фраз).
+    """
+    return " ".join(_normalize_token(token) for token in QUERY_TOKEN_PATTERN.findall(query))
+
+
+def _normalize_token(token):
+    if token.upper() in OPERATORS or near_distance(token.upper()) is not None:
+        return token.upper()
+    if token.startswith('"'):
+        return '"' + " ".join(token.strip('"').lower().split()) + '"'
+    return token.lower()
+
+
+class BooleanSearcher:
+    """
+    Булев поиск по загруженному индексу.
+    Множество всех id документов вычисляется один раз при загрузке индекса,
+    планы запросов (см. query_planner.py) и результаты хранятся в LRU-кэшах.
+    План зависит от частот терминов, поэтому оба кэша сбрасываются
+    при смене индекса (set_index). Фразы и NEAR проверяются по positional_index,
+    а у сегментированного индекса - по позициям его сегментов (select_positional_index).
+    """
 
-    result = evaluate_postfix(postfix, inverted_index, all_file_ids)
-    return sorted(result)
+    def __init__(self, inverted_index, plan_cache_size=1024, result_cache_size=256, positional_index=None):
+        self.plan_cache = LRUCache(plan_cache_size)
+        self.result_cache = LRUCache(result_cache_size)
+        self.generation = 0
+        self.positions_file_index = positional_index
+        self.set_index(inverted_index)
+
+    def set_index(self, inverted_index):
+        self.inverted_index = inverted_index
+        self.positional_index = select_positional_index(inverted_index, self.positions_file_index)
+        self.all_file_ids = collect_file_ids(inverted_index)
+        self.generation += 1
+        self.plan_cache.clear()
+        self.result_cache.clear()
+
+    def refresh(self):
+        """
+        Подхватывает новые сегменты сегментированного индекса без перезапуска.
+        Возвращает True, если индекс сменился. Прежний снимок закрывается после подмены:
+        новый открывает свои файлы сегментов, и без этого каждая перезагрузка
+        оставляла бы открытыми mmap и дескрипторы всех старых сегментов.
+        """
+        reopen = getattr(self.inverted_index, "reopen", None)
+        if reopen is None:
+            return False
+        previous = self.inverted_index
+        reader = reopen()
+        if reader is previous:
+            return False
+        self.set_index(reader)
+        previous.close()
+        return True
+
+    def parse(self, query):
+        """
+        Возвращает план запроса, лемматизируя и разбирая его только при промахе кэша.
+        """
+        key = normalize_query(query)
+        plan = self.plan_cache.get(key)
+        if plan is None:
+            with span("boolean_parse"):
+                postfix = convert_to_postfix(make_supported_query(key))
+            with span("boolean_plan"):
+                plan = optimize(build_tree(postfix), self.inverted_index, len(self.all_file_ids))
+            self.plan_cache.put(key, plan)
+        return plan
+
+    def search(self, query):
+        key = normalize_query(query)
+        result = self.result_cache.get(key)
+        if result is None:
+            plan = self.parse(query)
+            with span("boolean_execute"):
+                postings = execute(plan, self.inverted_index, positional_index=self.positional_index)
+            with span("boolean_materialize"):
+                result = materialize(postings, self.all_file_ids)
+            self.result_cache.put(key, result)
+        return list(result)
+
+    def search_many(self, queries, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+        """
+        Пакетный поиск для прогона журнала запросов: списки id документов в порядке запросов.
+        Одинаковые (после нормализации) запросы выполняются один раз, постинги терминов
+        декодируются один раз на пачку из chunk_size запросов, кэши результатов и планов
+        интерактивного поиска не заполняются. workers > 1 - пачки выполняются в пуле
+        процессов (common/batch.py).
+        """
+        keys = [normalize_query(query) for query in queries]
+        return run_batches(self, "search_chunk", keys, chunk_size, workers)
+
+    def search_chunk(self, keys):
+        """
+        Одна пачка search_many (запросы уже нормализованы).
+        """
+        postings_memo = BatchPostings(self.inverted_index)
+        results = []
+        with span("boolean_batch"):
+            for key in keys:
+                plan = self.plan_cache.get(key)
+                if plan is None:
+                    postfix = convert_to_postfix(make_supported_query(key))
+                    plan = optimize(build_tree(postfix), self.inverted_index, len(self.all_file_ids))
+                postings = execute(plan, postings_memo, positional_index=self.positional_index)
+                results.append(list(materialize(postings, self.all_file_ids)))
+        return results
+
+    def explain(self, query):
+        """
+        Выполняет запрос и возвращает выбранный план
+        с оценками и фактическим числом документов по узлам.
+        """
+        plan = self.parse(query)
+        actuals = {}
+        execute(plan, self.inverted_index, actuals, self.positional_index)
+        return explain(plan, len(self.all_file_ids), actuals)
+
+    def stats(self):
+        return {
+            "generation": self.generation,
+            "documents": len(self.all_file_ids),
+            "plan_cache": self.plan_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+            "lemma_cache": lemmatizer.stats(),
+        }
+
+
+class ShardedBooleanSearcher:
+    """
+    Булев поиск по шардам индекса (build_index.py --shards N).
+    Координатор один раз лемматизирует и разбирает запрос, шарды выполняют его
+    параллельно в пуле процессов (common/shards.py), а отсортированные результаты
+    шардов сливаются. Шарды делят документы без пересечений, поэтому NOT
+    считается относительно документов своего шарда и объединение даёт тот же
+    результат, что и нешардированный индекс.
+    """
+
+    def __init__(self, shard_files, workers=None, executor="process", result_cache_size=256, positions_files=None):
+        # Шард открывается по паре (файл индекса, файл позиций или None)
+        self.pool = ShardPool(list(zip(shard_files, positions_files or [None] * len(shard_files))),
+                              open_shard, workers, executor)
+        self.result_cache = LRUCache(result_cache_size)
+
+    def search(self, query):
+        key = normalize_query(query)
+        result = self.result_cache.get(key)
+        if result is None:
+            with span("boolean_parse"):
+                postfix = convert_to_postfix(make_supported_query(key))
+            with span("boolean_shards"):
+                shard_results = self.pool.scatter("search", postfix)
+            with span("boolean_merge_shards"):
+                parts = []
+                for data in shard_results:
+                    postings = array("I")
+                    postings.frombytes(data)
+                    parts.append(postings)
+                result = array("I", heapq.merge(*parts))
+            self.result_cache.put(key, result)
+        return list(result)
+
+    def close(self):
+        self.pool.close()
+
+    def stats(self):
+        return {
+            "shards": len(self.pool),
+            "documents": sum(self.pool.scatter("doc_count")),
+            "result_cache": self.result_cache.stats(),
+            "lemma_cache": lemmatizer.stats(),
+        }
 
 
 def main():
-    inverted_index = load_inverted_index_tsv("inverted_index.tsv")
+    shard_files = find_shard_files("inverted_index.bin") if "--shards" in sys.argv[1:] else []
+    snapshots = None
+    if shard_files:
+        positions_files = find_shard_files(POSITIONS_FILE)
+        searcher = ShardedBooleanSearcher(shard_files,
+                                          positions_files=positions_files if len(positions_files) == len(shard_files) else None)
+        print(f"Поиск по {len(shard_files)} шардам")
+    elif current_version(SNAPSHOT_DIR) is not None:
+        snapshots = SnapshotHolder(SNAPSHOT_DIR, load_snapshot_searcher)
+        searcher = snapshots.get() or BooleanSearcher(load_inverted_index(), positional_index=load_positional_index())
+        print(f"Поиск по снимку индекса v{snapshots.version}")
+    else:
+        searcher = BooleanSearcher(load_inverted_index(), positional_index=load_positional_index())
     print("Введите запрос")
-    print("Введите 'exit' для выхода.")
+    print('Фразы - в кавычках ("red velvet"), близость - a NEAR/5 b.')
+    print("Введите 'exit' для выхода, 'stats' для статистики кэшей,")
+    print("'explain <запрос>' для просмотра плана запроса.")
 
     while True:
         query = input("Ввод запроса: ").strip()
         if query.lower() == "exit":
             break
+        if query.lower() == "stats":
+            print(searcher.stats())
+            print()
+            continue
+        if query.lower().startswith("explain ") and hasattr(searcher, "explain"):
+            print(searcher.explain(query[len("explain "):]))
+            print()
+            continue
 
         try:
-            result_file_ids = boolean_search(query, inverted_index)
+            if snapshots is not None:
+                # Новая версия загружается в фоне; до конца загрузки запросы идут к старой
+                if current_version(SNAPSHOT_DIR) != snapshots.version:
+                    snapshots.reload_async()
+                searcher = snapshots.get() or searcher
+            elif hasattr(searcher, "refresh"):
+                searcher.refresh()
+            result_file_ids = searcher.search(query)
             print(f"\nНайдено документов: {len(result_file_ids)}")
             for file_id in result_file_ids:
                 print(f"{file_id}")
@@ -125,6 +492,8 @@ def main():
             print("Ошибка при выполнении запроса:", e)
         print()
 
+    lemmatizer.save()
+
 
 if __name__ == "__main__":
     main()
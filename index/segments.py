@@ -0,0 +1,592 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+
+from binary_index import BinaryIndex, write_binary_index
+from positional_index import PositionalIndex, write_positional_index
+from postings import difference, to_postings, union_many
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.artifact_store import ArtifactStore
+
+# Сегментированный инвертированный индекс (в духе Lucene).
+#
+# Папка индекса:
+#   segments.json        - манифест: поколение, список сегментов и их файлов удалений
+#   seg_<N>.bin          - неизменяемый сегмент в формате inverted_index.bin (binary_index.py)
+#   seg_<N>.pos          - позиции лемм документов сегмента в формате positions.bin (positional_index.py)
+#   seg_<N>_<G>.del      - удалённые id документов сегмента (array('I')), записанные в поколении G
+#
+# Новые и изменённые документы записываются в новый маленький сегмент, а их старые
+# копии в остальных сегментах помечаются удалёнными (tombstone) - каждый документ живёт
+# ровно в одном сегменте. Файлы сегментов и удалений никогда не перезаписываются:
+# коммит пишет новые файлы и атомарно заменяет манифест, поэтому читатель всегда
+# видит согласованный снимок. Политика слияния объединяет сегменты одного порядка
+# размера и выбрасывает удалённые документы; слияние может идти в фоновом потоке.
+# Позиции для фраз и NEAR пишутся и сливаются вместе с сегментом, поэтому документы,
+# добавленные без полной перестройки, тоже находятся фразами. Сегмент, записанный
+# без позиций (леммы из lemmas_N.txt), отмечается в манифесте: по такому индексу
+# фразы и NEAR недоступны, а не теряют его документы.
+
+MANIFEST_FILE = "segments.json"
+MERGE_FACTOR = 10
+# Сегмент переписывается, если удалена больше чем эта доля его документов
+MAX_DELETED_RATIO = 0.5
+
+_SEGMENT_FILE_PATTERN = re.compile(r"^seg_\d+(_\d+)?\.(bin|del|pos)$")
+
+
+def _read_doc_ids(path):
+    doc_ids = array("I")
+    with open(path, "rb") as f:
+        doc_ids.frombytes(f.read())
+    return doc_ids
+
+
+def _write_doc_ids(path, doc_ids):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        array("I", doc_ids).tofile(f)
+    os.replace(tmp_path, path)
+
+
+def _read_manifest(index_dir):
+    with open(os.path.join(index_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class Segment:
+    """
+    Открытый сегмент: BinaryIndex, позиционный индекс (если сегмент записан с позициями)
+    и отсортированный список удалённых в нём документов.
+    """
+
+    def __init__(self, index_dir, info):
+        self.name = info["name"]
+        self.doc_count = info["doc_count"]
+        self.index = BinaryIndex(os.path.join(index_dir, self.name + ".bin"))
+        try:
+            self.positional = PositionalIndex(os.path.join(index_dir, self.name + ".pos")) if info.get("positions") else None
+            deleted_file = info.get("deleted_file")
+            self.deleted = _read_doc_ids(os.path.join(index_dir, deleted_file)) if deleted_file else array("I")
+        except OSError:
+            self.close()
+            raise
+        self._live = None
+
+    @property
+    def live_count(self):
+        return self.doc_count - len(self.deleted)
+
+    def get(self, term):
+        postings = self.index.get(term)
+        if postings is None:
+            return None
+        return difference(postings, self.deleted) if self.deleted else postings
+
+    def live_doc_ids(self):
+        if self._live is None:
+            self._live = difference(self.index.universe(), self.deleted)
+        return self._live
+
+    def positions(self, term, doc_ids):
+        """
+        Позиции термина в живых документах сегмента (как PositionalIndex.positions);
+        удалённый документ получает пустой список - его живая копия в другом сегменте.
+        """
+        result = self.positional.positions(term, doc_ids)
+        if self.deleted:
+            for position, doc_id in enumerate(doc_ids):
+                if result[position] and _contains(self.deleted, doc_id):
+                    result[position] = array("I")
+        return result
+
+    def close(self):
+        self.index.close()
+        if getattr(self, "positional", None) is not None:
+            self.positional.close()
+
+
+class SegmentReader:
+    """
+    Неизменяемый снимок сегментированного индекса для поиска.
+    Поддерживает тот же интерфейс, что BinaryIndex (get, doc_frequency, universe, keys, items),
+    поэтому BooleanSearcher и планировщик работают с ним без изменений.
+    Если у всех сегментов есть позиции (has_positions), снимок служит и позиционным
+    индексом для фраз и NEAR (positions).
+    reopen() возвращает новый снимок, если индекс был изменён после открытия.
+    """
+
+    def __init__(self, index_dir):
+        self.index_dir = index_dir
+        # Между чтением манифеста и открытием файлов писатель может удалить
+        # устаревшие файлы - тогда перечитываем уже новый манифест
+        for attempt in range(10):
+            manifest = _read_manifest(index_dir)
+            try:
+                self.segments = [Segment(index_dir, info) for info in manifest["segments"]]
+                break
+            except FileNotFoundError:
+                if attempt == 9:
+                    raise
+        self.generation = manifest["generation"]
+        self._universe = None
+
+    def reopen(self):
+        if _read_manifest(self.index_dir)["generation"] == self.generation:
+            return self
+        return SegmentReader(self.index_dir)
+
+    def close(self):
+        for segment in self.segments:
+            segment.close()
+
+    def get(self, term, default=None):
+        found = [postings for postings in (segment.get(term) for segment in self.segments) if postings is not None]
+        if not found:
+            return default
+        if len(found) == 1:
+            return found[0]
+        return union_many(found)
+
+    def __getitem__(self, term):
+        postings = self.get(term)
+        if postings is None:
+            raise KeyError(term)
+        return postings
+
+    def __contains__(self, term):
+        return any(term in segment.index for segment in self.segments)
+
+    def doc_frequency(self, term):
+        """
+        Оценка DF для планировщика: сумма DF по сегментам без учёта удалённых документов.
+        """
+        return sum(segment.index.doc_frequency(term) for segment in self.segments)
+
+    def universe(self):
+        if self._universe is None:
+            self._universe = union_many(segment.live_doc_ids() for segment in self.segments)
+        return self._universe
+
+    @property
+    def doc_count(self):
+        return sum(segment.live_count for segment in self.segments)
+
+    @property
+    def has_positions(self):
+        return all(segment.positional is not None for segment in self.segments)
+
+    def positions(self, term, doc_ids):
+        """
+        Позиции термина в документах doc_ids: каждый документ жив ровно в одном сегменте.
+        """
+        result = [array("I") for _ in doc_ids]
+        for segment in self.segments:
+            for position, found in enumerate(segment.positions(term, doc_ids)):
+                if found:
+                    result[position] = found
+        return result
+
+    def keys(self):
+        terms = {term for segment in self.segments for term in segment.index.keys()}
+        return iter(sorted(terms, key=lambda t: t.encode("utf-8")))
+
+    def items(self):
+        for term in self.keys():
+            postings = self.get(term)
+            if postings:
+                yield term, postings
+
+    def values(self):
+        for _, postings in self.items():
+            yield postings
+
+    def __len__(self):
+        return sum(1 for _ in self.keys())
+
+
+class SegmentedIndex:
+    """
+    Писатель сегментированного индекса.
+
+    add_documents({doc_id: леммы}, sequences) - добавить или заменить документы (новый сегмент),
+    delete_documents(doc_ids)      - пометить документы удалёнными,
+    maybe_merge()                  - выполнить слияния по политике,
+    merge_in_background()          - то же в фоновом потоке.
+
+    Изменения сразу фиксируются новым поколением манифеста; открытые читатели
+    увидят их после reopen(). Предполагается один писатель на папку индекса.
+    """
+
+    def __init__(self, index_dir, merge_factor=MERGE_FACTOR, max_deleted_ratio=MAX_DELETED_RATIO):
+        self.index_dir = index_dir
+        self.merge_factor = merge_factor
+        self.max_deleted_ratio = max_deleted_ratio
+        self._lock = threading.Lock()
+        self._merge_thread = None
+        self._merging = set()  # имена сегментов, которые сейчас сливаются
+        self._writing = set()  # файлы сливаемых сегментов, ещё не попавшие в манифест
+        self._doc_ids = {}  # имя сегмента -> все id документов сегмента (кэш)
+        os.makedirs(index_dir, exist_ok=True)
+        if os.path.exists(os.path.join(index_dir, MANIFEST_FILE)):
+            self.manifest = _read_manifest(index_dir)
+        else:
+            self.manifest = {"generation": 0, "next_segment": 1, "segments": []}
+            self._commit()
+
+    @classmethod
+    def create(cls, index_dir, inverted_index, positions=None, **kwargs):
+        """
+        Создаёт индекс заново из готового словаря {термин: id документов} одним сегментом;
+        positions - позиции {термин: {doc_id: позиции}} для фраз и NEAR.
+        """
+        if os.path.isdir(index_dir):
+            for filename in os.listdir(index_dir):
+                if filename == MANIFEST_FILE or _SEGMENT_FILE_PATTERN.match(filename):
+                    os.remove(os.path.join(index_dir, filename))
+        index = cls(index_dir, **kwargs)
+        with index._lock:
+            info = index._write_segment(inverted_index, positions)
+            if info is not None:
+                index.manifest["segments"].append(info)
+            index._commit()
+        return index
+
+    def open_reader(self):
+        return SegmentReader(self.index_dir)
+
+    @property
+    def segments(self):
+        return list(self.manifest["segments"])
+
+    def _path(self, filename):
+        return os.path.join(self.index_dir, filename)
+
+    def _segment_doc_ids(self, info):
+        doc_ids = self._doc_ids.get(info["name"])
+        if doc_ids is None:
+            with BinaryIndex(self._path(info["name"] + ".bin")) as segment:
+                doc_ids = segment.universe()
+            self._doc_ids[info["name"]] = doc_ids
+        return doc_ids
+
+    def _deleted(self, info):
+        if not info.get("deleted_file"):
+            return array("I")
+        return _read_doc_ids(self._path(info["deleted_file"]))
+
+    def _write_segment(self, inverted_index, positions=None):
+        """
+        Записывает новый сегмент (и его позиции, если они переданы)
+        и возвращает его описание для манифеста (или None, если он пуст).
+        """
+        doc_ids = union_many(to_postings(file_ids) for file_ids in inverted_index.values())
+        if not doc_ids:
+            return None
+        name = f"seg_{self.manifest['next_segment']}"
+        self.manifest["next_segment"] += 1
+        write_binary_index(inverted_index, self._path(name + ".bin"))
+        if positions is not None:
+            write_positional_index(positions, self._path(name + ".pos"))
+        self._doc_ids[name] = doc_ids
+        return {"name": name, "doc_count": len(doc_ids), "deleted_file": None, "deleted_count": 0,
+                "positions": positions is not None}
+
+    def _add_tombstones(self, info, doc_ids):
+        """
+        Помечает удалёнными те из doc_ids, что есть в сегменте (новый файл удалений).
+        """
+        segment_doc_ids = self._segment_doc_ids(info)
+        deleted = self._deleted(info)
+        present = [doc_id for doc_id in doc_ids if _contains(segment_doc_ids, doc_id) and not _contains(deleted, doc_id)]
+        if not present:
+            return
+        deleted = union_many((deleted, to_postings(present)))
+        deleted_file = f"{info['name']}_{self.manifest['generation'] + 1}.del"
+        _write_doc_ids(self._path(deleted_file), deleted)
+        info["deleted_file"] = deleted_file
+        info["deleted_count"] = len(deleted)
+
+    def _commit(self):
+        """
+        Фиксирует манифест нового поколения и удаляет файлы, на которые он больше не ссылается.
+        """
+        self.manifest["generation"] += 1
+        tmp_file = self._path(MANIFEST_FILE + ".tmp")
+        with open(tmp_file, "w", encoding="utf-8") as f:
+            json.dump(self.manifest, f, indent=1)
+        os.replace(tmp_file, self._path(MANIFEST_FILE))
+
+        referenced = set(self._writing)
+        for info in self.manifest["segments"]:
+            referenced.add(info["name"] + ".bin")
+            if info.get("positions"):
+                referenced.add(info["name"] + ".pos")
+            if info.get("deleted_file"):
+                referenced.add(info["deleted_file"])
+        for filename in os.listdir(self.index_dir):
+            if _SEGMENT_FILE_PATTERN.match(filename) and filename not in referenced:
+                try:
+                    os.remove(self._path(filename))
+                except OSError:
+                    pass  # файл ещё открыт читателем (Windows) - удалится при следующем коммите
+        for name in list(self._doc_ids):
+            if name + ".bin" not in referenced:
+                del self._doc_ids[name]
+
+    def add_documents(self, documents, sequences=None):
+        """
+        Добавляет или заменяет документы. documents - {doc_id: итерируемое лемм},
+        sequences - {doc_id: леммы в порядке слов текста} для позиций фраз и NEAR.
+        Без sequences сегмент записывается без позиций, и фразы и NEAR по индексу
+        недоступны, пока он не будет пересобран build_index.py.
+        """
+        inverted_index = {}
+        for doc_id, lemmas in documents.items():
+            for lemma in lemmas:
+                inverted_index.setdefault(lemma, set()).add(doc_id)
+        positions = None
+        if sequences is not None:
+            positions = {}
+            for doc_id in documents:
+                for position, lemma in enumerate(sequences.get(doc_id, ())):
+                    positions.setdefault(lemma, {}).setdefault(doc_id, []).append(position)
+        doc_ids = sorted(documents)
+        with self._lock:
+            for info in self.manifest["segments"]:
+                self._add_tombstones(info, doc_ids)
+            info = self._write_segment(inverted_index, positions)
+            if info is not None:
+                self.manifest["segments"].append(info)
+            self._commit()
+
+    def delete_documents(self, doc_ids):
+        doc_ids = sorted(set(doc_ids))
+        with self._lock:
+            for info in self.manifest["segments"]:
+                self._add_tombstones(info, doc_ids)
+            self._commit()
+
+    def find_merges(self):
+        """
+        Политика слияния: группы из merge_factor сегментов одного порядка размера
+        (по числу живых документов) и сегменты с большой долей удалённых документов.
+        Возвращает список групп имён сегментов.
+        """
+        merges = []
+        tiers = {}
+        for info in self.manifest["segments"]:
+            if info["name"] in self._merging:
+                continue
+            live = info["doc_count"] - info["deleted_count"]
+            if live == 0 or info["deleted_count"] > info["doc_count"] * self.max_deleted_ratio:
+                merges.append([info["name"]])
+                continue
+            tier = int(math.log(live, self.merge_factor))
+            tiers.setdefault(tier, []).append(info)
+        for tier in sorted(tiers):
+            candidates = sorted(tiers[tier], key=lambda info: info["doc_count"] - info["deleted_count"])
+            while len(candidates) >= self.merge_factor:
+                merges.append([info["name"] for info in candidates[:self.merge_factor]])
+                candidates = candidates[self.merge_factor:]
+        return merges
+
+    def merge(self, names):
+        """
+        Сливает сегменты в один, отбрасывая удалённые документы.
+        Чтение и запись нового сегмента идут без блокировки; удаления,
+        сделанные за это время в исходных сегментах, переносятся на новый при коммите.
+        """
+        with self._lock:
+            sources = [info for info in self.manifest["segments"]
+                       if info["name"] in names and info["name"] not in self._merging]
+            if not sources:
+                return
+            self._merging.update(info["name"] for info in sources)
+            deleted_at_start = {info["name"]: (info.get("deleted_file"), self._deleted(info)) for info in sources}
+            name = f"seg_{self.manifest['next_segment']}"
+            self.manifest["next_segment"] += 1
+            self._writing.update((name + ".bin", name + ".pos"))
+
+        try:
+            inverted_index = {}
+            for info in sources:
+                deleted = deleted_at_start[info["name"]][1]
+                with BinaryIndex(self._path(info["name"] + ".bin")) as segment:
+                    for term, postings in segment.items():
+                        if deleted:
+                            postings = difference(postings, deleted)
+                        if postings:
+                            inverted_index.setdefault(term, []).append(postings)
+            inverted_index = {term: union_many(lists) for term, lists in inverted_index.items()}
+            # Позиции сливаются, только если они есть у всех исходных сегментов
+            with_positions = all(info.get("positions") for info in sources)
+            merged = None
+            if inverted_index:
+                write_binary_index(inverted_index, self._path(name + ".bin"))
+                if with_positions:
+                    write_positional_index(self._merge_positions(sources, deleted_at_start), self._path(name + ".pos"))
+                doc_ids = union_many(inverted_index.values())
+                self._doc_ids[name] = doc_ids
+                merged = {"name": name, "doc_count": len(doc_ids), "deleted_file": None, "deleted_count": 0,
+                          "positions": with_positions}
+
+            with self._lock:
+                late_deletes = []
+                for info in sources:
+                    deleted_file, deleted = deleted_at_start[info["name"]]
+                    if info.get("deleted_file") != deleted_file:
+                        # Удаления только этого сегмента: документ, удалённый в одном
+                        # исходном сегменте, может быть живым в другом
+                        late_deletes.extend(difference(self._deleted(info), deleted))
+                segments = [info for info in self.manifest["segments"] if info["name"] not in deleted_at_start]
+                if merged is not None:
+                    if late_deletes:
+                        self._add_tombstones(merged, sorted(set(late_deletes)))
+                    segments.append(merged)
+                self.manifest["segments"] = segments
+                self._commit()
+        finally:
+            with self._lock:
+                self._merging.difference_update(deleted_at_start)
+                self._writing.difference_update((name + ".bin", name + ".pos"))
+
+    def _merge_positions(self, sources, deleted_at_start):
+        """
+        Позиции живых документов исходных сегментов слияния: {термин: {doc_id: позиции}}.
+        """
+        positions = {}
+        for info in sources:
+            deleted = deleted_at_start[info["name"]][1]
+            with PositionalIndex(self._path(info["name"] + ".pos")) as segment:
+                for term, by_doc in segment.items():
+                    for doc_id, doc_positions in by_doc.items():
+                        if not _contains(deleted, doc_id):
+                            positions.setdefault(term, {})[doc_id] = doc_positions
+        return positions
+
+    def maybe_merge(self):
+        """
+        Выполняет слияния, пока политика их находит. Возвращает число слияний.
+        """
+        count = 0
+        while True:
+            with self._lock:
+                merges = self.find_merges()
+            if not merges:
+                return count
+            for names in merges:
+                self.merge(names)
+                count += 1
+
+    def merge_in_background(self):
+        """
+        Запускает maybe_merge в фоновом потоке (если он ещё не запущен) и возвращает поток.
+        """
+        if self._merge_thread is None or not self._merge_thread.is_alive():
+            self._merge_thread = threading.Thread(target=self.maybe_merge, daemon=True)
+            self._merge_thread.start()
+        return self._merge_thread
+
+    def wait_for_merges(self):
+        if self._merge_thread is not None:
+            self._merge_thread.join()
+
+    def stats(self):
+        segments = self.manifest["segments"]
+        return {
+            "generation": self.manifest["generation"],
+            "segments": len(segments),
+            "documents": sum(info["doc_count"] - info["deleted_count"] for info in segments),
+            "deleted": sum(info["deleted_count"] for info in segments),
+        }
+
+
+def _contains(postings, doc_id):
+    position = bisect_left(postings, doc_id)
+    return position < len(postings) and postings[position] == doc_id
+
+
+def read_lemmas(lemmas_folder, doc_id, store=None):
+    """
+    Леммы документа из lemmas_<id>.txt (первое слово каждой строки)
+    или, если передано хранилище токенизатора, из его таблицы lemmas.
+    """
+    if store is not None:
+        lemma_ids = store.table("lemmas").column(doc_id, "lemma")
+        if lemma_ids is None:
+            raise FileNotFoundError(f"Документа {doc_id} нет в {store.filename}")
+        return set(store.terms(set(lemma_ids)))
+    lemmas = set()
+    with open(os.path.join(lemmas_folder, f"lemmas_{doc_id}.txt"), "r", encoding="utf-8") as f:
+        for line in f:
+            parts = line.split()
+            if parts:
+                lemmas.add(parts[0])
+    return lemmas
+
+
+def read_sequence(store, doc_id):
+    """
+    Леммы документа в порядке слов текста из таблицы sequence хранилища.
+    """
+    lemma_ids = store.table("sequence").column(doc_id, "lemma")
+    return store.terms(lemma_ids.tolist()) if lemma_ids is not None else []
+
+
+def apply_changes(index, lemmas_folder, changes):
+    """
+    Применяет список изменений краулера (changes.json: added / modified / deleted)
+    к сегментированному индексу. Документы без лемм считаются удалёнными.
+    lemmas_folder - папка с lemmas_N.txt или файл хранилища tokens.art; из хранилища
+    с таблицей sequence вместе с сегментом записываются позиции для фраз и NEAR.
+    """
+    documents = {}
+    deleted = set(changes.get("deleted", ()))
+    store = ArtifactStore(lemmas_folder) if os.path.isfile(lemmas_folder) else None
+    sequences = {} if store is not None and "sequence" in store.tables else None
+    for doc_id in sorted(set(changes.get("added", ())) | set(changes.get("modified", ()))):
+        try:
+            documents[doc_id] = read_lemmas(lemmas_folder, doc_id, store)
+        except FileNotFoundError:
+            deleted.add(doc_id)
+            continue
+        if sequences is not None:
+            sequences[doc_id] = read_sequence(store, doc_id)
+    if store is not None:
+        store.close()
+    if deleted:
+        index.delete_documents(deleted)
+    if documents:
+        index.add_documents(documents, sequences)
+    if sequences is None:
+        print("Сегмент записан без позиций: фразы и NEAR будут недоступны до пересборки build_index.py")
+    return len(documents), len(deleted)
+
+
+def main():
+    index_dir = sys.argv[1] if len(sys.argv) > 1 else "segments"
+    changes_file = sys.argv[2] if len(sys.argv) > 2 else "../crawler/changes.json"
+    if len(sys.argv) > 3:
+        lemmas_folder = sys.argv[3]
+    elif os.path.exists("../tokenizer-lemmatizer/tokens.art"):
+        lemmas_folder = "../tokenizer-lemmatizer/tokens.art"
+    else:
+        lemmas_folder = "../tokenizer-lemmatizer/lemmas"
+    with open(changes_file, "r", encoding="utf-8") as f:
+        changes = json.load(f)
+    index = SegmentedIndex(index_dir)
+    updated, deleted = apply_changes(index, lemmas_folder, changes)
+    merges = index.maybe_merge()
+    print(f"Обновлено документов: {updated}, удалено: {deleted}, слияний: {merges}")
+    print(index.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+from binary_index import BinaryIndex
+from positional_index import PositionalIndex
+from postings import materialize
+from query_planner import build_tree, execute, optimize
+
+
+class IndexShard:
+    """
+    Шард булева индекса в процессе пула: открытый BinaryIndex и множество его документов.
+    Запрос приходит уже разобранным в ОПН (леммы вычисляет координатор),
+    результат возвращается байтами array('I') - так его дешевле передать между процессами.
+    Фразы и NEAR проверяются по позиционному индексу шарда, если он передан.
+    """
+
+    def __init__(self, index_filename, positions_filename=None):
+        self.index = BinaryIndex(index_filename)
+        self.positional_index = PositionalIndex(positions_filename) if positions_filename else None
+        self.all_file_ids = self.index.universe()
+
+    def search(self, postfix):
+        plan = optimize(build_tree(postfix), self.index, len(self.all_file_ids))
+        postings = execute(plan, self.index, positional_index=self.positional_index)
+        return materialize(postings, self.all_file_ids).tobytes()
+
+    def doc_count(self):
+        return len(self.all_file_ids)
+
+
+def open_shard(files):
+    """
+    Открывает шард по паре (файл индекса, файл позиций или None) - opener для ShardPool.
+    """
+    return IndexShard(*files)
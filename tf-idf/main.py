@@ -1,80 +1,66 @@
 import os
-import math
-from collections import defaultdict, Counter
+import sys
+
+from tfidf_builder import TfidfBuilder, build_sharded
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.artifact_store import ArtifactStore
+from common.metrics import REGISTRY, batch_span
 
 PAGES_DIR = '../crawler/downloaded_pages'
+# Хранилище токенизатора; если его нет, читаются tokens_N.txt и lemmas_N.txt
+TOKENS_STORE = '../tokenizer-lemmatizer/tokens.art'
 TOKENS_DIR = '../tokenizer-lemmatizer/tokens'
 LEMMAS_DIR = '../tokenizer-lemmatizer/lemmas'
+# Веса всех документов одним файлом (common/artifact_store.py)
+OUTPUT_STORE = 'tfidf.art'
+# Папки для tfidf_tokens_N.txt / tfidf_lemmas_N.txt, которые пишутся только с флагом --text-files
 OUTPUT_TOKEN_DIR = 'tfidf_tokens'
 OUTPUT_LEMMA_DIR = 'tfidf_lemmas'
+# Бинарная матрица TF-IDF по леммам для VectorSearchEngine
+OUTPUT_MATRIX_FILE = 'tfidf_lemmas.bin'
+# Ограничение памяти на сортировку весов для матрицы, байт
+MEMORY_BUDGET = 64 * 1024 * 1024
+# Число шардов для параллельного подсчёта (python main.py --shards N)
+DEFAULT_SHARDS = os.cpu_count() or 1
+# Время этапов подсчёта в формате Prometheus
+METRICS_FILE = 'metrics.prom'
 
-os.makedirs(OUTPUT_TOKEN_DIR, exist_ok=True)
-os.makedirs(OUTPUT_LEMMA_DIR, exist_ok=True)
-
-file_indices = sorted([
-    int(f.split('_')[-1].split('.')[0])
-    for f in os.listdir(PAGES_DIR) if f.startswith('page_')
-])
-N = len(file_indices)
-
-token_dfs = defaultdict(int)
-lemma_dfs = defaultdict(int)
-all_token_counts = {}         # токены по документам
-all_lemma_map = {}            # лемма -> токены по документам
-
-for idx in file_indices:
-    with open(os.path.join(TOKENS_DIR, f'tokens_{idx}.txt'), 'r', encoding='utf-8') as f:
-        tokens = [line.strip() for line in f if line.strip()]
-        counter = Counter(tokens)
-        all_token_counts[idx] = counter
-        unique_tokens = set(counter.keys())
-        for token in unique_tokens:
-            token_dfs[token] += 1
-
-# Чтение всех лемм и формирование отображения: лемма -> токены (и df)
-lemma_token_map_all_docs = {}
-lemma_token_presence = defaultdict(set)
-
-for idx in file_indices:
-    lemma_map = defaultdict(list)
-    with open(os.path.join(LEMMAS_DIR, f'lemmas_{idx}.txt'), 'r', encoding='utf-8') as f:
-        for line in f:
-            parts = line.strip().split()
-            if not parts:
-                continue
-            lemma, tokens = parts[0], parts[1:]
-            lemma_map[lemma].extend(tokens)
-            if any(t in all_token_counts[idx] for t in tokens):
-                lemma_token_presence[lemma].add(idx)
-    all_lemma_map[idx] = lemma_map
 
-# Подсчет tf-idf для токенов и сохранение
-for idx in file_indices:
-    token_tf_idf_lines = []
-    total_terms = sum(all_token_counts[idx].values())
-    for token, count in all_token_counts[idx].items():
-        tf = count / total_terms
-        idf = math.log(N / token_dfs[token])
-        tfidf = tf * idf
-        token_tf_idf_lines.append(f"{token} {idf:.6f} {tfidf:.6f}\n")
+def main():
+    file_indices = sorted([
+        int(f.split('_')[-1].split('.')[0])
+        for f in os.listdir(PAGES_DIR) if f.startswith('page_')
+    ])
+    store_filename = TOKENS_STORE if os.path.exists(TOKENS_STORE) else None
+    if store_filename is not None:
+        # Страницы, которые токенизатор не смог обработать, в хранилище не попадают
+        with ArtifactStore(store_filename) as store:
+            tokens = store.table("tokens")
+            file_indices = [idx for idx in file_indices if idx in tokens]
+    text_files = "--text-files" in sys.argv
+    output_token_dir = OUTPUT_TOKEN_DIR if text_files else None
+    output_lemma_dir = OUTPUT_LEMMA_DIR if text_files else None
 
-    with open(os.path.join(OUTPUT_TOKEN_DIR, f'tfidf_tokens_{idx}.txt'), 'w', encoding='utf-8') as f:
-        f.writelines(token_tf_idf_lines)
+    if "--shards" in sys.argv:
+        position = sys.argv.index("--shards")
+        shard_count = int(sys.argv[position + 1]) if len(sys.argv) > position + 1 else DEFAULT_SHARDS
+        with batch_span("tfidf_sharded", len(file_indices)):
+            matrices = build_sharded(TOKENS_DIR, LEMMAS_DIR, file_indices, shard_count,
+                                     output_token_dir, output_lemma_dir, OUTPUT_MATRIX_FILE, MEMORY_BUDGET,
+                                     store_filename=store_filename, output_store=OUTPUT_STORE)
+        REGISTRY.write_textfile(METRICS_FILE)
+        print(f"TF-IDF посчитан для {len(file_indices)} документов в {len(matrices)} шардах")
+        return
 
-# Подсчет tf-idf для лемм и сохранение
-for idx in file_indices:
-    lemma_tf_idf_lines = []
-    token_counts = all_token_counts[idx]
-    total_terms = sum(token_counts.values())
+    builder = TfidfBuilder(TOKENS_DIR, LEMMAS_DIR, memory_budget=MEMORY_BUDGET, store_filename=store_filename)
+    with batch_span("tfidf_document_frequencies", len(file_indices)):
+        builder.compute_document_frequencies(file_indices)
+    with batch_span("tfidf_write", len(file_indices)):
+        builder.write(output_token_dir, output_lemma_dir, OUTPUT_MATRIX_FILE, OUTPUT_STORE)
+    REGISTRY.write_textfile(METRICS_FILE)
+    print(f"TF-IDF посчитан для {len(file_indices)} документов")
 
-    for lemma, tokens in all_lemma_map[idx].items():
-        count = sum(token_counts[t] for t in tokens if t in token_counts)
-        if count == 0:
-            continue
-        tf = count / total_terms
-        idf = math.log(N / len(lemma_token_presence[lemma]))
-        tfidf = tf * idf
-        lemma_tf_idf_lines.append(f"{lemma} {idf:.6f} {tfidf:.6f}\n")
 
-    with open(os.path.join(OUTPUT_LEMMA_DIR, f'tfidf_lemmas_{idx}.txt'), 'w', encoding='utf-8') as f:
-        f.writelines(lemma_tf_idf_lines)
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import math
+import os
+import sys
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.artifact_store import TFIDF_TABLES, ArtifactStore, ArtifactWriter
+from common.shards import shard_filename, split_by_shard
+from common.tfidf_matrix import ExternalSorter, write_tfidf_matrix
+
+
+class TfidfBuilder:
+    """
+    Потоковый подсчёт TF-IDF по токенам и леммам.
+
+    Первый проход (compute_document_frequencies) по одному документу читает
+    хранилище токенизатора store_filename (tokens.art, common/artifact_store.py) или,
+    если его нет, tokens_N.txt и lemmas_N.txt и накапливает только частоты документов (DF).
+    Второй проход (write) снова читает документы по одному и сразу выгружает
+    их веса: в хранилище tfidf.art, в текстовые файлы tfidf_tokens_N.txt /
+    tfidf_lemmas_N.txt и в бинарную матрицу по леммам (common/tfidf_matrix.py). Для матрицы тройки
+    (термин, документ, вес) сортируются по термину с ограничением памяти
+    memory_budget байт - излишек сбрасывается во временные файлы.
+    В памяти одновременно находятся только DF словаря и один документ.
+
+    Для шардированной сборки (build_sharded) DF считаются по шардам параллельно,
+    суммируются и передаются каждому шарду через set_document_frequencies:
+    IDF глобальный, поэтому веса в шардах совпадают с нешардированными.
+    """
+
+    def __init__(self, tokens_dir, lemmas_dir, memory_budget=64 * 1024 * 1024, store_filename=None):
+        self.tokens_dir = tokens_dir
+        self.lemmas_dir = lemmas_dir
+        self.memory_budget = memory_budget
+        self.store = ArtifactStore(store_filename) if store_filename else None
+        if self.store is not None:
+            # Оба прохода читают все документы, поэтому словарь декодируется сразу целиком
+            self.store.vocabulary()
+        self.doc_ids = []
+        self.doc_count = 0
+        self.token_dfs = defaultdict(int)
+        self.lemma_dfs = defaultdict(int)
+        self.matrix_lemmas = None
+
+    def read_document(self, idx):
+        """
+        Возвращает (счётчик токенов, {лемма: токены}) документа. Счётчик - число вхождений
+        токена в текст (колонка count хранилища или повторы строк tokens_N.txt).
+        """
+        if self.store is not None:
+            tokens = self.store.table("tokens").document(idx)
+            token_counts = Counter(dict(zip(tokens["token"], tokens["count"])))
+            lemma_map = defaultdict(list)
+            lemmas = self.store.table("lemmas").document(idx)
+            for lemma, token in zip(lemmas["lemma"], lemmas["token"]):
+                lemma_map[lemma].append(token)
+            return token_counts, lemma_map
+
+        with open(os.path.join(self.tokens_dir, f'tokens_{idx}.txt'), 'r', encoding='utf-8') as f:
+            token_counts = Counter(line.strip() for line in f if line.strip())
+
+        lemma_map = defaultdict(list)
+        with open(os.path.join(self.lemmas_dir, f'lemmas_{idx}.txt'), 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.strip().split()
+                if not parts:
+                    continue
+                lemma_map[parts[0]].extend(parts[1:])
+        return token_counts, lemma_map
+
+    def compute_document_frequencies(self, doc_ids):
+        self.doc_ids = list(doc_ids)
+        self.doc_count = len(self.doc_ids)
+        self.matrix_lemmas = None
+        self.token_dfs.clear()
+        self.lemma_dfs.clear()
+        for idx in self.doc_ids:
+            token_counts, lemma_map = self.read_document(idx)
+            for token in token_counts:
+                self.token_dfs[token] += 1
+            for lemma, tokens in lemma_map.items():
+                if any(t in token_counts for t in tokens):
+                    self.lemma_dfs[lemma] += 1
+
+    def set_document_frequencies(self, doc_ids, doc_count, token_dfs, lemma_dfs, matrix_lemmas=None):
+        """
+        Задаёт DF, посчитанные по всему корпусу из doc_count документов, для записи
+        документов doc_ids (шарда). matrix_lemmas - леммы, встречающиеся в doc_ids
+        (только они попадают в матрицу шарда).
+        """
+        self.doc_ids = list(doc_ids)
+        self.doc_count = doc_count
+        self.token_dfs = defaultdict(int, token_dfs)
+        self.lemma_dfs = defaultdict(int, lemma_dfs)
+        self.matrix_lemmas = matrix_lemmas
+
+    def document_weights(self, token_counts, lemma_map):
+        """
+        Возвращает списки (термин, idf, tf-idf) по токенам и по леммам документа.
+        """
+        n = self.doc_count
+        total_terms = sum(token_counts.values())
+
+        token_weights = []
+        for token, count in token_counts.items():
+            tf = count / total_terms
+            idf = math.log(n / self.token_dfs[token])
+            token_weights.append((token, idf, tf * idf))
+
+        lemma_weights = []
+        for lemma, tokens in lemma_map.items():
+            count = sum(token_counts[t] for t in tokens if t in token_counts)
+            if count == 0:
+                continue
+            tf = count / total_terms
+            idf = math.log(n / self.lemma_dfs[lemma])
+            lemma_weights.append((lemma, idf, tf * idf))
+        return token_weights, lemma_weights
+
+    def write(self, output_token_dir=None, output_lemma_dir=None, matrix_filename=None, output_store=None):
+        """
+        Второй проход: выгружает веса документов. Любой из выходов можно отключить (None).
+        """
+        writer = ArtifactWriter(output_store, TFIDF_TABLES) if output_store else None
+        if output_token_dir:
+            os.makedirs(output_token_dir, exist_ok=True)
+        if output_lemma_dir:
+            os.makedirs(output_lemma_dir, exist_ok=True)
+
+        lemmas = sorted(self.matrix_lemmas if self.matrix_lemmas is not None else self.lemma_dfs)
+        lemma_ids = {lemma: term_id for term_id, lemma in enumerate(lemmas)}
+        sorter = ExternalSorter(self.memory_budget) if matrix_filename else None
+        doc_norms = {}
+
+        for idx in self.doc_ids:
+            token_weights, lemma_weights = self.document_weights(*self.read_document(idx))
+
+            if writer is not None:
+                for table, weights in (("tfidf_tokens", token_weights), ("tfidf_lemmas", lemma_weights)):
+                    writer.add(table, idx, {"term": [term for term, _, _ in weights],
+                                            "idf": [idf for _, idf, _ in weights],
+                                            "weight": [tfidf for _, _, tfidf in weights]})
+            if output_token_dir:
+                with open(os.path.join(output_token_dir, f'tfidf_tokens_{idx}.txt'), 'w', encoding='utf-8') as f:
+                    f.writelines(f"{token} {idf:.6f} {tfidf:.6f}\n" for token, idf, tfidf in token_weights)
+            if output_lemma_dir:
+                with open(os.path.join(output_lemma_dir, f'tfidf_lemmas_{idx}.txt'), 'w', encoding='utf-8') as f:
+                    f.writelines(f"{lemma} {idf:.6f} {tfidf:.6f}\n" for lemma, idf, tfidf in lemma_weights)
+            if sorter is not None:
+                doc_norms[idx] = math.sqrt(sum(tfidf ** 2 for _, _, tfidf in lemma_weights))
+                for lemma, _, tfidf in lemma_weights:
+                    sorter.add(lemma_ids[lemma], idx, tfidf)
+
+        if writer is not None:
+            writer.close()
+        if sorter is not None:
+            n = self.doc_count
+            idf = [math.log(n / self.lemma_dfs[lemma]) for lemma in lemmas]
+            write_tfidf_matrix(matrix_filename, lemmas, idf, doc_norms, sorter.sorted_records())
+
+
+def shard_document_frequencies(tokens_dir, lemmas_dir, doc_ids, store_filename=None):
+    """
+    DF токенов и лемм по документам одного шарда (выполняется в процессе пула).
+    """
+    builder = TfidfBuilder(tokens_dir, lemmas_dir, store_filename=store_filename)
+    builder.compute_document_frequencies(doc_ids)
+    return dict(builder.token_dfs), dict(builder.lemma_dfs)
+
+
+def write_shard(tokens_dir, lemmas_dir, memory_budget, doc_ids, doc_count, token_dfs, lemma_dfs,
+                matrix_lemmas, output_token_dir, output_lemma_dir, matrix_filename,
+                store_filename=None, output_store=None):
+    """
+    Записывает веса документов шарда с глобальными DF (выполняется в процессе пула).
+    """
+    builder = TfidfBuilder(tokens_dir, lemmas_dir, memory_budget=memory_budget, store_filename=store_filename)
+    builder.set_document_frequencies(doc_ids, doc_count, token_dfs, lemma_dfs, matrix_lemmas)
+    builder.write(output_token_dir, output_lemma_dir, matrix_filename, output_store)
+    return matrix_filename
+
+
+def build_sharded(tokens_dir, lemmas_dir, doc_ids, shard_count, output_token_dir=None, output_lemma_dir=None,
+                  matrix_filename=None, memory_budget=64 * 1024 * 1024, workers=None,
+                  store_filename=None, output_store=None):
+    """
+    Параллельный подсчёт TF-IDF по shard_count шардам (документ doc_id в шарде doc_id % shard_count).
+    Первый проход считает DF шардов, они суммируются в глобальные; второй проход
+    записывает веса документов и отдельную матрицу и хранилище каждого шарда
+    (tfidf_lemmas.shard0-of-N.bin, tfidf.shard0-of-N.art, ...). Возвращает пути матриц.
+    """
+    shards = split_by_shard(doc_ids, shard_count)
+    doc_count = sum(len(shard) for shard in shards)
+    workers = workers or min(shard_count, os.cpu_count() or 1)
+    shard_budget = max(1, memory_budget // workers)
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        local_dfs = list(executor.map(shard_document_frequencies, [tokens_dir] * shard_count,
+                                      [lemmas_dir] * shard_count, shards, [store_filename] * shard_count))
+        token_dfs = Counter()
+        lemma_dfs = Counter()
+        for shard_token_dfs, shard_lemma_dfs in local_dfs:
+            token_dfs.update(shard_token_dfs)
+            lemma_dfs.update(shard_lemma_dfs)
+
+        futures = []
+        for shard, shard_doc_ids in enumerate(shards):
+            shard_matrix = shard_filename(matrix_filename, shard, shard_count) if matrix_filename else None
+            shard_store = shard_filename(output_store, shard, shard_count) if output_store else None
+            futures.append(executor.submit(
+                write_shard, tokens_dir, lemmas_dir, shard_budget, shard_doc_ids, doc_count,
+                token_dfs, lemma_dfs, sorted(local_dfs[shard][1]),
+                output_token_dir, output_lemma_dir, shard_matrix, store_filename, shard_store))
+        return [future.result() for future in futures]
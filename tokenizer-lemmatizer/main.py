@@ -1,95 +1,272 @@
+import hashlib
+import json
 import os
 import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
 from bs4 import BeautifulSoup
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
-from nltk.stem import WordNetLemmatizer
-from collections import defaultdict
 
-nltk.download('punkt')
-nltk.download('stopwords')
-nltk.download('wordnet')
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.analyzer import ANALYZER_VERSION, Analyzer
+from common.artifact_store import TOKEN_TABLES, ArtifactStore, ArtifactWriter
+from common.lemma_cache import LemmaCache, local_lemmatizer
+from common.metrics import REGISTRY, record_batch
 
 INPUT_DIR = '../crawler/downloaded_pages'
+# Текст страниц, уже извлечённый краулером; если файла нет, текст извлекается из HTML
+TEXTS_DIR = '../crawler/downloaded_texts'
+# Токены и леммы всех страниц в одном файле (common/artifact_store.py)
+STORE_FILE = 'tokens.art'
+# Папки для tokens_N.txt / lemmas_N.txt, которые пишутся только с флагом --text-files
 TOKENS_DIR = 'tokens'
 LEMMAS_DIR = 'lemmas'
+# Хэши содержимого уже обработанных страниц: {номер страницы: sha1}
+MANIFEST_FILE = 'manifest.json'
+WORKERS = os.cpu_count() or 1
+# Метрики обработки (время на страницу) в формате Prometheus
+METRICS_FILE = 'metrics.prom'
 
-# Создаем выходные директории
-os.makedirs(TOKENS_DIR, exist_ok=True)
-os.makedirs(LEMMAS_DIR, exist_ok=True)
+page_pattern = re.compile(r'^page_(\d+)\.txt$')
 
-lemmatizer = WordNetLemmatizer()
-stop_words = set(stopwords.words('english'))
-token_pattern = re.compile(r'^[a-zA-Z]{2,}$')
+# Создаются один раз в каждом процессе-обработчике (init_worker): общий с поиском
+# анализатор (common/analyzer.py) и его кэш лемм (common/lemma_cache.py)
+lemmatizer = None
+analyzer = None
+
+
+def init_worker():
+    global lemmatizer, analyzer
+    lemmatizer = LemmaCache(lemmatizer=local_lemmatizer(quiet=True))
+    analyzer = Analyzer(lemma_cache=lemmatizer)
 
 
 def process_text(text):
-    tokens = word_tokenize(text.lower())
-    filtered_tokens = set()
+    return analyzer.analyze_document(text)
 
-    for token in tokens:
-        if token_pattern.fullmatch(token) and token not in stop_words:
-            sub_tokens = re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?=[A-Z]|$)', token)
-            for sub_token in sub_tokens:
-                if len(sub_token) >= 3:
-                    filtered_tokens.add(sub_token)
 
-    lemma_map = defaultdict(set)
-    for token in filtered_tokens:
-        lemma = lemmatizer.lemmatize(token)
-        lemma_map[lemma].add(token)
+def page_text_path(file_path):
+    return os.path.join(TEXTS_DIR, os.path.basename(file_path))
 
-    return filtered_tokens, lemma_map
 
+def read_page_text(file_path):
+    text_path = page_text_path(file_path)
+    if os.path.exists(text_path):
+        with open(text_path, 'r', encoding='utf-8', errors='ignore') as f:
+            return f.read()
 
-def process_page(file_path, page_num):
     with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
         html_content = f.read()
 
     soup = BeautifulSoup(html_content, 'html.parser')
-    text = soup.get_text(separator=' ', strip=True)
+    return soup.get_text(separator=' ', strip=True)
+
+
+def process_page(file_path, page_num, text_files=False):
+    """
+    Возвращает колонки страницы для таблиц tokens, lemmas и sequence хранилища.
+    """
+    text = read_page_text(file_path)
+
+    token_counts, lemmas, sequence = process_text(text)
+    tokens = sorted(token_counts)
+    pairs = [(lemma, token) for lemma, token_list in sorted(lemmas.items()) for token in sorted(token_list)]
+
+    if text_files:
+        tokens_file = os.path.join(TOKENS_DIR, f'tokens_{page_num}.txt')
+        # токен повторяется столько раз, сколько встречается на странице: по этим строкам TF-IDF считает частоты
+        with open(tokens_file, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(token for token in tokens for _ in range(token_counts[token])))
+
+        lemmas_file = os.path.join(LEMMAS_DIR, f'lemmas_{page_num}.txt')
+        with open(lemmas_file, 'w', encoding='utf-8') as f:
+            for lemma, token_list in sorted(lemmas.items()):
+                f.write(f"{lemma} {' '.join(sorted(token_list))}\n")
+
+    return ({"token": tokens, "count": [token_counts[token] for token in tokens]},
+            {"lemma": [lemma for lemma, _ in pairs], "token": [token for _, token in pairs]},
+            {"lemma": sequence},
+            len(lemmas))
+
+
+def find_pages(input_dir):
+    """
+    Возвращает {номер страницы: путь} для всех page_N.txt в папке.
+    """
+    pages = {}
+    for filename in os.listdir(input_dir):
+        match = page_pattern.match(filename)
+        if match:
+            pages[int(match.group(1))] = os.path.join(input_dir, filename)
+    return pages
+
+
+def content_hash(file_path):
+    # В хэш входит версия анализатора, чтобы смена правил разбора переобработала все страницы,
+    # и текст из TEXTS_DIR, если он есть: токенизатор читает его, а не HTML, и изменённый
+    # текст при том же HTML не должен считаться уже обработанным
+    digest = hashlib.sha1(f"analyzer-{ANALYZER_VERSION}\n".encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read())
+    text_path = page_text_path(file_path)
+    if os.path.exists(text_path):
+        digest.update(b"\0text\0")
+        with open(text_path, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def load_manifest():
+    if not os.path.exists(MANIFEST_FILE):
+        return {}
+    with open(MANIFEST_FILE, 'r', encoding='utf-8') as f:
+        return {int(page_num): digest for page_num, digest in json.load(f).items()}
 
-    tokens, lemmas = process_text(text)
 
-    tokens_file = os.path.join(TOKENS_DIR, f'tokens_{page_num}.txt')
-    with open(tokens_file, 'w', encoding='utf-8') as f:
-        f.write('\n'.join(sorted(tokens)))
+def save_manifest(manifest):
+    tmp_file = MANIFEST_FILE + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({str(page_num): manifest[page_num] for page_num in sorted(manifest)}, f, indent=1)
+    os.replace(tmp_file, MANIFEST_FILE)
 
-    lemmas_file = os.path.join(LEMMAS_DIR, f'lemmas_{page_num}.txt')
-    with open(lemmas_file, 'w', encoding='utf-8') as f:
-        for lemma, token_list in sorted(lemmas.items()):
-            f.write(f"{lemma} {' '.join(sorted(token_list))}\n")
 
-    return len(tokens), len(lemmas)
+def outputs_exist(page_num, store, text_files=False):
+    if store is None or any(page_num not in store.table(table) for table in TOKEN_TABLES):
+        return False
+    return not text_files or (os.path.exists(os.path.join(TOKENS_DIR, f'tokens_{page_num}.txt')) and
+                              os.path.exists(os.path.join(LEMMAS_DIR, f'lemmas_{page_num}.txt')))
+
+
+def open_store():
+    if not os.path.exists(STORE_FILE):
+        return None
+    try:
+        store = ArtifactStore(STORE_FILE)
+    except ValueError as e:
+        print(f"Хранилище {STORE_FILE} не прочитано, страницы будут обработаны заново: {e}")
+        return None
+    if not store.has_tables(TOKEN_TABLES):
+        print(f"Хранилище {STORE_FILE} записано прежней версией, страницы будут обработаны заново")
+        store.close()
+        return None
+    return store
+
+
+def remove_outputs(page_num):
+    for file_path in (os.path.join(TOKENS_DIR, f'tokens_{page_num}.txt'),
+                      os.path.join(LEMMAS_DIR, f'lemmas_{page_num}.txt')):
+        if os.path.exists(file_path):
+            os.remove(file_path)
+
+
+def process_page_safe(task):
+    """
+    Обрабатывает страницу в процессе-обработчике. Кроме результата возвращает
+    новые леммы, счётчики кэша и время обработки, чтобы собрать их в основном процессе.
+    """
+    page_num, file_path, text_files = task
+    hits, misses = lemmatizer.hits, lemmatizer.misses
+    started = time.perf_counter()
+    try:
+        tokens, lemmas, sequence, lemmas_count = process_page(file_path, page_num, text_files)
+        error = None
+    except Exception as e:
+        tokens, lemmas, sequence, lemmas_count, error = None, None, None, 0, str(e)
+    cache_delta = (lemmatizer.pop_new_entries(), lemmatizer.hits - hits, lemmatizer.misses - misses)
+    return page_num, tokens, lemmas, sequence, lemmas_count, error, cache_delta, time.perf_counter() - started
 
 
 def main():
+    force = '--force' in sys.argv[1:]
+    text_files = '--text-files' in sys.argv[1:]
+
+    # Основной процесс только собирает леммы обработчиков; без WordNet он их не сохранит
+    lemma_cache = LemmaCache(lemmatizer=local_lemmatizer())
+
+    if text_files:
+        os.makedirs(TOKENS_DIR, exist_ok=True)
+        os.makedirs(LEMMAS_DIR, exist_ok=True)
+
     print("Начало обработки страниц...")
 
+    pages = find_pages(INPUT_DIR)
+    manifest = {} if force else load_manifest()
+
+    # Страницы, удалённые из папки краулера, убираем и из результатов
+    for page_num in sorted(set(manifest) - set(pages)):
+        remove_outputs(page_num)
+        del manifest[page_num]
+
+    old_store = None if force else open_store()
+    hashes = {}
+    tasks = []
+    unchanged = []
+    for page_num in sorted(pages):
+        digest = content_hash(pages[page_num])
+        hashes[page_num] = digest
+        if manifest.get(page_num) == digest and outputs_exist(page_num, old_store, text_files):
+            unchanged.append(page_num)
+            continue
+        tasks.append((page_num, pages[page_num], text_files))
+
     total_pages = 0
     total_tokens = 0
     total_lemmas = 0
 
-    for i in range(1, 201):
-        filename = f'page_{i}.txt'
-        file_path = os.path.join(INPUT_DIR, filename)
-        try:
-            tokens_count, lemmas_count = process_page(file_path, i)
-            total_pages += 1
-            total_tokens += tokens_count
-            total_lemmas += lemmas_count
-            print(f"Обработана страница {i}: {tokens_count} токенов, {lemmas_count} лемм")
-        except Exception as e:
-            print(f"Ошибка при обработке {filename}: {str(e)}")
+    # Новое хранилище собирается целиком: строки неизменённых страниц копируются из старого
+    # байтами колонок (словарь продолжает словарь старого файла, id терминов не меняются),
+    # остальные приходят от обработчиков; старый файл заменяется только в конце.
+    # Термины исчезнувших страниц остаются в словаре до полной переобработки (--force)
+    writer = ArtifactWriter(STORE_FILE, TOKEN_TABLES, base=old_store if unchanged else None)
+    for page_num in unchanged:
+        for table in TOKEN_TABLES:
+            writer.copy(table, page_num)
+
+    if tasks:
+        chunksize = max(1, len(tasks) // (WORKERS * 4))
+        with ProcessPoolExecutor(max_workers=WORKERS, initializer=init_worker) as executor:
+            for page_num, tokens, lemmas, sequence, lemmas_count, error, cache_delta, seconds in executor.map(
+                    process_page_safe, tasks, chunksize=chunksize):
+                record_batch("tokenize", seconds)
+                new_lemmas, hits, misses = cache_delta
+                lemma_cache.update(new_lemmas)
+                lemma_cache.hits += hits
+                lemma_cache.misses += misses
+                if error is not None:
+                    print(f"Ошибка при обработке page_{page_num}.txt: {error}")
+                    manifest.pop(page_num, None)
+                    continue
+                writer.add("tokens", page_num, tokens)
+                writer.add("lemmas", page_num, lemmas)
+                writer.add("sequence", page_num, sequence)
+                tokens_count = len(tokens["token"])
+                manifest[page_num] = hashes[page_num]
+                total_pages += 1
+                total_tokens += tokens_count
+                total_lemmas += lemmas_count
+                print(f"Обработана страница {page_num}: {tokens_count} токенов, {lemmas_count} лемм")
+
+    writer.close()
+    if old_store is not None:
+        old_store.close()
+    save_manifest(manifest)
+    lemma_cache.save()
+    REGISTRY.write_textfile(METRICS_FILE)
 
     print("\nИтоговая статистика:")
+    print(f"Найдено страниц: {len(pages)}")
     print(f"Обработано страниц: {total_pages}")
+    print(f"Пропущено без изменений: {len(pages) - len(tasks)}")
     print(f"Всего уникальных токенов: {total_tokens}")
     print(f"Всего уникальных лемм: {total_lemmas}")
+    cache_stats = lemma_cache.stats()
+    print(f"Кэш лемм: {cache_stats['size']} слов, попаданий {cache_stats['hits']}, "
+          f"промахов {cache_stats['misses']} ({cache_stats['hit_rate']:.1%})")
     print(f"\nРезультаты сохранены в:")
-    print(f"- Токены: {TOKENS_DIR}/")
-    print(f"- Леммы: {LEMMAS_DIR}/")
+    print(f"- Токены, леммы и позиции лемм: {STORE_FILE}")
+    if text_files:
+        print(f"- Токены: {TOKENS_DIR}/")
+        print(f"- Леммы: {LEMMAS_DIR}/")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,72 @@
+import random
+import sys
+import time
+
+from search import VectorSearchEngine
+
+# Сравнение полного подсчёта (backend="sparse") и WAND на многословных запросах:
+# совпадение результатов, число полностью оценённых документов и задержка.
+
+
+def make_queries(engine, count, terms_per_query, seed=0):
+    """
+    Векторы запросов из случайных терминов словаря (вес - IDF термина).
+    """
+    rng = random.Random(seed)
+    terms = sorted(engine.idf)
+    queries = []
+    for _ in range(count):
+        chosen = rng.sample(terms, terms_per_query)
+        queries.append({term: engine.idf[term] / terms_per_query for term in chosen})
+    return queries
+
+
+def run(engine, queries, top_n):
+    scorer = engine.scorer
+    candidates = 0
+    stats = {}
+    exhaustive_time = 0.0
+    wand_time = 0.0
+    for query_vector in queries:
+        candidates += len(scorer.accumulate(query_vector))
+
+        start = time.perf_counter()
+        expected = scorer.score(query_vector, top_n)
+        exhaustive_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        actual = scorer.score_wand(query_vector, top_n, stats)
+        wand_time += time.perf_counter() - start
+
+        if actual != expected:
+            raise AssertionError(f"Результаты WAND расходятся с полным подсчётом: {query_vector}")
+
+    evaluated = stats.get("evaluated", 0)
+    return {
+        "queries": len(queries),
+        "candidates": candidates,
+        "evaluated": evaluated,
+        "skipped": candidates - evaluated,
+        "exhaustive_ms": exhaustive_time / len(queries) * 1000,
+        "wand_ms": wand_time / len(queries) * 1000,
+    }
+
+
+def main():
+    top_n = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+    engine = VectorSearchEngine(
+        pages_dir="../crawler/downloaded_pages",
+        tfidf_dir="../tf-idf/tfidf_lemmas",
+        tfidf_store="../tf-idf/tfidf.art"
+    )
+    for terms_per_query in (2, 4, 8):
+        result = run(engine, make_queries(engine, 500, terms_per_query), top_n)
+        print(f"Терминов в запросе: {terms_per_query}, top-{top_n}")
+        print(f"  документов-кандидатов: {result['candidates']}, "
+              f"оценено: {result['evaluated']}, пропущено: {result['skipped']}")
+        print(f"  полный подсчёт: {result['exhaustive_ms']:.3f} мс/запрос, "
+              f"WAND: {result['wand_ms']:.3f} мс/запрос")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import heapq
+import math
+import os
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import repeat
+from operator import add, mul, neg, truediv
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.metrics import span
+
+# Разреженная матрица TF-IDF в виде "термин -> постинги" (CSC по терминам):
+# для каждого термина - отсортированные id документов и веса в них.
+# Нормы документов считаются один раз при загрузке, поэтому при запросе
+# обходятся только постинги терминов запроса, а не все документы корпуса.
+#
+# score_wand дополнительно использует верхние оценки вклада каждого термина
+# (максимум weight / norm по его постингам, считается при загрузке) и
+# алгоритм WAND: документ считается полностью, только если сумма оценок
+# его терминов может превысить порог текущего top-N.
+#
+# При равенстве сходства выше стоит документ с меньшим id.
+
+# Запас на погрешность округления при сравнении верхней оценки с порогом.
+BOUND_EPSILON = 1e-9
+# Первый блок постингов, который score_many берёт из каждого термина запроса
+PRUNING_BLOCK = 64
+
+
+def _rank_key(item):
+    return item[1], -item[0]
+
+
+def merge_top(results, top_n=10):
+    """
+    Сливает top-N списки (doc_id, сходство) нескольких шардов в общий top-N.
+    """
+    return heapq.nlargest(top_n, (item for result in results for item in result), key=_rank_key)
+
+
+class SparseScorer:
+
+    def __init__(self, doc_vectors):
+        postings = {}
+        self.doc_norms = {}
+        self.max_weights = {}
+        for doc_id in sorted(doc_vectors):
+            vector = doc_vectors[doc_id]
+            norm = math.sqrt(sum(v ** 2 for v in vector.values()))
+            self.doc_norms[doc_id] = norm
+            for term, weight in vector.items():
+                doc_ids, weights = postings.setdefault(term, (array("I"), array("d")))
+                doc_ids.append(doc_id)
+                weights.append(weight)
+                if norm:
+                    self.max_weights[term] = max(self.max_weights.get(term, 0.0), weight / norm)
+        self.postings = postings
+
+    @classmethod
+    def from_matrix(cls, matrix):
+        """
+        Строит scorer поверх бинарной матрицы TF-IDF (common/tfidf_matrix.py):
+        постинги - memoryview на файл, верхние оценки взяты из файла.
+        """
+        scorer = cls.__new__(cls)
+        scorer.postings = {}
+        scorer.max_weights = {}
+        for term, _idf, max_weight, doc_ids, weights in matrix.terms():
+            scorer.postings[term] = (doc_ids, weights)
+            scorer.max_weights[term] = max_weight
+        scorer.doc_norms = dict(zip(matrix.doc_ids, matrix.doc_norms))
+        return scorer
+
+    def accumulate(self, query_vector):
+        """
+        Поочерёдно по терминам запроса накапливает скалярные произведения
+        для документов, содержащих эти термины.
+        """
+        accumulators = {}
+        for term, query_weight in query_vector.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            doc_ids, weights = entry
+            for doc_id, weight in zip(doc_ids, weights):
+                accumulators[doc_id] = accumulators.get(doc_id, 0.0) + query_weight * weight
+        return accumulators
+
+    def score(self, query_vector, top_n=10):
+        """
+        Возвращает top_n пар (doc_id, косинусное сходство) по убыванию сходства.
+        """
+        query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+        if not query_norm:
+            return []
+
+        with span("accumulate"):
+            accumulators = self.accumulate(query_vector)
+        with span("normalize"):
+            scores = []
+            for doc_id, dot in accumulators.items():
+                doc_norm = self.doc_norms[doc_id]
+                if not doc_norm:
+                    continue
+                score = dot / (query_norm * doc_norm)
+                if score > 0:
+                    scores.append((doc_id, score))
+        with span("top_n"):
+            return heapq.nlargest(top_n, scores, key=_rank_key)
+
+    def score_many(self, query_vectors, top_n=10):
+        """
+        score для пачки запросов. Постинги каждого термина пачки один раз упорядочиваются
+        по убыванию вклада weight / norm (_impact_order) и дальше используются всеми
+        запросами пачки с этим термином, а запрос оценивается с ранней остановкой
+        (_score_pruned). Сложение вкладов, нормировка и сортировка идут через
+        map/zip/sorted по спискам документов, без цикла Python на каждый документ.
+        Возвращает списки top_n пар (doc_id, сходство) в порядке запросов;
+        результаты совпадают с score.
+        """
+        doc_norms = self._batch_doc_norms()
+        orders = {}
+        for query_vector in query_vectors:
+            for term in query_vector:
+                if term not in orders:
+                    orders[term] = self._impact_order(term, doc_norms)
+        return [self._score_pruned(query_vector, top_n, orders, doc_norms) for query_vector in query_vectors]
+
+    def _impact_order(self, term, doc_norms):
+        """
+        (словарь doc_id -> вес, вклады weight / norm по убыванию, doc_id в том же порядке) или None.
+        """
+        entry = self.postings.get(term)
+        if entry is None:
+            return None
+        doc_ids, weights = entry
+        impacts = list(map(truediv, weights, map(doc_norms.__getitem__, doc_ids)))
+        # сортировка номеров по ключу-числу быстрее сортировки кортежей (вклад, doc_id)
+        order = sorted(range(len(impacts)), key=impacts.__getitem__, reverse=True)
+        return dict(zip(doc_ids, weights)), list(map(impacts.__getitem__, order)), list(map(doc_ids.__getitem__, order))
+
+    def _score_pruned(self, query_vector, top_n, orders, doc_norms):
+        """
+        Алгоритм порога (Fagin): из упорядоченных по вкладу постингов терминов запроса
+        берутся блоки растущего размера, и каждый новый документ оценивается полностью -
+        по всем терминам в том же порядке сложения, что в score. Документ, которого
+        ещё нет ни в одном взятом блоке, наберёт не больше суммы вкладов на границах
+        блоков; когда эта оценка меньше top_n-го сходства, перебор заканчивается.
+        """
+        query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+        if not query_norm or top_n <= 0:
+            return []
+
+        terms = [(query_weight, orders[term]) for term, query_weight in query_vector.items()
+                 if orders[term] is not None]
+        positions = [0] * len(terms)
+        block = max(top_n, PRUNING_BLOCK)
+        scored = []
+        seen = set()
+        threshold = 0.0
+        while True:
+            bound = sum(query_weight * impacts[position]
+                        for (query_weight, (_, impacts, _)), position in zip(terms, positions)
+                        if position < len(impacts)) / query_norm
+            if bound <= 0 or (len(scored) >= top_n and bound * (1 + BOUND_EPSILON) < threshold):
+                break
+
+            new_docs = set()
+            for index, (_, (_, _, ordered_doc_ids)) in enumerate(terms):
+                new_docs.update(ordered_doc_ids[positions[index]:positions[index] + block])
+                positions[index] += block
+            new_docs = list(new_docs - seen)
+            seen.update(new_docs)
+
+            dots = [0.0] * len(new_docs)
+            for query_weight, (weights, _, _) in terms:
+                dots = list(map(add, dots, map(mul, repeat(query_weight), map(weights.get, new_docs, repeat(0.0)))))
+            scores = map(truediv, dots, map(mul, repeat(query_norm), map(doc_norms.__getitem__, new_docs)))
+            scored.extend(zip(scores, map(neg, new_docs)))
+            if len(scored) >= top_n:
+                scored = sorted(scored, reverse=True)[:top_n]
+                threshold = scored[-1][0]
+            block *= 2
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(scored, reverse=True) if score > 0]
+
+    def _batch_doc_norms(self):
+        """
+        Нормы документов для score_many; нулевая норма заменена бесконечностью,
+        чтобы сходство такого документа было 0 и он отбрасывался, как в score.
+        """
+        if getattr(self, "_safe_doc_norms", None) is None:
+            self._safe_doc_norms = {doc_id: norm or math.inf for doc_id, norm in self.doc_norms.items()}
+        return self._safe_doc_norms
+
+    def score_wand(self, query_vector, top_n=10, stats=None):
+        """
+        То же, что score, но документ за документом с отсечением WAND.
+        Результат совпадает с score: сходство полностью оцениваемых документов
+        считается в том же порядке операций. В stats (если передан) пишется
+        число полностью оценённых документов.
+        """
+        query_norm = math.sqrt(sum(v ** 2 for v in query_vector.values()))
+        if not query_norm or top_n <= 0:
+            return []
+
+        # курсор: [текущий doc_id, позиция, doc_ids, weights, верхняя оценка, термин]
+        cursors = []
+        for term, query_weight in query_vector.items():
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            doc_ids, weights = entry
+            upper_bound = query_weight * self.max_weights.get(term, 0.0) / query_norm
+            cursors.append([doc_ids[0], 0, doc_ids, weights, upper_bound, term])
+
+        heap = []
+        threshold = 0.0
+        evaluated = 0
+        while cursors:
+            cursors.sort(key=lambda cursor: cursor[0])
+
+            bound = 0.0
+            pivot = None
+            for position, cursor in enumerate(cursors):
+                bound += cursor[4]
+                if bound * (1 + BOUND_EPSILON) > threshold:
+                    pivot = position
+                    break
+            if pivot is None:
+                break
+            pivot_doc = cursors[pivot][0]
+
+            if cursors[0][0] == pivot_doc:
+                contributions = {}
+                for cursor in cursors:
+                    if cursor[0] != pivot_doc:
+                        break
+                    contributions[cursor[5]] = cursor[3][cursor[1]]
+                    self._advance(cursor, pivot_doc + 1)
+                evaluated += 1
+
+                dot = 0.0
+                for term, query_weight in query_vector.items():
+                    if term in contributions:
+                        dot = dot + query_weight * contributions[term]
+                doc_norm = self.doc_norms[pivot_doc]
+                score = dot / (query_norm * doc_norm) if doc_norm else 0.0
+                if score > 0:
+                    item = (score, -pivot_doc)
+                    if len(heap) < top_n:
+                        heapq.heappush(heap, item)
+                    elif item > heap[0]:
+                        heapq.heapreplace(heap, item)
+                    if len(heap) == top_n:
+                        threshold = heap[0][0]
+            else:
+                # ни один документ до pivot_doc не наберёт порог - пропускаем их
+                for cursor in cursors[:pivot]:
+                    self._advance(cursor, pivot_doc)
+
+            cursors = [cursor for cursor in cursors if cursor[0] is not None]
+
+        if stats is not None:
+            stats["evaluated"] = stats.get("evaluated", 0) + evaluated
+        return [(-neg_doc_id, score) for score, neg_doc_id in sorted(heap, reverse=True)]
+
+    @staticmethod
+    def _advance(cursor, target):
+        """
+        Переводит курсор на первый документ >= target (None, если список исчерпан).
+        """
+        doc_ids = cursor[2]
+        position = bisect_left(doc_ids, target, cursor[1])
+        cursor[1] = position
+        cursor[0] = doc_ids[position] if position < len(doc_ids) else None
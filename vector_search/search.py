@@ -1,16 +1,94 @@
 import os
 import math
+import sys
 from collections import Counter, defaultdict
 from bs4 import BeautifulSoup
-from nltk import word_tokenize
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from common.analyzer import Analyzer
+from common.artifact_store import ArtifactStore
+from common.batch import DEFAULT_CHUNK_SIZE, run_batches
+from common.lemma_cache import LemmaCache
+from common.metrics import span
+from common.shards import ShardPool
+from common.tfidf_matrix import TfidfMatrix
+
+try:
+    from .scoring import SparseScorer, merge_top
+    from .text_store import TextStore, best_window
+except ImportError:
+    from scoring import SparseScorer, merge_top
+    from text_store import TextStore, best_window
+
+
+def open_matrix_scorer(matrix_filename):
+    """
+    SparseScorer поверх шарда матрицы TF-IDF (открывается в процессе пула ShardPool).
+    """
+    return SparseScorer.from_matrix(TfidfMatrix(matrix_filename))
+
 
 class VectorSearchEngine:
+    """
+    backend="sparse" - полный подсчёт по постингам терминов запроса (scoring.py),
+    backend="wand" - top-N документ за документом с отсечением WAND,
+    выгоден на длинных постингах (см. benchmark_wand.py),
+    backend="dict" - исходный перебор всех документов, оставлен для сверки результатов.
+
+    text_store - путь к хранилищу текстов страниц (text_store.py); если оно задано,
+    сниппеты строятся без разбора HTML.
 
-    def __init__(self, pages_dir, tfidf_dir):
+    tfidf_matrix - путь к бинарной матрице TF-IDF (tf-idf/tfidf_lemmas.bin); если файл есть,
+    веса берутся из него через mmap вместо разбора tfidf_lemmas_N.txt.
+    Словари doc_vectors в этом случае строятся только для backend="dict".
+    Без матрицы веса читаются из хранилища tfidf_store (tf-idf/tfidf.art), а если нет
+    и его - из текстовых файлов в tfidf_dir.
+    Если передан список путей (шарды из tf-idf/main.py --shards N), top-N считается
+    в каждом шарде параллельно (shard_executor: "process", "thread" или "serial",
+    см. common/shards.py), а результаты шардов сливаются. IDF в шардах глобальный,
+    поэтому результаты совпадают с нешардированной матрицей.
+    """
+
+    def __init__(self, pages_dir, tfidf_dir, backend="sparse", text_store=None, lemma_cache=None,
+                 tfidf_matrix=None, shard_executor="process", shard_workers=None, analyzer=None,
+                 tfidf_store=None):
         self.pages_dir = pages_dir
+        self.lemma_cache = lemma_cache if lemma_cache is not None else LemmaCache()
+        # Запрос разбирается тем же анализатором, что и документы при индексации
+        self.analyzer = analyzer if analyzer is not None else Analyzer(lemma_cache=self.lemma_cache)
         self.tfidf_dir = tfidf_dir
-        self.N = len([f for f in os.listdir(tfidf_dir) if f.startswith("tfidf_tokens_")])
-        self.doc_vectors, self.idf = self.load_tfidf_vectors()
+        self.tfidf_store = tfidf_store
+        self.backend = backend
+        # Номер поколения индекса: по нему кэши результатов понимают, что индекс сменился
+        self.generation = 0
+        self.text_store = TextStore(text_store) if text_store and os.path.exists(text_store) else None
+        self.shard_pool = None
+        if isinstance(tfidf_matrix, (list, tuple)):
+            self.matrices = [TfidfMatrix(path) for path in tfidf_matrix]
+            self.matrix = None
+            self.N = sum(matrix.doc_count for matrix in self.matrices)
+            self.idf = {}
+            for matrix in self.matrices:
+                self.idf.update((term, idf) for term, idf, _, _, _ in matrix.terms())
+            self.scorer = None
+            self.shard_pool = ShardPool(tfidf_matrix, open_matrix_scorer, shard_workers, shard_executor)
+            self.doc_vectors = self.matrix_doc_vectors() if backend == "dict" else None
+        elif tfidf_matrix and os.path.exists(tfidf_matrix):
+            self.matrix = TfidfMatrix(tfidf_matrix)
+            self.matrices = [self.matrix]
+            self.N = self.matrix.doc_count
+            self.idf = {term: idf for term, idf, _, _, _ in self.matrix.terms()}
+            self.scorer = SparseScorer.from_matrix(self.matrix)
+            self.doc_vectors = self.matrix_doc_vectors() if backend == "dict" else None
+        else:
+            self.matrix = None
+            self.matrices = []
+            if tfidf_store and os.path.exists(tfidf_store):
+                self.N, self.doc_vectors, self.idf = self.load_store_vectors()
+            else:
+                self.N = len([f for f in os.listdir(tfidf_dir) if f.startswith("tfidf_tokens_")])
+                self.doc_vectors, self.idf = self.load_tfidf_vectors()
+            self.scorer = SparseScorer(self.doc_vectors)
 
 
     def load_tfidf_vectors(self):
@@ -37,9 +115,39 @@ class VectorSearchEngine:
         return doc_vectors, idf
 
 
+    def load_store_vectors(self):
+        """
+        (число документов, векторы документов, IDF) из таблицы tfidf_lemmas хранилища:
+        один файл через mmap вместо tfidf_lemmas_N.txt, строки терминов декодируются один раз.
+        """
+        with ArtifactStore(self.tfidf_store) as store:
+            vocabulary = store.vocabulary()
+            table = store.table("tfidf_lemmas")
+            doc_vectors = {}
+            idf = {}
+            for doc_id in table.doc_ids.tolist():
+                rows = table.rows(doc_id)
+                terms = [vocabulary[term_id] for term_id in rows["term"]]
+                doc_vectors[doc_id] = dict(zip(terms, rows["weight"].tolist()))
+                for term, idf_val in zip(terms, rows["idf"].tolist()):
+                    idf.setdefault(term, idf_val)
+                # срезы mmap должны быть освобождены до закрытия хранилища
+                del rows
+            return len(store.table("tfidf_tokens")), doc_vectors, idf
+
+    def matrix_doc_vectors(self):
+        doc_vectors = {}
+        for matrix in self.matrices:
+            doc_vectors.update((doc_id, {}) for doc_id in matrix.doc_ids)
+            for term, _, _, doc_ids, weights in matrix.terms():
+                for doc_id, weight in zip(doc_ids, weights):
+                    doc_vectors[doc_id][term] = weight
+        return doc_vectors
+
     def query_to_vector(self, query):
-        tokens = word_tokenize(query.lower())
-        terms = [t for t in tokens if t.isalnum()]
+        return self.terms_to_vector(self.analyzer.analyze(query))
+
+    def terms_to_vector(self, terms):
         present_terms = [term for term in terms if term in self.idf]
         tf = Counter(present_terms)
         total = sum(tf.values())
@@ -56,32 +164,28 @@ class VectorSearchEngine:
 
     def get_snippet(self, doc_id, query_terms, max_words=100):
         try:
-            path = os.path.join(self.pages_dir, f"page_{doc_id}.txt")
-            with open(path, 'r', encoding='utf-8') as f:
-                html = f.read()
-            text = BeautifulSoup(html, "html.parser").get_text(" ", strip=True)
-            words = text.split()
-
-            best_score = 0
-            best_snippet = words[:max_words] if words else []
-
-            for i in range(0, len(words) - max_words + 1):
-                window = words[i:i + max_words]
-                window_score = sum(1 for w in window if any(q in w.lower() for q in query_terms))
-                if window_score > best_score:
-                    best_score = window_score
-                    best_snippet = window
-
-            snippet = ' '.join(best_snippet)
+            if self.text_store is not None:
+                with span("snippet_text_store"):
+                    snippet = self.text_store.get_snippet(doc_id, query_terms, max_words)
+                if snippet is not None:
+                    return snippet
+
+            with span("snippet_html"):
+                path = os.path.join(self.pages_dir, f"page_{doc_id}.txt")
+                with open(path, 'r', encoding='utf-8') as f:
+                    html = f.read()
+                text = BeautifulSoup(html, "html.parser").get_text(" ", strip=True)
+                words = text.split()
+                positions = defaultdict(list)
+                for position, word in enumerate(words):
+                    positions[word.lower()].append(position)
+
+                snippet = ' '.join(best_window(words, positions, query_terms, max_words))
             return snippet
         except Exception:
             return ""
 
-    def search(self, query, top_n=10):
-        query_vector = self.query_to_vector(query)
-        if not query_vector:
-            return []
-
+    def score_dict(self, query_vector, top_n=10):
         scores = []
         for doc_id, vec in self.doc_vectors.items():
             if not any(term in vec for term in query_vector):
@@ -91,10 +195,95 @@ class VectorSearchEngine:
                 scores.append((doc_id, score))
 
         scores.sort(key=lambda x: x[1], reverse=True)
-        query_terms = [t.lower() for t in word_tokenize(query) if t.isalnum()]
+        return scores[:top_n]
+
+    def score(self, query_vector, top_n=10):
+        if self.backend == "dict":
+            with span("score_dict"):
+                return self.score_dict(query_vector, top_n)
+        if self.shard_pool is not None:
+            method = "score_wand" if self.backend == "wand" else "score"
+            with span("score_shards"):
+                results = self.shard_pool.scatter(method, query_vector, top_n)
+            with span("merge_shards"):
+                return merge_top(results, top_n)
+        if self.backend == "wand":
+            with span("score_wand"):
+                return self.scorer.score_wand(query_vector, top_n)
+        return self.scorer.score(query_vector, top_n)
+
+    def query_terms(self, query):
+        """
+        Слова запроса для поиска сниппета.
+        """
+        return self.analyzer.tokens(query)
+
+    def rank(self, query, top_n=10):
+        """
+        Top-N пар (doc_id, сходство) без построения сниппетов.
+        """
+        with span("query_to_vector"):
+            query_vector = self.query_to_vector(query)
+        if not query_vector:
+            return []
+        return self.score(query_vector, top_n)
+
+    def warm_up(self):
+        """
+        Загружает ленивые ресурсы (WordNet) заранее - например,
+        до fork рабочих процессов сервера, чтобы они были общими для всех процессов.
+        """
+        self.query_to_vector("warm up")
+
+    def search_many(self, queries, top_n=10, with_snippets=False, chunk_size=DEFAULT_CHUNK_SIZE, workers=None):
+        """
+        Пакетный поиск для прогона журнала запросов (оценка качества, массовое ранжирование).
+        Возвращает для каждого запроса список пар (doc_id, сходство), а с with_snippets -
+        список результатов, как search. Одинаковые запросы выполняются один раз; пачка
+        из chunk_size запросов разбирается analyze_many и оценивается одним проходом
+        по постингам терминов пачки (SparseScorer.score_many), без отрезков на каждый запрос.
+        workers > 1 - пачки выполняются в пуле процессов (common/batch.py); для матриц
+        шардов пул не используется: шарды и так опрашиваются параллельно своим пулом,
+        который нельзя переносить в процессы, созданные fork.
+        """
+        if self.shard_pool is not None:
+            workers = None
+        return run_batches(self, "search_chunk", list(queries), chunk_size, workers, (top_n, with_snippets))
+
+    def search_chunk(self, queries, top_n=10, with_snippets=False):
+        """
+        Одна пачка search_many.
+        """
+        with span("batch_query_to_vector"):
+            query_vectors = [self.terms_to_vector(terms) for terms in self.analyzer.analyze_many(queries)]
+        with span("batch_score"):
+            if self.backend == "dict":
+                rankings = [self.score_dict(query_vector, top_n) if query_vector else []
+                            for query_vector in query_vectors]
+            elif self.shard_pool is not None:
+                shard_results = self.shard_pool.scatter("score_many", query_vectors, top_n)
+                rankings = [merge_top(results, top_n) for results in zip(*shard_results)]
+            else:
+                rankings = self.scorer.score_many(query_vectors, top_n)
+        if not with_snippets:
+            return rankings
+
+        with span("batch_snippets"):
+            results = []
+            for query, ranking in zip(queries, rankings):
+                query_terms = self.query_terms(query)
+                results.append([{"doc_id": doc_id, "score": score, "snippet": self.get_snippet(doc_id, query_terms)}
+                                for doc_id, score in ranking])
+            return results
+
+    def search(self, query, top_n=10):
+        scores = self.rank(query, top_n)
+        if not scores:
+            return []
+        query_terms = self.query_terms(query)
 
         results = []
-        for doc_id, score in scores[:top_n]:
+        for doc_id, score in scores:
             snippet = self.get_snippet(doc_id, query_terms)
             results.append({
                 "doc_id": doc_id,
@@ -108,6 +297,7 @@ class VectorSearchEngine:
         while True:
             query = input("Введите запрос: ").strip()
             if query.lower() == 'exit':
+                self.lemma_cache.save()
                 break
             results = self.search(query)
             if not results:
@@ -122,6 +312,9 @@ class VectorSearchEngine:
 if __name__ == '__main__':
     search_engine = VectorSearchEngine(
         pages_dir="../crawler/downloaded_pages",
-        tfidf_dir="../tf-idf/tfidf_lemmas"
+        tfidf_dir="../tf-idf/tfidf_lemmas",
+        text_store="page_texts.bin",
+        tfidf_matrix="../tf-idf/tfidf_lemmas.bin",
+        tfidf_store="../tf-idf/tfidf.art"
     )
     search_engine.run_console()
@@ -0,0 +1,153 @@
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from bisect import bisect_left
+
+from bs4 import BeautifulSoup
+
+# Хранилище извлечённого текста страниц для сниппетов.
+# HTML разбирается один раз при построении; при поиске текст читается
+# из одного файла через mmap без BeautifulSoup.
+#
+# Формат файла page_texts.bin:
+#   заголовок - MAGIC, версия формата, число документов
+#   таблица   - doc_count записей (doc_id, смещение, длина), по возрастанию doc_id
+#   данные    - для каждого документа zlib-сжатый JSON:
+#               {"words": [слова текста], "positions": {слово в нижнем регистре: [позиции]}}
+MAGIC = b"ITTS"
+FORMAT_VERSION = 1
+
+HEADER = struct.Struct("<4sHHI")
+ENTRY = struct.Struct("<IQI")
+
+
+def extract_text(html):
+    return BeautifulSoup(html, "html.parser").get_text(" ", strip=True)
+
+
+def encode_document(text):
+    words = text.split()
+    positions = {}
+    for position, word in enumerate(words):
+        positions.setdefault(word.lower(), []).append(position)
+    payload = json.dumps({"words": words, "positions": positions}, ensure_ascii=False)
+    return zlib.compress(payload.encode("utf-8"), 6)
+
+
+def write_text_store(texts, store_filename="page_texts.bin"):
+    """
+    Сохраняет тексты документов {doc_id: текст} в хранилище.
+    """
+    entries = []
+    blob = bytearray()
+    for doc_id in sorted(texts):
+        encoded = encode_document(texts[doc_id])
+        entries.append((doc_id, len(blob), len(encoded)))
+        blob += encoded
+
+    data_offset = HEADER.size + ENTRY.size * len(entries)
+    with open(store_filename, "wb") as store_file:
+        store_file.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(entries)))
+        for doc_id, offset, length in entries:
+            store_file.write(ENTRY.pack(doc_id, data_offset + offset, length))
+        store_file.write(blob)
+
+
+def build_text_store(pages_dir, store_filename="page_texts.bin"):
+    """
+    Извлекает текст из всех page_N.txt и сохраняет его в хранилище.
+    """
+    texts = {}
+    for filename in os.listdir(pages_dir):
+        if not filename.startswith("page_"):
+            continue
+        doc_id = int(filename.split("_")[-1].split(".")[0])
+        with open(os.path.join(pages_dir, filename), "r", encoding="utf-8") as f:
+            texts[doc_id] = extract_text(f.read())
+    write_text_store(texts, store_filename)
+    return len(texts)
+
+
+def best_window(words, positions, query_terms, max_words=100):
+    """
+    Окно из max_words слов с наибольшим числом слов, содержащих термины запроса.
+    Слова-совпадения берутся из индекса позиций, окно сдвигается за O(n).
+    """
+    if len(words) <= max_words:
+        return words[:max_words]
+
+    hits = bytearray(len(words))
+    for word, word_positions in positions.items():
+        if any(q in word for q in query_terms):
+            for position in word_positions:
+                hits[position] = 1
+
+    best_score = 0
+    best_start = 0
+    window_score = sum(hits[:max_words])
+    if window_score > best_score:
+        best_score = window_score
+    for start in range(1, len(words) - max_words + 1):
+        window_score += hits[start + max_words - 1] - hits[start - 1]
+        if window_score > best_score:
+            best_score = window_score
+            best_start = start
+    return words[best_start:best_start + max_words]
+
+
+class TextStore:
+
+    def __init__(self, store_filename="page_texts.bin"):
+        self.store_filename = store_filename
+        self._file = open(store_filename, "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, _flags, self.doc_count = HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self.close()
+            raise ValueError(f"Файл {store_filename} не является хранилищем текстов")
+        if version != FORMAT_VERSION:
+            self.close()
+            raise ValueError(f"Неподдерживаемая версия хранилища: {version}")
+        self._doc_ids = [ENTRY.unpack_from(self._mm, HEADER.size + ENTRY.size * i)[0]
+                         for i in range(self.doc_count)]
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+    def __contains__(self, doc_id):
+        position = bisect_left(self._doc_ids, doc_id)
+        return position < self.doc_count and self._doc_ids[position] == doc_id
+
+    def load(self, doc_id):
+        """
+        Возвращает (words, positions) документа или None, если его нет в хранилище.
+        """
+        position = bisect_left(self._doc_ids, doc_id)
+        if position >= self.doc_count or self._doc_ids[position] != doc_id:
+            return None
+        _, offset, length = ENTRY.unpack_from(self._mm, HEADER.size + ENTRY.size * position)
+        document = json.loads(zlib.decompress(self._mm[offset:offset + length]))
+        return document["words"], document["positions"]
+
+    def get_snippet(self, doc_id, query_terms, max_words=100):
+        document = self.load(doc_id)
+        if document is None:
+            return None
+        words, positions = document
+        return ' '.join(best_window(words, positions, query_terms, max_words))
+
+
+def main():
+    pages_dir = sys.argv[1] if len(sys.argv) > 1 else "../crawler/downloaded_pages"
+    store_filename = sys.argv[2] if len(sys.argv) > 2 else "page_texts.bin"
+    doc_count = build_text_store(pages_dir, store_filename)
+    print(f"Сохранено документов: {doc_count}, хранилище: {store_filename}")
+
+
+if __name__ == "__main__":
+    main()